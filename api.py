@@ -1,13 +1,196 @@
 """API that connects to a movie_database"""
 
-from datetime import datetime
-from flask import Flask, jsonify, request
+import os
+import time
+from functools import wraps
+from itertools import islice
+from flask import Flask, Response, g, jsonify, request, stream_with_context, url_for
+from catalogue_snapshot import catalogue_snapshot
+from json_encoding import fragment_cache
+from connection_pool import (get_replicas, pin_to_primary, pool_stats, primary_pinned,
+                             replica_stats, READ_PRIMARY_COOKIE, READ_YOUR_WRITES_SECONDS, WRITE_METHODS)
+from metrics import TimedJSONProvider, render_metrics, REQUESTS, REQUEST_SECONDS
+from recommendations import (similarity_index, parse_similar_limit, DEFAULT_SIMILAR,
+                             MAX_SIMILAR)
+from reference_cache import reference_cache
+from response_cache import response_cache, CachedResponse
+from response_compression import (choose_encoding, compress, compress_chunks,
+                                  COMPRESSIBLE_MIMETYPES, MIN_SIZE)
+from stats_refresher import stats_refresher
 from database_functions import (get_movies, validate_sort_by, validate_sort_order,
                                 add_movie, get_genre, get_movies_by_genre, get_genres,
                                 get_country_key, get_movies_by_country, get_movie_by_id,
-                                delete_movie, validate_data_types, update_movie)
+                                delete_movie, validate_data_types, update_movie,
+                                validate_limit, decode_cursor, split_page,
+                                validate_stream_format, iter_movies, get_sort_key,
+                                iter_movies_by_country, iter_movies_by_genre,
+                                add_movies, get_movies_by_ids, delete_movies, parse_ids,
+                                parse_fields, parse_filters, validate_movie, get_stats,
+                                validate_movie_changes, parse_version, VersionConflictError,
+                                DEFAULT_PAGE_SIZE, MAX_BATCH_SIZE, STATS_VIEWS)
 
 app = Flask(__name__)
+app.json = TimedJSONProvider(app)
+
+# Headers that are part of a cached response rather than generated per request
+CACHED_HEADERS = ["X-Next-Cursor", "Link"]
+
+
+@app.before_request
+def start_timer():
+    """Notes when the request started so its latency can be recorded"""
+    g.request_started = time.perf_counter()
+
+
+@app.before_request
+def route_reads():
+    """Pins writes, and reads from clients that have just written, to the primary"""
+    pin_to_primary(request.method in WRITE_METHODS
+                   or READ_PRIMARY_COOKIE in request.cookies)
+
+
+@app.after_request
+def remember_writes(response: Response) -> Response:
+    """Marks a client that wrote so its next reads see the write despite replica or snapshot lag"""
+    if (request.method in WRITE_METHODS and response.status_code < 400
+            and (get_replicas() is not None or catalogue_snapshot.enabled)):
+        response.set_cookie(READ_PRIMARY_COOKIE, "1", max_age=READ_YOUR_WRITES_SECONDS,
+                            httponly=True)
+    return response
+
+
+@app.after_request
+def record_request(response: Response) -> Response:
+    """Counts the request and records its latency against the route template"""
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUESTS.inc((request.method, route, response.status_code))
+    # Streamed bodies are still being sent, so this is the time to the first byte
+    REQUEST_SECONDS.observe((request.method, route),
+                            time.perf_counter() - g.request_started)
+    return response
+
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """Compresses JSON bodies, streamed ones included, with the client's preferred encoding"""
+    if (response.status_code in (204, 304) or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES or response.direct_passthrough):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, encoding)
+    else:
+        body = response.get_data()
+        if len(body) < MIN_SIZE:
+            return response
+        response.set_data(compress(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def cached(view):
+    """Serves GET requests from the response cache with ETag validators"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Clients reading their own writes must not get a copy built before the write
+        if request.method != "GET" or primary_pinned.get():
+            return view(*args, **kwargs)
+
+        key = (request.path, tuple(sorted(request.args.items(multi=True))),
+               request.headers.get("Accept"))
+        entry = response_cache.get(key)
+
+        if entry is None:
+            generation = response_cache.generation
+            response = app.make_response(view(*args, **kwargs))
+
+            # Errors and streamed listings are always rendered fresh
+            if response.status_code != 200 or response.is_streamed:
+                return response
+
+            entry = CachedResponse(response.get_data(), response.mimetype,
+                                   {name: response.headers[name] for name in CACHED_HEADERS
+                                    if name in response.headers})
+            response_cache.set(key, entry, generation)
+
+        encoding = None
+        if len(entry.body) >= MIN_SIZE and entry.mimetype in COMPRESSIBLE_MIMETYPES:
+            encoding = choose_encoding(request.accept_encodings)
+
+        response = Response(entry.get_body(encoding), mimetype=entry.mimetype,
+                            headers=entry.headers)
+        if encoding:
+            # Each encoding is its own representation, so it needs its own ETag
+            response.headers["Content-Encoding"] = encoding
+            response.set_etag(f"{entry.etag}-{encoding}")
+        else:
+            response.set_etag(entry.etag)
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["Vary"] = "Accept, Accept-Encoding"
+        return response.make_conditional(request)
+
+    return wrapper
+
+
+def page_response(movies: list[dict], next_cursor: str) -> Response:
+    """Returns a page of movies, linking to the next page when there is one"""
+    response = app.json.movies_response(movies)
+
+    if next_cursor:
+        args = request.args.to_dict()
+        args["cursor"] = next_cursor
+        next_url = url_for(request.endpoint, **request.view_args, **args)
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+
+    return response
+
+
+def get_stream_format() -> str:
+    """Gets the streaming format from the stream parameter or the Accept header"""
+    stream_format = request.args.get("stream")
+
+    if not stream_format and request.accept_mimetypes.best_match(
+            ["application/json", "application/x-ndjson"]) == "application/x-ndjson":
+        stream_format = "ndjson"
+
+    return stream_format
+
+
+def stream_response(rows, stream_format: str, limit: int = None) -> Response:
+    """Streams rows as a JSON array or NDJSON, returning None if there are no rows"""
+    source = rows
+    if limit:
+        rows = islice(source, limit)
+
+    # Pull the first row up front so an empty result can still be a 404
+    first = next(rows, None)
+    if first is None:
+        return None
+
+    def generate():
+        try:
+            if stream_format == "ndjson":
+                yield app.json.row_bytes(first) + b"\n"
+                for row in rows:
+                    yield app.json.row_bytes(row) + b"\n"
+            else:
+                yield b"[" + app.json.row_bytes(first)
+                for row in rows:
+                    yield b"," + app.json.row_bytes(row)
+                yield b"]"
+        finally:
+            # Hands the connection back even if the client disconnects early
+            source.close()
+
+    mimetype = "application/x-ndjson" if stream_format == "ndjson" else "application/json"
+    # Keeps the request context so per route metrics still apply while streaming
+    return Response(stream_with_context(generate()), mimetype=mimetype)
 
 
 @app.route("/", methods=["GET"])
@@ -16,14 +199,58 @@ def endpoint_index():
     return jsonify({"message": "Welcome to the Movie API"})
 
 
+@app.route("/health", methods=["GET"])
+def endpoint_health():
+    """Reports database connection pool statistics for monitoring"""
+    return jsonify({"status": "ok", "pool": pool_stats(), "replicas": replica_stats()}), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def endpoint_metrics():
+    """Exposes request, query, pool and cache metrics for Prometheus to scrape"""
+    body = render_metrics({
+        "movies_db_pool": ("Database connection pool", pool_stats()),
+        "movies_db_replicas": ("Read replica routing", replica_stats()),
+        "movies_response_cache": ("Response cache", response_cache.stats()),
+        "movies_catalogue_snapshot": ("Catalogue snapshot", catalogue_snapshot.stats()),
+        "movies_json_fragments": ("Encoded movie fragment cache", fragment_cache.stats()),
+        "movies_similarity_index": ("Similar movies index", similarity_index.stats())
+    })
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/movies", methods=["GET", "POST"])
+@cached
 def endpoint_get_movies():
     """Route returns all movies or adds movie to database"""
     # Adding parameter's to movies route
     if request.method == "GET":
+        ids = request.args.get("ids")
+        fields = request.args.get("fields")
+
+        if fields is not None:
+            fields = parse_fields(fields)
+            if not fields:
+                return jsonify({"error": "Invalid fields parameter"}), 400
+
+        if ids is not None:
+            ids = parse_ids(ids)
+            if not ids:
+                return jsonify({"error": f"Invalid ids parameter, ensure it is a comma separated list of up to {MAX_BATCH_SIZE} movie ids"}), 400
+
+            movies = get_movies_by_ids(ids, fields)
+            if not movies:
+                return {"error": "Movies not found"}, 404
+            return app.json.movies_response(movies), 200
+
         search = request.args.get("search")
         sort_by = request.args.get("sort_by")
         sort_order = request.args.get("sort_order")
+        stream_format = get_stream_format()
+        # Streamed listings cover the whole catalogue unless a limit is given
+        limit = request.args.get(
+            "limit", None if stream_format else DEFAULT_PAGE_SIZE)
+        cursor = request.args.get("cursor")
 
         if not validate_sort_by(sort_by):
             return jsonify({"error": "Invalid sort_by parameter"}), 400
@@ -31,78 +258,157 @@ def endpoint_get_movies():
         if not validate_sort_order(sort_order):
             return jsonify({"error": "Invalid sort_order parameter"}), 400
 
-        movies = get_movies(search, sort_by, sort_order)
+        if not validate_stream_format(stream_format):
+            return jsonify({"error": "Invalid stream parameter"}), 400
+
+        if not validate_limit(limit):
+            return jsonify({"error": "Invalid limit parameter"}), 400
+        limit = int(limit) if limit else None
+
+        filters, error = parse_filters(request.args)
+        if error:
+            return jsonify({"error": error}), 400
+
+        # An unsorted search is ordered, and so paged, by relevance
+        sort_key = get_sort_key(sort_by, search)
+
+        if cursor:
+            cursor = decode_cursor(cursor, sort_key)
+            if not cursor:
+                return jsonify({"error": "Invalid cursor parameter"}), 400
+
+        if stream_format:
+            rows = catalogue_snapshot.iter_movies(search, sort_by, sort_order, cursor=cursor,
+                                                  fields=fields, filters=filters)
+            if rows is None:
+                rows = iter_movies(search, sort_by, sort_order, cursor=cursor,
+                                   fields=fields, filters=filters)
+            response = stream_response(rows, stream_format, limit)
+            if response is None:
+                return {"error": "Movies not found"}, 404
+            return response, 200
+
+        movies = catalogue_snapshot.get_movies(search, sort_by, sort_order, limit=limit,
+                                               cursor=cursor, fields=fields, filters=filters)
+        if movies is None:
+            movies = get_movies(search, sort_by, sort_order, limit=limit,
+                                cursor=cursor, fields=fields, filters=filters)
 
         if movies == []:
             return {"error": "Movies not found"}, 404
 
-        return jsonify(movies), 200
+        movies, next_cursor = split_page(movies, limit, sort_key, fields)
+
+        return page_response(movies, next_cursor), 200
 
     else:
-        try:
-            data = request.json
-            title = data["title"]
-            release_date = data["release_date"]
-            score = float(data["score"])
-            orig_title = data["orig_title"]
-            orig_lang = data["orig_lang"]
-            overview = data["overview"]
-            budget = float(data["budget"])
-            revenue = float(data["revenue"])
-            country = data["country"]
-
-        except KeyError:
-            return jsonify({"error": "Missing required fields, ensure data has the following columns: title, release_date, score, overview, orig_title, orig_lang, budget, revenue, country"}), 400
-        except ValueError:
-            return jsonify({"error": "Post request has invalid data types, ensure budget,revenue and score values are floats and the other values are strings"}), 400
-
-        str_params = [title, release_date, orig_title,
-                      orig_lang, overview, country]
-        float_params = [score, budget, revenue]
-
-        if not validate_data_types(str_params, str):
-            return jsonify({"error": "Post request has invalid data types, ensure budget,revenue and score values are floats and the other values are strings"}), 400
-
-        if not validate_data_types(float_params, float):
-            return jsonify({"error": "Post request has invalid data types, ensure budget,revenue and score values are floats and the other values are strings"}), 400
+        movie, error = validate_movie(request.json)
 
-        try:
-            datetime.strptime(release_date, "%m/%d/%Y")
-        except ValueError:
-            return jsonify({"error": "Invalid release_date format. Please use MM/DD/YYYY"}), 400
+        if error:
+            return jsonify({"error": error}), 400
 
         try:
-            movie = add_movie(title, release_date, score, overview,
-                              orig_title, orig_lang, budget, revenue, country)
+            movie = add_movie(**movie)
+            response_cache.invalidate()
+            stats_refresher.request_refresh()
+            similarity_index.update(movie)
             return jsonify({'success': movie}), 201
         except Exception as e:
-            print(e)
+            app.logger.exception("Adding a movie failed")
+            return jsonify({"error": str(e)}), 500
+
+
+@app.route("/movies/batch", methods=["POST", "DELETE"])
+def endpoint_movies_batch():
+    """Route adds or deletes many movies in a single transaction"""
+    data = request.json
+
+    if request.method == "POST":
+        if not isinstance(data, list) or not 1 <= len(data) <= MAX_BATCH_SIZE:
+            return jsonify({"error": f"Request body must be a list of 1 to {MAX_BATCH_SIZE} movies"}), 400
+
+        movies = []
+        for index, item in enumerate(data):
+            movie, error = validate_movie(item)
+            if error:
+                return jsonify({"error": error, "index": index}), 400
+            movies.append(movie)
+
+        try:
+            movies = add_movies(movies)
+            response_cache.invalidate()
+            stats_refresher.request_refresh()
+            similarity_index.update(movies)
+            return jsonify({'success': movies}), 201
+        except Exception as e:
+            app.logger.exception("Adding a batch of movies failed")
             return jsonify({"error": str(e)}), 500
 
+    else:
+        ids = data.get("ids") if isinstance(data, dict) else None
+
+        if (not isinstance(ids, list) or not 1 <= len(ids) <= MAX_BATCH_SIZE
+                or not validate_data_types(ids, int)):
+            return jsonify({"error": f"Request body must contain ids, a list of 1 to {MAX_BATCH_SIZE} movie ids"}), 400
+
+        deleted = delete_movies(ids)
+
+        if not deleted:
+            return jsonify({"error": "Movies could not be deleted"}), 404
+
+        response_cache.invalidate()
+        stats_refresher.request_refresh()
+        similarity_index.update(removed_ids=deleted)
+        return jsonify({"deleted": deleted}), 200
+
 
 @app.route("/genres/<int:genre_id>/movies", methods=["GET"])
+@cached
 def endpoint_movies_by_genre(genre_id: int):
     """Get list of movie details by genre"""
 
+    stream_format = get_stream_format()
+
+    if not validate_stream_format(stream_format):
+        return jsonify({"error": "Invalid stream parameter"}), 400
+
     if not get_genre(genre_id):
         return jsonify({"error": "Genre not found"}), 404
 
-    movies = get_movies_by_genre(genre_id)
+    if stream_format:
+        movies = catalogue_snapshot.get_movies_by_genre(genre_id)
+        rows = iter_movies_by_genre(genre_id) if movies is None else (movie for movie in movies)
+        response = stream_response(rows, stream_format)
+        if response is None:
+            return jsonify({"error": "No movies found for this genre"}), 404
+        return response, 200
+
+    movies = catalogue_snapshot.get_movies_by_genre(genre_id)
+    if movies is None:
+        movies = get_movies_by_genre(genre_id)
 
     if not movies:
         return jsonify({"error": "No movies found for this genre"}), 404
 
-    return jsonify(movies), 200
+    return app.json.movies_response(movies), 200
 
 
 @app.route("/movies/<int:movie_id>", methods=["GET", "DELETE", "PATCH"])
+@cached
 def endpoint_get_movie(movie_id: int):
 
     if request.method == "GET":
-        movie = get_movie_by_id(movie_id)
+        fields = request.args.get("fields")
+
+        if fields is not None:
+            fields = parse_fields(fields)
+            if not fields:
+                return jsonify({"error": "Invalid fields parameter"}), 400
+
+        movie = get_movie_by_id(movie_id, fields)
 
         if movie:
-            return jsonify(movie), 200
+            return app.json.movies_response(movie), 200
         else:
             return jsonify({"error": "Movie not found"}), 404
 
@@ -112,54 +418,69 @@ def endpoint_get_movie(movie_id: int):
         if not success:
             return jsonify({"error": "Movie could not be deleted"}), 404
 
+        response_cache.invalidate()
+        stats_refresher.request_refresh()
+        similarity_index.update(removed_ids=[movie_id])
+
         return jsonify({"message": "Movie deleted"}), 200
 
     else:
+        data = request.get_json(silent=True)
+
+        if not isinstance(data, dict):
+            return jsonify({"error": "Request body must be a JSON object of the fields to update"}), 400
+
+        data = dict(data)
+        version = data.pop("version", request.headers.get("If-Match"))
+
+        if version is not None:
+            version = parse_version(version)
+            if version is None:
+                return jsonify({"error": "Invalid version, send the movie's current version number"}), 400
+
+        changes, error = validate_movie_changes(data)
+
+        if error:
+            return jsonify({"error": error}), 400
+
         try:
-            data = request.json
-            title = data["title"]
-            release_date = data["release_date"]
-            score = float(data["score"])
-            overview = data["overview"]
-            orig_title = data["orig_title"]
-            orig_lang = data["orig_lang"]
-            budget = float(data["budget"])
-            revenue = float(data["revenue"])
-            country = data["country"]
-
-            for param in [title, release_date, score,
-                          overview, orig_title, orig_lang,
-                          budget, revenue, country]:
-                if not param:
-                    raise Exception("Missing required values")
-
-            str_params = [title, release_date, orig_title,
-                          orig_lang, overview, country]
-            float_params = [score, budget, revenue]
-
-            if not validate_data_types(str_params, str):
-                return jsonify({"error": "Post request has invalid data types, ensure budget,revenue and score values are floats and the other values are strings"}), 400
-
-            if not validate_data_types(float_params, float):
-                return jsonify({"error": "Post request has invalid data types, ensure budget,revenue and score values are floats and the other values are strings"}), 400
-
-            try:
-                datetime.strptime(release_date, "%m/%d/%Y")
-            except ValueError:
-                return jsonify({"error": "Invalid release_date format. Please use MM/DD/YYYY"}), 400
-
-            movie = update_movie(
-                title, release_date, score,
-                overview, orig_title, orig_lang,
-                budget, revenue, country)
-
-            if movie:
-                return jsonify({'success': True}), 201
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+            movie = update_movie(movie_id, changes, version)
+        except VersionConflictError as e:
+            return jsonify({"error": str(e), "version": e.current_version}), 409
+
+        if not movie:
+            return jsonify({"error": "Movie not found"}), 404
+
+        response_cache.invalidate()
+        stats_refresher.request_refresh()
+        similarity_index.update([movie])
+        return app.json.movies_response(movie), 200
+
+
+@app.route("/movies/<int:movie_id>/similar", methods=["GET"])
+@cached
+def endpoint_get_similar_movies(movie_id: int):
+    """Get the movies most like one by overview, genres, language and country"""
+    limit = parse_similar_limit(request.args.get("limit", str(DEFAULT_SIMILAR)))
+
+    if limit is None:
+        return jsonify({"error": f"Invalid limit parameter, ensure it is between 1 and {MAX_SIMILAR}"}), 400
+
+    similar = similarity_index.similar(movie_id, limit)
+
+    if similar is None:
+        return jsonify({"error": "Movie not found"}), 404
+
+    scores = dict(similar)
+    movies = get_movies_by_ids(list(scores)) if scores else []
+    for movie in movies:
+        movie["similarity"] = round(scores[movie["movie_id"]], 4)
+
+    return app.json.movies_response(movies), 200
 
 
 @app.route("/genres", methods=["GET"])
+@cached
 def endpoint_get_genres():
     """Get a list of all genres"""
     genres = get_genres()
@@ -170,13 +491,29 @@ def endpoint_get_genres():
     return jsonify(genres)
 
 
+@app.route("/stats/<string:group>", methods=["GET"])
+@cached
+def endpoint_get_stats(group: str):
+    """Get precomputed movie statistics grouped by genre, country, language or year"""
+    if group not in STATS_VIEWS:
+        return jsonify({"error": "Unknown statistics group"}), 404
+
+    return jsonify(get_stats(group))
+
+
 @app.route("/countries/<string:country_code>", methods=["GET"])
+@cached
 def endpoint_get_movies_by_country(country_code: str):
     """Get a list of movie details by country. Results can be sorted 
     by a specific field in ascending or descending order."""
 
     sort_by = request.args.get("sort_by")
     sort_order = request.args.get("sort_order")
+    stream_format = get_stream_format()
+    limit = request.args.get(
+        "limit", None if stream_format else DEFAULT_PAGE_SIZE)
+    cursor = request.args.get("cursor")
+    fields = request.args.get("fields")
 
     if not validate_sort_by(sort_by):
         return jsonify({"error": "Invalid sort_by parameter"}), 400
@@ -184,20 +521,68 @@ def endpoint_get_movies_by_country(country_code: str):
     if not validate_sort_order(sort_order):
         return jsonify({"error": "Invalid sort_order parameter"}), 400
 
+    if not validate_stream_format(stream_format):
+        return jsonify({"error": "Invalid stream parameter"}), 400
+
+    if not validate_limit(limit):
+        return jsonify({"error": "Invalid limit parameter"}), 400
+    limit = int(limit) if limit else None
+
+    if cursor:
+        cursor = decode_cursor(cursor, sort_by)
+        if not cursor:
+            return jsonify({"error": "Invalid cursor parameter"}), 400
+
+    if fields is not None:
+        fields = parse_fields(fields)
+        if not fields:
+            return jsonify({"error": "Invalid fields parameter"}), 400
+
     country_id = get_country_key(country_code)
 
     if not country_id:
         return jsonify({"error": "Unable to find country with given country code"}), 404
 
-    movies = get_movies_by_country(country_id, sort_by, sort_order)
+    if stream_format:
+        rows = catalogue_snapshot.iter_movies(sort_by=sort_by, sort_order=sort_order,
+                                              cursor=cursor, fields=fields,
+                                              country_id=country_id)
+        if rows is None:
+            rows = iter_movies_by_country(country_id, sort_by, sort_order, cursor=cursor,
+                                          fields=fields)
+        response = stream_response(rows, stream_format, limit)
+        if response is None:
+            return jsonify({"error": "No movies found for this country"}), 404
+        return response, 200
+
+    movies = catalogue_snapshot.get_movies(sort_by=sort_by, sort_order=sort_order,
+                                           limit=limit, cursor=cursor, fields=fields,
+                                           country_id=country_id)
+    if movies is None:
+        movies = get_movies_by_country(country_id, sort_by, sort_order,
+                                       limit=limit, cursor=cursor, fields=fields)
 
     if not movies:
         return jsonify({"error": "No movies found for this country"}), 404
 
-    return jsonify(movies), 200
+    movies, next_cursor = split_page(movies, limit, sort_by, fields)
+
+    return page_response(movies, next_cursor), 200
+
+
+def start_background_jobs() -> None:
+    """Starts the statistics refresher and the first build of the similar movies index"""
+    stats_refresher.start()
+    similarity_index.request_rebuild()
+
+
+# Started when the app is created so WSGI servers such as gunicorn run them too
+if os.environ.get("MOVIES_BACKGROUND_JOBS", "1") == "1":
+    start_background_jobs()
 
 
 if __name__ == "__main__":
+    reference_cache.refresh()
     app.config['TESTING'] = True
     app.config['DEBUG'] = True
     app.run(debug=True, host="0.0.0.0", port=5000)
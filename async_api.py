@@ -0,0 +1,694 @@
+"""Async version of the movie API, served over an asyncpg connection pool.
+
+It serves the same routes and JSON bodies as api.py, but each request awaits
+the database instead of holding a worker thread. Run it with an ASGI server:
+
+    hypercorn async_api:app --bind 0.0.0.0:5000 --workers 4
+"""
+
+import asyncio
+import contextlib
+import itertools
+import os
+import re
+import time
+from datetime import datetime
+import asyncpg
+from psycopg2.extensions import parse_dsn
+from quart import Quart, Response, g, jsonify, request, url_for
+from quart.wrappers.response import IterableBody
+from connection_pool import (DEFAULT_DSN, REPLICA_LAG_QUERY, READ_PRIMARY_COOKIE,
+                             READ_YOUR_WRITES_SECONDS, WRITE_METHODS, ReplicaRouter,
+                             create_router, get_replica_dsns, pin_to_primary,
+                             primary_pinned)
+from json_encoding import fragment_cache
+from metrics import render_metrics, REQUESTS, REQUEST_SECONDS
+from response_compression import (choose_encoding, compress, compress_async_chunks,
+                                  COMPRESSIBLE_MIMETYPES, MIN_SIZE)
+from recommendations import (similarity_index, parse_similar_limit, DEFAULT_SIMILAR,
+                             MAX_SIMILAR)
+from reference_cache import reference_cache, REFERENCE_TABLES
+from stats_refresher import stats_refresher
+from imports import get_language_key
+from database_functions import (validate_sort_by, validate_sort_order, validate_limit,
+                                validate_stream_format, validate_data_types,
+                                validate_movie, decode_cursor, split_page, get_sort_key,
+                                parse_ids, parse_fields, parse_filters, select_list, get_genre,
+                                get_genres, get_country_key, movies_query,
+                                movies_by_country_query, movies_by_genre_query,
+                                stats_query, format_stats, validate_movie_changes,
+                                parse_version, update_movie_query, VersionConflictError,
+                                add_genre_names,
+                                DEFAULT_PAGE_SIZE, MAX_BATCH_SIZE, MOVIE_SELECT,
+                                STREAM_BATCH_SIZE, STATS_VIEWS)
+
+app = Quart(__name__)
+
+pool: asyncpg.Pool = None
+replica_pools: list[asyncpg.Pool] = []
+replica_router: ReplicaRouter = None
+# Raised when a replica cannot be reached or drops its connection
+CONNECTION_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError,
+                     asyncpg.InterfaceError)
+
+
+def get_connect_args(dsn: str = None) -> dict:
+    """Converts the libpq style DSN shared with api.py into asyncpg arguments"""
+    dsn = parse_dsn(dsn or os.environ.get("MOVIES_DB_DSN", DEFAULT_DSN))
+    if "dbname" in dsn:
+        dsn["database"] = dsn.pop("dbname")
+    if "port" in dsn:
+        dsn["port"] = int(dsn["port"])
+    return dsn
+
+
+def to_asyncpg(query: str) -> str:
+    """Rewrites psycopg2 %s placeholders as asyncpg's numbered $n placeholders"""
+    counter = itertools.count(1)
+    return re.sub(r"%([s%])",
+                  lambda match: f"${next(counter)}" if match.group(1) == "s" else "%",
+                  query)
+
+
+async def check_replicas() -> None:
+    """Runs whichever replica health checks are due"""
+    for index in replica_router.due_checks():
+        try:
+            async with replica_pools[index].acquire(timeout=1) as conn:
+                lag = await conn.fetchval(REPLICA_LAG_QUERY)
+        except CONNECTION_ERRORS:
+            lag = None
+        replica_router.record_check(index, lag)
+
+
+@contextlib.asynccontextmanager
+async def read_connection():
+    """Acquires a connection from the next healthy replica, falling back to the primary"""
+    if replica_pools and not primary_pinned.get():
+        await check_replicas()
+        for index in replica_router.candidates():
+            try:
+                conn = await replica_pools[index].acquire()
+            except CONNECTION_ERRORS:
+                replica_router.mark_failed(index)
+                continue
+
+            replica_router.record_read(True)
+            try:
+                yield conn
+            except CONNECTION_ERRORS:
+                replica_router.mark_failed(index)
+                raise
+            finally:
+                await replica_pools[index].release(conn)
+            return
+
+    if replica_pools:
+        replica_router.record_read(False)
+    async with pool.acquire() as conn:
+        yield conn
+
+
+async def fetch_rows(query: str, params: list, read_only: bool = True) -> list[dict]:
+    """Runs a query on a pooled connection and returns every row, reading from a replica when read_only"""
+    async with (read_connection() if read_only else pool.acquire()) as conn:
+        rows = await conn.fetch(to_asyncpg(query), *params)
+    return [add_genre_names(dict(row)) for row in rows]
+
+
+async def stream_rows(query: str, params: list):
+    """Yields rows from a server side cursor so the result is never held in memory"""
+    async with read_connection() as conn:
+        async with conn.transaction():
+            async for row in conn.cursor(to_asyncpg(query), *params,
+                                         prefetch=STREAM_BATCH_SIZE):
+                yield add_genre_names(dict(row))
+
+
+async def load_reference_tables() -> None:
+    """Fills the reference cache through asyncpg so lookups never block the loop"""
+    tables = {}
+    async with read_connection() as conn:
+        for name, (table, key_column, name_column) in REFERENCE_TABLES.items():
+            rows = await conn.fetch(f"""SELECT {key_column}, {name_column}
+                                    FROM {table} ORDER BY {key_column};""")
+            tables[name] = [tuple(row) for row in rows]
+    reference_cache.load(tables)
+
+
+async def keep_reference_tables_fresh() -> None:
+    """Reloads the reference tables well before their ttl runs out"""
+    while True:
+        await asyncio.sleep(reference_cache.ttl / 2)
+        try:
+            await load_reference_tables()
+        except (OSError, asyncpg.PostgresError):
+            # Keep serving the loaded copy and retry on the next tick
+            continue
+
+
+@app.before_serving
+async def startup() -> None:
+    """Opens the connection pool, loads the reference tables and starts the background jobs"""
+    global pool, replica_pools, replica_router
+    pool = await asyncpg.create_pool(
+        **get_connect_args(),
+        min_size=int(os.environ.get("MOVIES_DB_POOL_MIN", 1)),
+        max_size=int(os.environ.get("MOVIES_DB_POOL_MAX", 10)))
+    # Replica pools connect lazily so one being down never stops startup
+    dsns = get_replica_dsns()
+    replica_router = create_router(len(dsns))
+    replica_pools = [await asyncpg.create_pool(
+        **get_connect_args(dsn), min_size=0,
+        max_size=int(os.environ.get("MOVIES_DB_POOL_MAX", 10))) for dsn in dsns]
+    await load_reference_tables()
+    app.config["REFERENCE_REFRESH"] = asyncio.create_task(keep_reference_tables_fresh())
+    if os.environ.get("MOVIES_BACKGROUND_JOBS", "1") == "1":
+        stats_refresher.start()
+        similarity_index.request_rebuild()
+
+
+@app.after_serving
+async def shutdown() -> None:
+    """Stops the background refresh and closes the pool"""
+    app.config["REFERENCE_REFRESH"].cancel()
+    await pool.close()
+    for replica_pool in replica_pools:
+        await replica_pool.close()
+
+
+def movie_values(movie: dict) -> tuple:
+    """Converts a validated movie into the column values asyncpg expects"""
+    return (movie["title"],
+            datetime.strptime(movie["release_date"], "%m/%d/%Y").date(),
+            movie["score"], movie["overview"], movie["orig_title"],
+            get_language_key(movie["orig_lang"]), movie["budget"],
+            movie["revenue"], get_country_key(movie["country"]))
+
+
+def get_stream_format() -> str:
+    """Gets the streaming format from the stream parameter or the Accept header"""
+    stream_format = request.args.get("stream")
+
+    if not stream_format and request.accept_mimetypes.best_match(
+            ["application/json", "application/x-ndjson"]) == "application/x-ndjson":
+        stream_format = "ndjson"
+
+    return stream_format
+
+
+def movies_response(movies) -> Response:
+    """Returns a movie, or a list of them, as JSON built from their cached fragments"""
+    if isinstance(movies, list):
+        return Response(fragment_cache.encode_list(movies) + b"\n", mimetype="application/json")
+    return Response(fragment_cache.encode(movies) + b"\n", mimetype="application/json")
+
+
+def page_response(movies: list[dict], next_cursor: str) -> Response:
+    """Returns a page of movies, linking to the next page when there is one"""
+    response = movies_response(movies)
+
+    if next_cursor:
+        args = request.args.to_dict()
+        args["cursor"] = next_cursor
+        next_url = url_for(request.endpoint, **request.view_args, **args)
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+
+    return response
+
+
+async def stream_response(rows, stream_format: str, limit: int = None) -> Response:
+    """Streams rows as a JSON array or NDJSON, returning None if there are no rows"""
+    # Pull the first row up front so an empty result can still be a 404
+    first = await anext(rows, None)
+    if first is None:
+        return None
+
+    async def generate():
+        ndjson = stream_format == "ndjson"
+        sent = 1
+        try:
+            fragment = fragment_cache.encode(first)
+            yield fragment + b"\n" if ndjson else b"[" + fragment
+            async for row in rows:
+                if limit and sent >= limit:
+                    break
+                sent += 1
+                fragment = fragment_cache.encode(row)
+                yield fragment + b"\n" if ndjson else b"," + fragment
+            if not ndjson:
+                yield b"]"
+        finally:
+            # Hands the connection back even if the client disconnects early
+            await rows.aclose()
+
+    mimetype = "application/x-ndjson" if stream_format == "ndjson" else "application/json"
+    return Response(generate(), mimetype=mimetype)
+
+
+@app.before_request
+async def start_timer() -> None:
+    """Notes when the request started so its latency can be recorded"""
+    g.request_started = time.perf_counter()
+
+
+@app.before_request
+async def route_reads() -> None:
+    """Pins writes, and reads from clients that have just written, to the primary"""
+    pin_to_primary(request.method in WRITE_METHODS
+                   or READ_PRIMARY_COOKIE in request.cookies)
+
+
+@app.after_request
+async def remember_writes(response: Response) -> Response:
+    """Marks a client that wrote so its next reads see the write despite replica lag"""
+    if request.method in WRITE_METHODS and response.status_code < 400 and replica_pools:
+        response.set_cookie(READ_PRIMARY_COOKIE, "1", max_age=READ_YOUR_WRITES_SECONDS,
+                            httponly=True)
+    return response
+
+
+@app.after_request
+async def record_request(response: Response) -> Response:
+    """Counts the request and records its latency against the route template"""
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUESTS.inc((request.method, route, response.status_code))
+    # Streamed bodies are still being sent, so this is the time to the first byte
+    REQUEST_SECONDS.observe((request.method, route),
+                            time.perf_counter() - g.request_started)
+    return response
+
+
+@app.after_request
+async def compress_response(response: Response) -> Response:
+    """Compresses JSON bodies, streamed ones included, with the client's preferred encoding"""
+    if (response.status_code in (204, 304) or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if isinstance(response.response, IterableBody):
+        response.response = IterableBody(compress_async_chunks(response.response.iter, encoding))
+    else:
+        body = await response.get_data()
+        if len(body) < MIN_SIZE:
+            return response
+        response.set_data(compress(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def pool_stats() -> dict:
+    """Returns a snapshot of the asyncpg pool's utilisation, or an empty one before startup"""
+    if pool is None:
+        return {"min_size": 0, "max_size": 0, "size": 0, "idle": 0, "in_use": 0}
+    return {"min_size": pool.get_min_size(), "max_size": pool.get_max_size(),
+            "size": pool.get_size(), "idle": pool.get_idle_size(),
+            "in_use": pool.get_size() - pool.get_idle_size()}
+
+
+def replica_stats() -> dict:
+    """Returns replica health and routing, or zero replicas when none are configured"""
+    return replica_router.stats() if replica_pools else {"replicas": 0, "healthy": 0}
+
+
+@app.route("/", methods=["GET"])
+async def endpoint_index():
+    """Sets up index route"""
+    return jsonify({"message": "Welcome to the Movie API"})
+
+
+@app.route("/health", methods=["GET"])
+async def endpoint_health():
+    """Reports database connection pool statistics for monitoring"""
+    return jsonify({"status": "ok", "pool": pool_stats(), "replicas": replica_stats()}), 200
+
+
+@app.route("/metrics", methods=["GET"])
+async def endpoint_metrics():
+    """Exposes request, pool and cache metrics for Prometheus to scrape"""
+    body = render_metrics({
+        "movies_db_pool": ("Database connection pool", pool_stats()),
+        "movies_db_replicas": ("Read replica routing", replica_stats()),
+        "movies_json_fragments": ("Encoded movie fragment cache", fragment_cache.stats()),
+        "movies_similarity_index": ("Similar movies index", similarity_index.stats())
+    })
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/movies", methods=["GET", "POST"])
+async def endpoint_get_movies():
+    """Route returns all movies or adds movie to database"""
+    if request.method == "GET":
+        ids = request.args.get("ids")
+        fields = request.args.get("fields")
+
+        if fields is not None:
+            fields = parse_fields(fields)
+            if not fields:
+                return jsonify({"error": "Invalid fields parameter"}), 400
+
+        if ids is not None:
+            ids = parse_ids(ids)
+            if not ids:
+                return jsonify({"error": f"Invalid ids parameter, ensure it is a comma separated list of up to {MAX_BATCH_SIZE} movie ids"}), 400
+
+            movies = await fetch_rows(f"""SELECT {select_list(fields)} FROM movie
+                                      WHERE movie_id = ANY(%s)
+                                      ORDER BY array_position(%s::int[], movie_id);""",
+                                      [ids, ids])
+            if not movies:
+                return {"error": "Movies not found"}, 404
+            return movies_response(movies), 200
+
+        search = request.args.get("search")
+        sort_by = request.args.get("sort_by")
+        sort_order = request.args.get("sort_order")
+        stream_format = get_stream_format()
+        # Streamed listings cover the whole catalogue unless a limit is given
+        limit = request.args.get(
+            "limit", None if stream_format else DEFAULT_PAGE_SIZE)
+        cursor = request.args.get("cursor")
+
+        if not validate_sort_by(sort_by):
+            return jsonify({"error": "Invalid sort_by parameter"}), 400
+
+        if not validate_sort_order(sort_order):
+            return jsonify({"error": "Invalid sort_order parameter"}), 400
+
+        if not validate_stream_format(stream_format):
+            return jsonify({"error": "Invalid stream parameter"}), 400
+
+        if not validate_limit(limit):
+            return jsonify({"error": "Invalid limit parameter"}), 400
+        limit = int(limit) if limit else None
+
+        filters, error = parse_filters(request.args)
+        if error:
+            return jsonify({"error": error}), 400
+
+        # An unsorted search is ordered, and so paged, by relevance
+        sort_key = get_sort_key(sort_by, search)
+
+        if cursor:
+            cursor = decode_cursor(cursor, sort_key)
+            if not cursor:
+                return jsonify({"error": "Invalid cursor parameter"}), 400
+
+        if stream_format:
+            response = await stream_response(
+                stream_rows(*movies_query(search, sort_by, sort_order, cursor=cursor,
+                                          fields=fields, filters=filters)),
+                stream_format, limit)
+            if response is None:
+                return {"error": "Movies not found"}, 404
+            return response, 200
+
+        movies = await fetch_rows(*movies_query(search, sort_by, sort_order,
+                                                limit, cursor, fields, filters))
+
+        if movies == []:
+            return {"error": "Movies not found"}, 404
+
+        movies, next_cursor = split_page(movies, limit, sort_key, fields)
+
+        return page_response(movies, next_cursor), 200
+
+    else:
+        movie, error = validate_movie(await request.get_json())
+
+        if error:
+            return jsonify({"error": error}), 400
+
+        try:
+            movie = await fetch_rows(f"""INSERT INTO movie (title, release_date, score,
+                                     overview, orig_title, orig_lang, budget,
+                                     revenue, country_id)
+                                     VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s)
+                                     RETURNING {MOVIE_SELECT};""",
+                                     list(movie_values(movie)), read_only=False)
+            stats_refresher.request_refresh()
+            similarity_index.update(movie)
+            return jsonify({'success': movie}), 201
+        except (asyncpg.PostgresError, ValueError) as e:
+            return jsonify({"error": str(e)}), 500
+
+
+@app.route("/movies/batch", methods=["POST", "DELETE"])
+async def endpoint_movies_batch():
+    """Route adds or deletes many movies in a single transaction"""
+    data = await request.get_json()
+
+    if request.method == "POST":
+        if not isinstance(data, list) or not 1 <= len(data) <= MAX_BATCH_SIZE:
+            return jsonify({"error": f"Request body must be a list of 1 to {MAX_BATCH_SIZE} movies"}), 400
+
+        movies = []
+        for index, item in enumerate(data):
+            movie, error = validate_movie(item)
+            if error:
+                return jsonify({"error": error, "index": index}), 400
+            movies.append(movie)
+
+        # One array per column, unnested into a single multi-row insert
+        columns = list(zip(*[movie_values(movie) for movie in movies]))
+        try:
+            movies = await fetch_rows(f"""INSERT INTO movie (title, release_date, score,
+                                      overview, orig_title, orig_lang, budget,
+                                      revenue, country_id)
+                                      SELECT * FROM unnest(%s::text[], %s::date[],
+                                      %s::float8[], %s::text[], %s::text[], %s::int[],
+                                      %s::float8[], %s::float8[], %s::int[])
+                                      RETURNING {MOVIE_SELECT};""",
+                                      [list(column) for column in columns], read_only=False)
+            stats_refresher.request_refresh()
+            similarity_index.update(movies)
+            return jsonify({'success': movies}), 201
+        except asyncpg.PostgresError as e:
+            return jsonify({"error": str(e)}), 500
+
+    else:
+        ids = data.get("ids") if isinstance(data, dict) else None
+
+        if (not isinstance(ids, list) or not 1 <= len(ids) <= MAX_BATCH_SIZE
+                or not validate_data_types(ids, int)):
+            return jsonify({"error": f"Request body must contain ids, a list of 1 to {MAX_BATCH_SIZE} movie ids"}), 400
+
+        rows = await fetch_rows("""DELETE FROM movie WHERE movie_id = ANY(%s)
+                                RETURNING movie_id;""", [ids], read_only=False)
+        deleted = [row["movie_id"] for row in rows]
+
+        if not deleted:
+            return jsonify({"error": "Movies could not be deleted"}), 404
+
+        stats_refresher.request_refresh()
+        similarity_index.update(removed_ids=deleted)
+        return jsonify({"deleted": deleted}), 200
+
+
+@app.route("/genres/<int:genre_id>/movies", methods=["GET"])
+async def endpoint_movies_by_genre(genre_id: int):
+    """Get list of movie details by genre"""
+    stream_format = get_stream_format()
+
+    if not validate_stream_format(stream_format):
+        return jsonify({"error": "Invalid stream parameter"}), 400
+
+    if not get_genre(genre_id):
+        return jsonify({"error": "Genre not found"}), 404
+
+    if stream_format:
+        response = await stream_response(
+            stream_rows(*movies_by_genre_query(genre_id)), stream_format)
+        if response is None:
+            return jsonify({"error": "No movies found for this genre"}), 404
+        return response, 200
+
+    movies = await fetch_rows(*movies_by_genre_query(genre_id))
+
+    if not movies:
+        return jsonify({"error": "No movies found for this genre"}), 404
+
+    return movies_response(movies), 200
+
+
+@app.route("/movies/<int:movie_id>", methods=["GET", "DELETE", "PATCH"])
+async def endpoint_get_movie(movie_id: int):
+    """Get, delete or update a single movie"""
+    if request.method == "GET":
+        fields = request.args.get("fields")
+
+        if fields is not None:
+            fields = parse_fields(fields)
+            if not fields:
+                return jsonify({"error": "Invalid fields parameter"}), 400
+
+        movies = await fetch_rows(f"""SELECT {select_list(fields)} FROM movie
+                                  WHERE movie_id = %s""", [movie_id])
+
+        if movies:
+            return movies_response(movies[0]), 200
+        else:
+            return jsonify({"error": "Movie not found"}), 404
+
+    elif request.method == "DELETE":
+        async with pool.acquire() as conn:
+            status = await conn.execute("DELETE FROM movie WHERE movie_id = $1;",
+                                        movie_id)
+
+        if status == "DELETE 0":
+            return jsonify({"error": "Movie could not be deleted"}), 404
+
+        stats_refresher.request_refresh()
+        similarity_index.update(removed_ids=[movie_id])
+        return jsonify({"message": "Movie deleted"}), 200
+
+    else:
+        data = await request.get_json(silent=True)
+
+        if not isinstance(data, dict):
+            return jsonify({"error": "Request body must be a JSON object of the fields to update"}), 400
+
+        data = dict(data)
+        version = data.pop("version", request.headers.get("If-Match"))
+
+        if version is not None:
+            version = parse_version(version)
+            if version is None:
+                return jsonify({"error": "Invalid version, send the movie's current version number"}), 400
+
+        changes, error = validate_movie_changes(data)
+
+        if error:
+            return jsonify({"error": error}), 400
+
+        query, params = update_movie_query(movie_id, changes, version)
+        async with pool.acquire() as conn:
+            movie = await conn.fetchrow(to_asyncpg(query), *params)
+
+            if movie is None and version is not None:
+                current = await conn.fetchval(
+                    "SELECT version FROM movie WHERE movie_id = $1;", movie_id)
+                if current is not None:
+                    error = VersionConflictError(current)
+                    return jsonify({"error": str(error), "version": current}), 409
+
+        if movie is None:
+            return jsonify({"error": "Movie not found"}), 404
+
+        movie = add_genre_names(dict(movie))
+        stats_refresher.request_refresh()
+        similarity_index.update([movie])
+        return jsonify(movie), 200
+
+
+@app.route("/movies/<int:movie_id>/similar", methods=["GET"])
+async def endpoint_get_similar_movies(movie_id: int):
+    """Get the movies most like one by overview, genres, language and country"""
+    limit = parse_similar_limit(request.args.get("limit", str(DEFAULT_SIMILAR)))
+
+    if limit is None:
+        return jsonify({"error": f"Invalid limit parameter, ensure it is between 1 and {MAX_SIMILAR}"}), 400
+
+    # The first call builds the index, so it is kept off the event loop
+    similar = await asyncio.to_thread(similarity_index.similar, movie_id, limit)
+
+    if similar is None:
+        return jsonify({"error": "Movie not found"}), 404
+
+    scores = dict(similar)
+    movies = []
+    if scores:
+        movies = await fetch_rows(f"""SELECT {MOVIE_SELECT} FROM movie
+                                  WHERE movie_id = ANY(%s)
+                                  ORDER BY array_position(%s::int[], movie_id);""",
+                                  [list(scores), list(scores)])
+    for movie in movies:
+        movie["similarity"] = round(scores[movie["movie_id"]], 4)
+
+    return movies_response(movies), 200
+
+
+@app.route("/genres", methods=["GET"])
+async def endpoint_get_genres():
+    """Get a list of all genres"""
+    genres = get_genres()
+
+    if not genres:
+        return jsonify({"error": "No genres found"}), 404
+
+    return jsonify(genres)
+
+
+@app.route("/stats/<string:group>", methods=["GET"])
+async def endpoint_get_stats(group: str):
+    """Get precomputed movie statistics grouped by genre, country, language or year"""
+    if group not in STATS_VIEWS:
+        return jsonify({"error": "Unknown statistics group"}), 404
+
+    return jsonify(format_stats(await fetch_rows(stats_query(group), [])))
+
+
+@app.route("/countries/<string:country_code>", methods=["GET"])
+async def endpoint_get_movies_by_country(country_code: str):
+    """Get a list of movie details by country. Results can be sorted
+    by a specific field in ascending or descending order."""
+    sort_by = request.args.get("sort_by")
+    sort_order = request.args.get("sort_order")
+    stream_format = get_stream_format()
+    limit = request.args.get(
+        "limit", None if stream_format else DEFAULT_PAGE_SIZE)
+    cursor = request.args.get("cursor")
+    fields = request.args.get("fields")
+
+    if not validate_sort_by(sort_by):
+        return jsonify({"error": "Invalid sort_by parameter"}), 400
+
+    if not validate_sort_order(sort_order):
+        return jsonify({"error": "Invalid sort_order parameter"}), 400
+
+    if not validate_stream_format(stream_format):
+        return jsonify({"error": "Invalid stream parameter"}), 400
+
+    if not validate_limit(limit):
+        return jsonify({"error": "Invalid limit parameter"}), 400
+    limit = int(limit) if limit else None
+
+    if cursor:
+        cursor = decode_cursor(cursor, sort_by)
+        if not cursor:
+            return jsonify({"error": "Invalid cursor parameter"}), 400
+
+    if fields is not None:
+        fields = parse_fields(fields)
+        if not fields:
+            return jsonify({"error": "Invalid fields parameter"}), 400
+
+    country_id = get_country_key(country_code)
+
+    if not country_id:
+        return jsonify({"error": "Unable to find country with given country code"}), 404
+
+    if stream_format:
+        response = await stream_response(
+            stream_rows(*movies_by_country_query(country_id, sort_by, sort_order,
+                                                 cursor=cursor, fields=fields)),
+            stream_format, limit)
+        if response is None:
+            return jsonify({"error": "No movies found for this country"}), 404
+        return response, 200
+
+    movies = await fetch_rows(*movies_by_country_query(country_id, sort_by, sort_order,
+                                                       limit, cursor, fields))
+
+    if not movies:
+        return jsonify({"error": "No movies found for this country"}), 404
+
+    movies, next_cursor = split_page(movies, limit, sort_by, fields)
+
+    return page_response(movies, next_cursor), 200
@@ -0,0 +1,476 @@
+"""Load benchmark for every API route against a freshly provisioned local Postgres
+
+Provisions a throwaway cluster with initdb, loads schemas.sql, the migrations and
+imdb_movies.csv, scales the catalogue up with synthetic movies, then drives each
+route at a fixed concurrency and reports latency percentiles and throughput.
+Results can be saved as a baseline that later runs are compared against.
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+import psycopg2
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIR = os.path.join(ROOT, ".benchmark")
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmark_baseline.json")
+DATABASE = "movies_benchmark"
+DB_USER = "benchmark"
+
+
+@dataclass
+class Scenario:
+    """One route to drive, building a fresh request for each call"""
+    name: str
+    build: Callable[[random.Random, dict], tuple[str, str, dict]]
+    # Fraction of --requests sent to this scenario, for the very heavy routes
+    share: float = 1.0
+
+
+def movie_body(rng: random.Random) -> dict:
+    """Builds a valid movie for the write routes"""
+    return {"title": f"Benchmark movie {rng.randrange(10 ** 9)}",
+            "release_date": (f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}"
+                             f"/{rng.randint(1950, 2023)}"),
+            "score": float(rng.randint(0, 100)), "overview": "Written by the benchmark",
+            "orig_title": "Benchmark movie", "orig_lang": "English",
+            "budget": float(rng.randint(10 ** 5, 10 ** 8)),
+            "revenue": float(rng.randint(0, 10 ** 9)), "country": "US"}
+
+
+def random_id(rng: random.Random, context: dict) -> int:
+    """Picks a movie id that existed when the benchmark started"""
+    return rng.randint(context["min_id"], context["max_id"])
+
+
+def created_id(context: dict) -> int:
+    """Takes a movie created by an earlier write scenario, so deletes never hit real data"""
+    with context["lock"]:
+        return context["created"].pop() if context["created"] else 0
+
+
+SORT_KEYS = ["title", "release_date", "score", "budget", "revenue"]
+SEARCH_TERMS = ["love", "war", "space", "batman", "family"]
+COUNTRY_CODES = ["US", "GB", "FR", "JP"]
+STATS_GROUPS = ["genres", "countries", "languages", "years"]
+
+READ_SCENARIOS = [
+    Scenario("GET /", lambda rng, ctx: ("GET", "/", None)),
+    Scenario("GET /health", lambda rng, ctx: ("GET", "/health", None)),
+    Scenario("GET /movies", lambda rng, ctx: ("GET", "/movies?limit=100", None)),
+    Scenario("GET /movies sorted page",
+             lambda rng, ctx: ("GET", f"/movies?sort_by={rng.choice(SORT_KEYS)}"
+                                      f"&sort_order={rng.choice(['asc', 'desc'])}&limit=100", None)),
+    Scenario("GET /movies search",
+             lambda rng, ctx: ("GET", f"/movies?search={rng.choice(SEARCH_TERMS)}", None)),
+    Scenario("GET /movies filtered",
+             lambda rng, ctx: ("GET", f"/movies?min_score={rng.randint(40, 80)}"
+                                      f"&genre={rng.randint(1, 19)}&country={rng.choice(COUNTRY_CODES)}"
+                                      "&sort_by=score&sort_order=desc", None)),
+    Scenario("GET /movies?ids",
+             lambda rng, ctx: ("GET", "/movies?ids=" + ",".join(
+                 str(random_id(rng, ctx)) for _ in range(50)), None)),
+    Scenario("GET /movies stream",
+             lambda rng, ctx: ("GET", "/movies?stream=ndjson&limit=1000", None), share=0.2),
+    Scenario("GET /movies/<id>",
+             lambda rng, ctx: ("GET", f"/movies/{random_id(rng, ctx)}", None)),
+    Scenario("GET /movies/<id> fields",
+             lambda rng, ctx: ("GET", f"/movies/{random_id(rng, ctx)}?fields=title,score", None)),
+    # The index is built when the API starts, so a first request may wait for it
+    Scenario("GET /movies/<id>/similar",
+             lambda rng, ctx: ("GET", f"/movies/{random_id(rng, ctx)}/similar", None)),
+    Scenario("GET /genres", lambda rng, ctx: ("GET", "/genres", None)),
+    # Every movie in a genre, so only a few of these are sent
+    Scenario("GET /genres/<id>/movies",
+             lambda rng, ctx: ("GET", f"/genres/{rng.randint(1, 19)}/movies?stream=ndjson", None),
+             share=0.02),
+    Scenario("GET /countries/<code>",
+             lambda rng, ctx: ("GET", f"/countries/{rng.choice(COUNTRY_CODES)}"
+                                      "?sort_by=score&limit=100", None)),
+    Scenario("GET /stats/<group>",
+             lambda rng, ctx: ("GET", f"/stats/{rng.choice(STATS_GROUPS)}", None)),
+    Scenario("GET /metrics", lambda rng, ctx: ("GET", "/metrics", None), share=0.2)
+]
+
+# Run after every read, as each write empties the response cache
+WRITE_SCENARIOS = [
+    Scenario("POST /movies", lambda rng, ctx: ("POST", "/movies", movie_body(rng))),
+    Scenario("POST /movies/batch",
+             lambda rng, ctx: ("POST", "/movies/batch", [movie_body(rng) for _ in range(50)]),
+             share=0.2),
+    Scenario("PATCH /movies/<id>",
+             lambda rng, ctx: ("PATCH", f"/movies/{random_id(rng, ctx)}",
+                               {"score": float(rng.randint(0, 100))})),
+    Scenario("DELETE /movies/<id>",
+             lambda rng, ctx: ("DELETE", f"/movies/{created_id(ctx)}", None), share=0.5),
+    Scenario("DELETE /movies/batch",
+             lambda rng, ctx: ("DELETE", "/movies/batch",
+                               {"ids": [created_id(ctx) for _ in range(50)]}), share=0.05)
+]
+
+
+def get_scenarios(dsn: str, skip_writes: bool, include_writes: bool) -> list[Scenario]:
+    """Gets the routes to run, only writing to a database given with --dsn when asked to"""
+    writes = not skip_writes and (include_writes or dsn is None)
+    return READ_SCENARIOS + (WRITE_SCENARIOS if writes else [])
+
+
+def find_pg_bin(pg_bin: str = None) -> str:
+    """Finds the directory holding initdb and pg_ctl"""
+    if pg_bin:
+        return pg_bin
+
+    initdb = shutil.which("initdb")
+    if initdb:
+        return os.path.dirname(initdb)
+
+    try:
+        return subprocess.run(["pg_config", "--bindir"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        sys.exit("Unable to find initdb, pass --pg-bin with the PostgreSQL bin directory")
+
+
+def start_cluster(pg_bin: str, data_dir: str, port: int) -> None:
+    """Creates the cluster on first use and starts it"""
+    cluster = os.path.join(data_dir, "pgdata")
+    if not os.path.exists(os.path.join(cluster, "PG_VERSION")):
+        os.makedirs(data_dir, exist_ok=True)
+        subprocess.run([os.path.join(pg_bin, "initdb"), "-D", cluster, "-U", DB_USER,
+                        "--auth=trust", "--encoding=UTF8", "--no-locale"],
+                       check=True, stdout=subprocess.DEVNULL)
+
+    subprocess.run([os.path.join(pg_bin, "pg_ctl"), "-D", cluster, "-w",
+                    "-l", os.path.join(data_dir, "postgres.log"),
+                    "-o", f"-p {port} -k {data_dir} -c listen_addresses=127.0.0.1", "start"],
+                   check=True, stdout=subprocess.DEVNULL)
+
+
+def stop_cluster(pg_bin: str, data_dir: str) -> None:
+    """Stops the benchmark cluster"""
+    subprocess.run([os.path.join(pg_bin, "pg_ctl"), "-D", os.path.join(data_dir, "pgdata"),
+                    "-m", "fast", "-w", "stop"], check=False, stdout=subprocess.DEVNULL)
+
+
+def create_database(port: int) -> str:
+    """Recreates the benchmark database and returns its DSN"""
+    conn = psycopg2.connect(dbname="postgres", user=DB_USER, host="127.0.0.1", port=port)
+    conn.autocommit = True
+    curs = conn.cursor()
+    curs.execute(f"DROP DATABASE IF EXISTS {DATABASE};")
+    curs.execute(f"CREATE DATABASE {DATABASE} TEMPLATE template0 ENCODING 'UTF8';")
+    conn.close()
+    return f"dbname={DATABASE} user={DB_USER} host=127.0.0.1 port={port}"
+
+
+def load_catalogue(csv_path: str, catalogue_size: int) -> None:
+    """Loads the schema, migrations and csv, then pads the catalogue with synthetic movies"""
+    # Imported here so the pool picks up the benchmark DSN from the environment
+    from connection_pool import get_connection
+    from database_functions import refresh_stats
+    from imports import bulk_import_movies_to_database, read_movies
+    from migrate import apply_migrations
+
+    with get_connection() as conn:
+        curs = conn.cursor()
+        with open(os.path.join(ROOT, "schemas.sql"), encoding="utf-8") as schema:
+            curs.execute(schema.read())
+        conn.commit()
+        curs.close()
+
+    apply_migrations()
+    loaded = bulk_import_movies_to_database(read_movies(csv_path))
+
+    if catalogue_size > loaded:
+        start = time.perf_counter()
+        synthesize_movies(catalogue_size - loaded)
+        print(f"Added {catalogue_size - loaded} synthetic movies "
+              f"in {time.perf_counter() - start:.1f}s")
+
+    with get_connection() as conn:
+        conn.autocommit = True
+        conn.cursor().execute("VACUUM ANALYZE;")
+        conn.autocommit = False
+    refresh_stats()
+
+
+def synthesize_movies(count: int) -> None:
+    """Copies the real movies with shifted dates, scores and money until count are added.
+
+    Everything is derived from the row number, so every run builds the same catalogue.
+    """
+    from connection_pool import get_connection
+
+    with get_connection() as conn:
+        curs = conn.cursor()
+        curs.execute("SELECT max(movie_id), count(*) FROM movie;")
+        max_id, base = curs.fetchone()
+
+        curs.execute("""CREATE TEMP TABLE source_movies ON COMMIT DROP AS
+                     SELECT row_number() OVER (ORDER BY movie_id) AS n, *
+                     FROM movie;
+                     CREATE INDEX ON source_movies (n);""")
+        curs.execute("""INSERT INTO movie(movie_id, title, release_date, score, overview,
+                     orig_title, orig_lang, budget, revenue, country_id, genre_ids)
+                     OVERRIDING SYSTEM VALUE
+                     SELECT %(max_id)s + g, s.title || ' (' || g || ')',
+                        s.release_date + (g %% 3650 - 1825),
+                        least(100, greatest(0, s.score + g %% 21 - 10)),
+                        s.overview, s.orig_title, s.orig_lang,
+                        s.budget * (0.5 + g %% 100 / 100.0),
+                        s.revenue * (0.5 + g %% 97 / 97.0), s.country_id, s.genre_ids
+                     FROM generate_series(1, %(count)s) AS g
+                     JOIN source_movies AS s ON s.n = 1 + g %% %(base)s;""",
+                     {"max_id": max_id, "count": count, "base": base})
+        curs.execute("""INSERT INTO movie_genres(movie_id, genre_id)
+                     SELECT %(max_id)s + g, mg.genre_id
+                     FROM generate_series(1, %(count)s) AS g
+                     JOIN source_movies AS s ON s.n = 1 + g %% %(base)s
+                     JOIN movie_genres AS mg ON mg.movie_id = s.movie_id;""",
+                     {"max_id": max_id, "count": count, "base": base})
+        curs.execute("SELECT setval(pg_get_serial_sequence('movie', 'movie_id'), %s);",
+                     (max_id + count,))
+        conn.commit()
+        curs.close()
+
+
+def start_server(command: str, port: int, env: dict) -> subprocess.Popen:
+    """Starts the API in its own process and waits for /health to answer"""
+    if command:
+        args = command.format(port=port).split()
+    else:
+        args = [sys.executable, "-m", "flask", "--app", "api", "run",
+                "--port", str(port), "--with-threads", "--no-reload"]
+
+    server = subprocess.Popen(args, cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit(f"API server exited with code {server.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    sys.exit("API server did not become healthy within 30s")
+
+
+def get_context(dsn: str) -> dict:
+    """Reads the id range random lookups are drawn from"""
+    conn = psycopg2.connect(dsn)
+    curs = conn.cursor()
+    curs.execute("SELECT min(movie_id), max(movie_id), count(*) FROM movie;")
+    min_id, max_id, total = curs.fetchone()
+    conn.close()
+    return {"min_id": min_id, "max_id": max_id, "movies": total,
+            "created": [], "lock": threading.Lock()}
+
+
+def percentile(latencies: list[float], percent: float) -> float:
+    """Nearest rank percentile of sorted latencies"""
+    if not latencies:
+        return 0.0
+    return latencies[max(0, math.ceil(percent / 100 * len(latencies)) - 1)]
+
+
+def run_scenario(port: int, scenario: Scenario, context: dict, requests: int,
+                 concurrency: int, seed: int) -> dict:
+    """Sends requests to one route from concurrency keep-alive clients"""
+    latencies = []
+    errors = []
+    issued = itertools.count()
+
+    def client(number: int) -> None:
+        rng = random.Random(f"{seed}-{scenario.name}-{number}")
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        while next(issued) < requests:
+            method, path, body = scenario.build(rng, context)
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, json.dumps(body) if body is not None else None,
+                             headers)
+                response = conn.getresponse()
+                data = response.read()
+                if response.will_close:
+                    conn.close()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                errors.append(path)
+                continue
+            latencies.append(time.perf_counter() - start)
+
+            # Not found is a valid answer for a random id or filter, server errors are not
+            if response.status >= 500:
+                errors.append(path)
+            elif method == "POST" and response.status == 201:
+                created = json.loads(data)["success"]
+                with context["lock"]:
+                    context["created"].extend(movie["movie_id"] for movie in created)
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(number,))
+               for number in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {"requests": len(latencies), "errors": len(errors),
+            "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2)}
+
+
+def print_results(results: dict) -> None:
+    """Prints one line per route"""
+    print(f"\n{'route':<28}{'requests':>10}{'errors':>8}{'req/s':>10}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, result in results.items():
+        print(f"{name:<28}{result['requests']:>10}{result['errors']:>8}{result['rps']:>10}"
+              f"{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}")
+
+
+def compare_to_baseline(results: dict, settings: dict, baseline: dict,
+                        tolerance: float) -> list[str]:
+    """Lists every route that got slower, lost throughput or started failing"""
+    if baseline["settings"] != settings:
+        return [f"baseline settings {baseline['settings']} do not match this run's {settings}"]
+
+    regressions = []
+    for name, result in results.items():
+        if result["errors"]:
+            regressions.append(f"{name}: {result['errors']} failed requests")
+
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+
+        if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']}ms, baseline {before['p95_ms']}ms")
+        if result["rps"] < before["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['rps']} req/s, baseline {before['rps']} req/s")
+    return regressions
+
+
+def main() -> int:
+    """Provisions, benchmarks and compares, returning the process exit code"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dsn", help="benchmark an existing, already loaded database "
+                                      "instead of provisioning one")
+    parser.add_argument("--pg-bin", help="directory holding initdb and pg_ctl")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    parser.add_argument("--db-port", type=int, default=55432)
+    parser.add_argument("--api-port", type=int, default=5055)
+    parser.add_argument("--csv", default=os.path.join(ROOT, "imdb_movies.csv"))
+    parser.add_argument("--catalogue-size", type=int, default=1_000_000,
+                        help="total movies after synthetic padding")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000,
+                        help="requests per route, scaled down for the heaviest routes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--with-cache", action="store_true",
+                        help="keep the response cache on, which mostly measures cache hits")
+    parser.add_argument("--skip-writes", action="store_true")
+    parser.add_argument("--include-writes", action="store_true",
+                        help="also run the write routes against the --dsn database, "
+                             "which adds, changes and deletes movies in it")
+    parser.add_argument("--only", help="run only the routes whose name contains this text")
+    parser.add_argument("--server-command",
+                        help="command that serves api:app on {port}, e.g. "
+                             "'gunicorn -w 4 -b 127.0.0.1:{port} api:app'")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed fractional change before a route counts as a regression")
+    parser.add_argument("--keep-cluster", action="store_true",
+                        help="leave the provisioned Postgres running afterwards")
+    args = parser.parse_args()
+
+    pg_bin = None if args.dsn else find_pg_bin(args.pg_bin)
+    try:
+        dsn = args.dsn
+        if dsn is None:
+            start_cluster(pg_bin, args.data_dir, args.db_port)
+            dsn = create_database(args.db_port)
+            os.environ["MOVIES_DB_DSN"] = dsn
+            load_catalogue(args.csv, args.catalogue_size)
+
+        env = dict(os.environ, MOVIES_DB_DSN=dsn,
+                   MOVIES_DB_POOL_MAX=str(max(10, args.concurrency)),
+                   MOVIES_STATS_REFRESH_INTERVAL="86400")
+        if not args.with_cache:
+            env["MOVIES_RESPONSE_CACHE_SIZE"] = "0"
+
+        context = get_context(dsn)
+        print(f"Benchmarking {context['movies']} movies at concurrency {args.concurrency}")
+
+        server = start_server(args.server_command, args.api_port, env)
+        try:
+            scenarios = get_scenarios(args.dsn, args.skip_writes, args.include_writes)
+            results = {}
+            for scenario in scenarios:
+                if args.only and args.only not in scenario.name:
+                    continue
+                requests = max(args.concurrency, int(args.requests * scenario.share))
+                results[scenario.name] = run_scenario(args.api_port, scenario, context,
+                                                      requests, args.concurrency, args.seed)
+                print(f"{scenario.name}: {results[scenario.name]['rps']} req/s")
+        finally:
+            server.terminate()
+            server.wait()
+    finally:
+        if pg_bin and not args.keep_cluster:
+            stop_cluster(pg_bin, args.data_dir)
+
+    print_results(results)
+
+    settings = {"movies": context["movies"], "concurrency": args.concurrency,
+                "requests": args.requests, "with_cache": args.with_cache,
+                "python": platform.python_version()}
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump({"settings": settings, "results": results}, file, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, run with --save-baseline to record one")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as file:
+        regressions = compare_to_baseline(results, settings, json.load(file), args.tolerance)
+
+    if regressions:
+        print("\nREGRESSIONS against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+
+    print(f"\nNo regressions beyond {args.tolerance:.0%} of the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
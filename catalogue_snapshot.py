@@ -0,0 +1,387 @@
+"""Optional in-process snapshot of the movie catalogue behind the hot read endpoints"""
+
+import logging
+import os
+import select
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+import psycopg2
+from connection_pool import PoolTimeoutError, get_connection, get_pool, primary_pinned
+from database_functions import MOVIE_COLUMNS, MOVIE_SELECT, add_genre_names
+from imports import get_cursor
+from metrics import instrumented
+from reference_cache import reference_cache
+from response_cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+# Keys the listings can be sorted by, besides the default movie_id order
+SORT_KEYS = ["title", "release_date", "revenue", "budget", "score"]
+NOTIFY_CHANNEL = "movie_changes"
+# Every sort order comes from Postgres, so text sorts by the database's collation
+# and snapshot pages line up exactly with the SQL ones
+ORDERS_QUERY = "SELECT " + ", ".join(
+    f"array_agg(movie_id ORDER BY {key}, movie_id) AS {key}" for key in SORT_KEYS) + " FROM movie;"
+# Reads changed movies with the movie just before each in every sort order, found
+# through the (key, movie_id) indexes, and their order among themselves
+PLACEMENT_QUERY = f"SELECT {MOVIE_SELECT}, " + ", ".join(
+    f"""(SELECT ARRAY[p.movie_id::text, p.{key}::text] FROM movie AS p
+         WHERE (p.{key}, p.movie_id) < (m.{key}, m.movie_id)
+         ORDER BY p.{key} DESC, p.movie_id DESC LIMIT 1) AS after_{key},
+        row_number() OVER (ORDER BY m.{key}, m.movie_id) AS place_{key}"""
+    for key in SORT_KEYS) + " FROM movie AS m WHERE m.movie_id = ANY(%s);"
+
+
+class MovieRecord:
+    """One movie's columns, slotted so a catalogue of them stays compact"""
+    __slots__ = tuple(MOVIE_COLUMNS)
+
+    def __init__(self, row: dict):
+        for column in MOVIE_COLUMNS:
+            setattr(self, column, row[column])
+
+
+class Catalogue:
+    """Every movie with its sort orders and country and genre indexes.
+
+    Each movie has a rank in every sort order, so a changed movie is placed by
+    giving it a rank between its new neighbours' instead of renumbering the order.
+    A refresh builds a new catalogue sharing everything the changes leave alone,
+    so requests reading the old one are never disturbed.
+    """
+
+    def __init__(self, records: dict[int, MovieRecord], orders: dict[str, list[int]]):
+        self.records = records
+        self.loaded_at = time.time()
+        # None is the default movie_id order
+        self.orders = {None: [records[movie_id] for movie_id in sorted(records)]}
+        self.orders.update({key: [records[movie_id] for movie_id in movie_ids]
+                            for key, movie_ids in orders.items()})
+        self.ranks = {key: {record.movie_id: float(position)
+                            for position, record in enumerate(order)}
+                      for key, order in self.orders.items() if key}
+
+        self.by_country = {}
+        for key, order in self.orders.items():
+            for record in order:
+                self.by_country.setdefault(record.country_id, {}).setdefault(key, []).append(record)
+
+        self.by_genre = {}
+        for record in self.orders[None]:
+            for genre_id in record.genre_ids:
+                self.by_genre.setdefault(genre_id, []).append(record)
+
+    def rank(self, sort_by: str):
+        """Gets the function giving a record's place in a sort order"""
+        if not sort_by:
+            return lambda record: record.movie_id
+        ranks = self.ranks[sort_by]
+        return lambda record: ranks[record.movie_id]
+
+    def cursor_rank(self, sort_by: str, cursor: dict) -> float:
+        """Gets the place a cursor points after, or None if its movie has since changed"""
+        if not sort_by:
+            return cursor["movie_id"]
+
+        record = self.records.get(cursor["movie_id"])
+        if record is None or getattr(record, sort_by) != cursor["value"]:
+            return None
+        return self.ranks[sort_by][record.movie_id]
+
+    def is_placed(self, movie_id: int, sort_by: str, value: str) -> bool:
+        """Checks a movie is in the catalogue with the sort value, as text, the database has"""
+        record = self.records.get(movie_id)
+        return record is not None and str_value(getattr(record, sort_by)) == value
+
+    def updated(self, changed: dict[int, MovieRecord], removed: set[int],
+                placements: dict[str, list[tuple[int, int]]]) -> "Catalogue":
+        """Copies the catalogue with changed movies re-placed and removed ones dropped.
+
+        placements lists, for each sort key, the changed movies in their new order
+        with the movie each now follows, or None for the first.
+        """
+        old = [self.records[movie_id] for movie_id in [*changed, *removed]
+               if movie_id in self.records]
+        new = list(changed.values())
+
+        catalogue = Catalogue.__new__(Catalogue)
+        catalogue.loaded_at = time.time()
+        catalogue.records = dict(self.records)
+        for record in old:
+            del catalogue.records[record.movie_id]
+        catalogue.records.update(changed)
+
+        by_id = catalogue.rank(None)
+        catalogue.orders = {None: replace_records(self.orders[None], old, new, by_id, by_id)}
+        catalogue.ranks = {}
+        for key in SORT_KEYS:
+            catalogue.orders[key], catalogue.ranks[key] = place_records(
+                self.orders[key], self.ranks[key], old,
+                [(changed[movie_id], after_id) for movie_id, after_id in placements[key]])
+
+        catalogue.by_country = dict(self.by_country)
+        for country_id in {record.country_id for record in [*old, *new]}:
+            country_old = [record for record in old if record.country_id == country_id]
+            country_new = [record for record in new if record.country_id == country_id]
+            orders = self.by_country.get(country_id, {})
+            catalogue.by_country[country_id] = {
+                key: replace_records(orders.get(key, []), country_old, country_new,
+                                     self.rank(key), catalogue.rank(key))
+                for key in [None, *SORT_KEYS]}
+
+        catalogue.by_genre = dict(self.by_genre)
+        for genre_id in {genre_id for record in [*old, *new] for genre_id in record.genre_ids}:
+            catalogue.by_genre[genre_id] = replace_records(
+                self.by_genre.get(genre_id, []),
+                [record for record in old if genre_id in record.genre_ids],
+                [record for record in new if genre_id in record.genre_ids], by_id, by_id)
+        return catalogue
+
+
+def str_value(value) -> str:
+    """Formats a sort value the way Postgres casts it to text, so the two can be compared"""
+    if isinstance(value, float):
+        return repr(value) if value != int(value) else str(int(value))
+    return str(value)
+
+
+def replace_records(order: list[MovieRecord], old: list[MovieRecord], new: list[MovieRecord],
+                    old_rank, new_rank) -> list[MovieRecord]:
+    """Copies an order with the old records taken out and the new ones put in by rank"""
+    order = list(order)
+    for record in old:
+        del order[bisect_left(order, old_rank(record), key=old_rank)]
+    for record in new:
+        insort(order, record, key=new_rank)
+    return order
+
+
+def place_records(order: list[MovieRecord], ranks: dict[int, float], old: list[MovieRecord],
+                  placements: list[tuple[MovieRecord, int]]) -> tuple[list, dict]:
+    """Copies a sort order and its ranks with the old records taken out and each new one
+    put straight after the movie it follows"""
+    old_rank = ranks.__getitem__
+    order = list(order)
+    for record in old:
+        del order[bisect_left(order, old_rank(record.movie_id),
+                              key=lambda other: old_rank(other.movie_id))]
+    ranks = dict(ranks)
+    for record in old:
+        del ranks[record.movie_id]
+
+    def rank(record: MovieRecord) -> float:
+        return ranks[record.movie_id]
+
+    for record, after_id in placements:
+        while True:
+            if after_id is None:
+                index = 0
+                low = rank(order[0]) - 2.0 if order else 0.0
+            else:
+                index = bisect_right(order, ranks[after_id], key=rank)
+                low = ranks[after_id]
+            high = rank(order[index]) if index < len(order) else low + 2.0
+            value = (low + high) / 2
+            if low < value < high:
+                break
+            # Repeated inserts at one spot used up the gap, so the order is renumbered
+            ranks.update((other.movie_id, float(position))
+                         for position, other in enumerate(order))
+
+        ranks[record.movie_id] = value
+        order.insert(index, record)
+    return order, ranks
+
+
+class CatalogueSnapshot:
+    """Serves movie listings from memory, kept current by LISTEN/NOTIFY on movie writes.
+
+    Listings it cannot answer exactly, such as searches, filters, and reads that
+    must see the client's own writes, return None so callers fall back to SQL.
+    """
+
+    def __init__(self, enabled: bool = False, delay: float = 0.2):
+        self.enabled = enabled
+        self.delay = delay
+        self._catalogue = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._counters = {"full_reloads": 0, "incremental_refreshes": 0}
+
+    def start(self) -> None:
+        """Starts listening for movie changes, loading the catalogue in the background"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name="catalogue-snapshot",
+                                                daemon=True)
+                self._thread.start()
+
+    @instrumented
+    def load(self) -> None:
+        """Reads the whole catalogue and its sort orders"""
+        with get_connection() as conn:
+            curs = get_cursor(conn)
+            # Rows and orders are read from the same point in time
+            curs.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+            curs.execute(f"SELECT {MOVIE_SELECT} FROM movie;")
+            records = {row["movie_id"]: MovieRecord(row) for row in curs.fetchall()}
+            curs.execute(ORDERS_QUERY)
+            orders = curs.fetchone()
+            curs.close()
+
+        self._catalogue = Catalogue(records, {key: orders[key] or [] for key in SORT_KEYS})
+        self._counters["full_reloads"] += 1
+        # Listings cached from the previous snapshot since the last write are dropped
+        response_cache.invalidate()
+
+    @instrumented
+    def refresh(self, movie_ids: set[int]) -> None:
+        """Re-reads only the changed movies and re-places them in the sort orders and indexes"""
+        catalogue = self._catalogue
+        wanted = set(movie_ids)
+        with get_connection() as conn:
+            curs = get_cursor(conn)
+            curs.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+            while True:
+                curs.execute(PLACEMENT_QUERY, (list(wanted),))
+                rows = curs.fetchall()
+                # A movie can only be placed after one the snapshot has in its current
+                # place, so neighbours written since this notification are read as well
+                unplaced = {int(row[f"after_{key}"][0]) for row in rows for key in SORT_KEYS
+                            if row[f"after_{key}"] is not None
+                            and not catalogue.is_placed(int(row[f"after_{key}"][0]), key,
+                                                        row[f"after_{key}"][1])} - wanted
+                if not unplaced:
+                    break
+                wanted |= unplaced
+            curs.close()
+
+        changed = {row["movie_id"]: MovieRecord(row) for row in rows}
+        placements = {key: [(row["movie_id"], int(row[f"after_{key}"][0])
+                             if row[f"after_{key}"] is not None else None)
+                            for row in sorted(rows, key=lambda row: row[f"place_{key}"])]
+                      for key in SORT_KEYS}
+        # Notified movies that are gone were deleted
+        removed = wanted - changed.keys()
+
+        self._catalogue = catalogue.updated(changed, removed, placements)
+        self._counters["incremental_refreshes"] += 1
+        response_cache.invalidate()
+
+    def _listen(self) -> None:
+        """Applies notified changes until the process exits, reconnecting after failures"""
+        while True:
+            conn = None
+            try:
+                # LISTEN holds its connection for good, so it has its own outside the pool
+                conn = psycopg2.connect(get_pool().dsn)
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {NOTIFY_CHANNEL};")
+                # Anything written while nobody was listening is covered by a full reload
+                self.load()
+
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    # Lets a burst of writes arrive so it is applied as one refresh
+                    time.sleep(self.delay)
+                    conn.poll()
+                    payloads = {notify.payload for notify in conn.notifies}
+                    conn.notifies.clear()
+
+                    if "*" in payloads:
+                        self.load()
+                    elif payloads:
+                        self.refresh({int(movie_id) for payload in payloads
+                                      for movie_id in payload.split(",")})
+            except (psycopg2.Error, PoolTimeoutError, OSError):
+                logger.exception("Catalogue snapshot lost its database connection, retrying")
+                time.sleep(5)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _serving(self) -> Catalogue:
+        """Gets the catalogue if it can answer the current request"""
+        if not self.enabled:
+            return None
+        if self._thread is None:
+            self.start()
+        # A client that just wrote must read the primary, which may be ahead of the snapshot
+        if primary_pinned.get():
+            return None
+        return self._catalogue
+
+    def iter_movies(self, search: str = None, sort_by: str = None, sort_order: str = None,
+                    limit: int = None, cursor: dict = None, fields: list[str] = None,
+                    filters: dict = None, country_id: int = None):
+        """Yields movies as the SQL listing would, or returns None if it must be queried instead"""
+        catalogue = self._serving()
+        if catalogue is None or search or filters or (sort_by and sort_by not in SORT_KEYS):
+            return None
+
+        if country_id is None:
+            order = catalogue.orders[sort_by]
+        else:
+            order = catalogue.by_country.get(country_id, {}).get(sort_by, [])
+
+        rank = catalogue.rank(sort_by)
+        if cursor:
+            position = catalogue.cursor_rank(sort_by, cursor)
+            if position is None:
+                return None
+
+        if sort_order == "desc":
+            end = bisect_left(order, position, key=rank) if cursor else len(order)
+            records = (order[index] for index in range(end - 1, -1, -1))
+        else:
+            start = bisect_right(order, position, key=rank) if cursor else 0
+            records = islice(order, start, None)
+
+        return self._rows(records, fields, limit, sort_by)
+
+    def _rows(self, records, fields: list[str], limit: int, sort_by: str):
+        """Builds response rows holding the columns the SQL select list would"""
+        columns = list(fields or MOVIE_COLUMNS)
+        # As in select_list, only pages carry the columns their cursor is built from
+        if limit:
+            for column in ["movie_id", sort_by]:
+                if column and column not in columns:
+                    columns.append(column)
+
+        for record in records:
+            yield add_genre_names({column: getattr(record, column) for column in columns})
+
+    def get_movies(self, search: str = None, sort_by: str = None, sort_order: str = None,
+                   limit: int = None, cursor: dict = None, fields: list[str] = None,
+                   filters: dict = None, country_id: int = None) -> list[dict]:
+        """Gets a page of movies with one look-ahead row, or None if it must be queried instead"""
+        rows = self.iter_movies(search, sort_by, sort_order, limit, cursor, fields, filters,
+                                country_id)
+        if rows is None:
+            return None
+        return list(islice(rows, limit + 1 if limit else None))
+
+    def get_movies_by_genre(self, genre_id: int) -> list[dict]:
+        """Gets the movies of a genre, or None if they must be queried instead"""
+        catalogue = self._serving()
+        if catalogue is None:
+            return None
+
+        genre_name = reference_cache.get_name("genre", genre_id)
+        return [{"title": record.title, "genre_name": genre_name}
+                for record in catalogue.by_genre.get(genre_id, [])]
+
+    def stats(self) -> dict:
+        """Returns the snapshot's size, age and refresh counts for monitoring"""
+        catalogue = self._catalogue
+        return {"movies": len(catalogue.records) if catalogue else 0,
+                "age_seconds": time.time() - catalogue.loaded_at if catalogue else 0,
+                **self._counters}
+
+
+catalogue_snapshot = CatalogueSnapshot(
+    os.environ.get("MOVIES_CATALOGUE_SNAPSHOT", "0") == "1",
+    float(os.environ.get("MOVIES_CATALOGUE_SNAPSHOT_DELAY", 0.2)))
@@ -0,0 +1,4 @@
+import os
+
+# The tests mock the database, so the apps must not start jobs that read the real one
+os.environ["MOVIES_BACKGROUND_JOBS"] = "0"
@@ -0,0 +1,375 @@
+"""Connection pool shared by every function that queries the database"""
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+from psycopg2.extensions import connection, TRANSACTION_STATUS_IDLE
+
+DEFAULT_DSN = "dbname=movies user=joel host=localhost"
+# Seconds of replay lag, 0 on a caught up replica or a server that is not replicating
+REPLICA_LAG_QUERY = """SELECT CASE
+                       WHEN NOT pg_is_in_recovery()
+                       OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                       ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                       END::float8;"""
+
+# Set per request, reads made while it is True go to the primary to see earlier writes
+primary_pinned = contextvars.ContextVar("primary_pinned", default=False)
+# After a write a client reads from the primary for this long, covering replica lag
+READ_YOUR_WRITES_SECONDS = int(os.environ.get("MOVIES_DB_READ_YOUR_WRITES", 10))
+READ_PRIMARY_COOKIE = "movies_read_primary"
+WRITE_METHODS = ["POST", "PUT", "PATCH", "DELETE"]
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes free within the checkout timeout"""
+
+
+class ConnectionPool:
+    """Thread safe pool of psycopg2 connections with a bounded size"""
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10,
+                 timeout: float = 5.0, health_check_interval: float = 30.0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1")
+
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+        self._lock = threading.Condition()
+        # Idle connections paired with the time they were returned
+        self._idle: list[tuple[connection, float]] = []
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+        self._counters = {"checkouts": 0, "timeouts": 0,
+                          "connections_opened": 0, "connections_discarded": 0}
+
+        for _ in range(min_size):
+            self._idle.append((self._open(), time.monotonic()))
+            self._size += 1
+
+    def _open(self) -> connection:
+        """Opens a new connection to the database"""
+        conn = psycopg2.connect(self.dsn)
+        self._counters["connections_opened"] += 1
+        return conn
+
+    def _discard(self, conn: connection) -> None:
+        """Closes a connection and frees its slot in the pool"""
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._lock:
+            self._size -= 1
+            self._counters["connections_discarded"] += 1
+            self._lock.notify()
+
+    def _is_healthy(self, conn: connection, idle_since: float) -> bool:
+        """Checks a connection is still usable before handing it out"""
+        if conn.closed:
+            return False
+
+        # Only ping connections that have been sitting idle for a while
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+
+        try:
+            with conn.cursor() as curs:
+                curs.execute("SELECT 1;")
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def getconn(self, timeout: float = None) -> connection:
+        """Checks a connection out of the pool, waiting up to timeout seconds"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise PoolTimeoutError("Connection pool is closed")
+
+                self._waiting += 1
+                try:
+                    while not self._idle and self._size >= self.max_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or not self._lock.wait(remaining):
+                            if not self._idle and self._size >= self.max_size:
+                                self._counters["timeouts"] += 1
+                                raise PoolTimeoutError(
+                                    f"No database connection available after {timeout}s")
+                finally:
+                    self._waiting -= 1
+
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                else:
+                    # Reserve the slot before connecting outside the lock
+                    conn, idle_since = None, None
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    conn = self._open()
+                except psycopg2.Error:
+                    with self._lock:
+                        self._size -= 1
+                        self._lock.notify()
+                    raise
+            elif not self._is_healthy(conn, idle_since):
+                self._discard(conn)
+                continue
+
+            with self._lock:
+                self._counters["checkouts"] += 1
+            return conn
+
+    def putconn(self, conn: connection) -> None:
+        """Returns a connection to the pool, rolling back anything left open"""
+        if conn.closed or self._closed:
+            self._discard(conn)
+            return
+
+        try:
+            if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            self._discard(conn)
+            return
+
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """Yields a pooled connection and always returns it on exit"""
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self) -> dict:
+        """Returns a snapshot of pool utilisation for monitoring"""
+        with self._lock:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "waiting": self._waiting,
+                **self._counters
+            }
+
+    def close(self) -> None:
+        """Closes every idle connection and stops handing out new ones"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._lock.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+class ReplicaRouter:
+    """Round robins reads over the replicas that answered their last health check in time.
+
+    It only tracks state, so the psycopg2 and asyncpg apps share it and run the
+    checks with their own drivers.
+    """
+
+    def __init__(self, count: int, max_lag: float = 5.0, check_interval: float = 5.0):
+        self.count = count
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._healthy = [True] * count
+        self._lag = [0.0] * count
+        # Never checked, so the first read checks every replica
+        self._checked_at = [float("-inf")] * count
+        self._next = 0
+        self._counters = {"replica_reads": 0, "primary_reads": 0, "failovers": 0}
+
+    def due_checks(self) -> list[int]:
+        """Claims the replicas whose health check is due, so only one caller runs each"""
+        now = time.monotonic()
+        with self._lock:
+            due = [index for index in range(self.count)
+                   if now - self._checked_at[index] >= self.check_interval]
+            for index in due:
+                self._checked_at[index] = now
+        return due
+
+    def record_check(self, index: int, lag: float = None) -> None:
+        """Stores a health check's lag, None meaning the replica could not be reached"""
+        with self._lock:
+            healthy = lag is not None and lag <= self.max_lag
+            if self._healthy[index] and not healthy:
+                self._counters["failovers"] += 1
+            self._healthy[index] = healthy
+            self._lag[index] = lag
+
+    def mark_failed(self, index: int) -> None:
+        """Takes a replica out of rotation until its next health check passes"""
+        with self._lock:
+            if self._healthy[index]:
+                self._counters["failovers"] += 1
+            self._healthy[index] = False
+            self._checked_at[index] = time.monotonic()
+
+    def candidates(self) -> list[int]:
+        """Gets the healthy replicas in the order to try them, rotating the first each call"""
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % self.count
+            return [index % self.count for index in range(start, start + self.count)
+                    if self._healthy[index % self.count]]
+
+    def record_read(self, replica: bool) -> None:
+        """Counts where a read was served"""
+        with self._lock:
+            self._counters["replica_reads" if replica else "primary_reads"] += 1
+
+    def stats(self) -> dict:
+        """Returns a snapshot of replica health and routing for monitoring"""
+        with self._lock:
+            return {"replicas": self.count, "healthy": sum(self._healthy), **self._counters}
+
+
+def get_replica_dsns() -> list[str]:
+    """Reads the replica DSNs, separated by semicolons as multi-host URIs contain commas"""
+    dsns = os.environ.get("MOVIES_DB_REPLICA_DSNS", "")
+    return [dsn.strip() for dsn in dsns.split(";") if dsn.strip()]
+
+
+def create_router(count: int) -> ReplicaRouter:
+    """Creates a replica router configured from the environment"""
+    return ReplicaRouter(
+        count,
+        max_lag=float(os.environ.get("MOVIES_DB_REPLICA_MAX_LAG", 5)),
+        check_interval=float(os.environ.get("MOVIES_DB_REPLICA_CHECK_INTERVAL", 5)))
+
+
+def pin_to_primary(pinned: bool = True) -> None:
+    """Sends the current request's reads to the primary, so it reads its own writes"""
+    primary_pinned.set(pinned)
+
+
+def create_pool(dsn: str, min_size: int = None) -> ConnectionPool:
+    """Creates a pool for a DSN sized from the environment"""
+    return ConnectionPool(
+        dsn,
+        min_size=int(os.environ.get("MOVIES_DB_POOL_MIN", 1)) if min_size is None else min_size,
+        max_size=int(os.environ.get("MOVIES_DB_POOL_MAX", 10)),
+        timeout=float(os.environ.get("MOVIES_DB_POOL_TIMEOUT", 5)),
+        health_check_interval=float(os.environ.get("MOVIES_DB_POOL_HEALTH_CHECK", 30)))
+
+
+_pool = None
+_replicas = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Returns the shared pool, creating it from the environment on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = create_pool(os.environ.get("MOVIES_DB_DSN", DEFAULT_DSN))
+    return _pool
+
+
+def get_replicas() -> tuple[ReplicaRouter, list[ConnectionPool]]:
+    """Returns the replica router and pools, or None when no replicas are configured"""
+    global _replicas
+    if _replicas is None:
+        with _pool_lock:
+            if _replicas is None:
+                dsns = get_replica_dsns()
+                # Replica pools connect lazily so one being down never stops startup
+                _replicas = (create_router(len(dsns)),
+                             [create_pool(dsn, min_size=0) for dsn in dsns])
+    return _replicas if _replicas[1] else None
+
+
+def check_replicas(router: ReplicaRouter, pools: list[ConnectionPool]) -> None:
+    """Runs whichever replica health checks are due"""
+    for index in router.due_checks():
+        try:
+            with pools[index].connection(timeout=1) as conn:
+                with conn.cursor() as curs:
+                    curs.execute(REPLICA_LAG_QUERY)
+                    lag = curs.fetchone()[0]
+        except (psycopg2.Error, PoolTimeoutError):
+            lag = None
+        router.record_check(index, lag)
+
+
+def checkout_replica() -> tuple[int, connection]:
+    """Checks a connection out of the next healthy replica, or returns None to use the primary"""
+    router, pools = get_replicas()
+    check_replicas(router, pools)
+
+    for index in router.candidates():
+        try:
+            return index, pools[index].getconn()
+        except psycopg2.OperationalError:
+            router.mark_failed(index)
+        except PoolTimeoutError:
+            # Busy rather than broken, so the replica stays in rotation
+            continue
+    return None
+
+
+@contextmanager
+def get_connection(read_only: bool = False):
+    """Yields a connection from the shared pool, or from a replica's pool for reads"""
+    replicas = get_replicas() if read_only else None
+    if replicas and not primary_pinned.get():
+        router, pools = replicas
+        checkout = checkout_replica()
+        router.record_read(checkout is not None)
+        if checkout is not None:
+            index, conn = checkout
+            try:
+                yield conn
+            except psycopg2.OperationalError:
+                router.mark_failed(index)
+                raise
+            finally:
+                pools[index].putconn(conn)
+            return
+    elif replicas:
+        replicas[0].record_read(False)
+
+    with get_pool().connection() as conn:
+        yield conn
+
+
+def pool_stats() -> dict:
+    """Returns the shared pool's statistics without opening it"""
+    if _pool is None:
+        return {"size": 0, "idle": 0, "in_use": 0, "waiting": 0}
+    return _pool.stats()
+
+
+def replica_stats() -> dict:
+    """Returns replica routing statistics without opening any replica pools"""
+    replicas = get_replicas()
+    if replicas is None:
+        return {"replicas": 0, "healthy": 0}
+    return replicas[0].stats()
@@ -1,21 +1,21 @@
 """Functions that query the database"""
 
-from datetime import date
-import psycopg2
+import base64
+import binascii
+import json
+import math
+import uuid
+from datetime import date, datetime
 import psycopg2.extras
-from psycopg2.extensions import connection
-from imports import get_cursor, get_country_key, get_language_key
-
-
-def get_connection() -> connection:
-    """Sets up connection"""
-    return psycopg2.connect(
-        "dbname=movies user=joel host=localhost")
+from connection_pool import get_connection
+from imports import get_cursor, get_language_key
+from metrics import instrumented, InstrumentedCursor
+from reference_cache import reference_cache
 
 
 def validate_sort_by(sort_by: str) -> bool:
     """Checks if we are sorting by a valid parameter"""
-    if sort_by and sort_by not in ["title", "release_date", "genre", "revenue", "budget", "score"]:
+    if sort_by and sort_by not in ["title", "release_date", "revenue", "budget", "score"]:
         return False
 
     return True
@@ -29,183 +29,716 @@ def validate_sort_order(sort_order: str) -> bool:
     return True
 
 
-def get_movies(search: str = None, sort_by: str = None, sort_order: str = None) -> list[dict]:
-    """Gets all movies from table"""
-    conn = get_connection()
-    curs = get_cursor(conn)
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_BATCH_SIZE = 1000
+MOVIE_COLUMNS = ["movie_id", "title", "release_date", "score", "overview",
+                 "orig_title", "orig_lang", "budget", "revenue", "country_id", "version",
+                 "genre_ids"]
+MOVIE_SELECT = ", ".join(MOVIE_COLUMNS)
+STREAM_BATCH_SIZE = 500
+STREAM_FORMATS = ["json", "ndjson"]
+# Each /stats group maps to its materialized view and the key it is ordered by
+STATS_VIEWS = {
+    "genres": ("genre_stats", "genre_id"),
+    "countries": ("country_stats", "country_id"),
+    "languages": ("language_stats", "language_id"),
+    "years": ("year_stats", "release_year")
+}
+ROI_PERCENTILES = ["p25", "p50", "p75", "p90"]
+# Range filters on /movies, each bounding an indexed column inclusively
+RANGE_FILTERS = {
+    "min_score": ("score", ">="),
+    "max_score": ("score", "<="),
+    "min_budget": ("budget", ">="),
+    "max_budget": ("budget", "<="),
+    "min_revenue": ("revenue", ">="),
+    "max_revenue": ("revenue", "<="),
+    "min_release_date": ("release_date", ">="),
+    "max_release_date": ("release_date", "<=")
+}
+
+
+def validate_stream_format(stream_format: str) -> bool:
+    """Checks the requested streaming format is supported"""
+    if stream_format and stream_format not in STREAM_FORMATS:
+        return False
 
-    query = "SELECT * FROM movie"
-    params = []
+    return True
 
-    if search:
-        search = '%'+search+'%'
-        query += " WHERE title ILIKE %s"
-        params.append(search)
+
+def validate_limit(limit: str) -> bool:
+    """Checks the page size is a whole number within the allowed range"""
+    if limit is None:
+        return True
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        return False
+
+    return 1 <= limit <= MAX_PAGE_SIZE
+
+
+def encode_cursor(row: dict, sort_by: str = None) -> str:
+    """Builds an opaque cursor pointing just after the given row"""
+    value = row[sort_by] if sort_by else None
+    if isinstance(value, date):
+        value = value.isoformat()
+
+    payload = json.dumps({"sort_by": sort_by, "value": value,
+                          "movie_id": row["movie_id"]})
+    # Padding is dropped so the cursor needs no escaping in a URL
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_by: str = None) -> dict:
+    """Decodes a cursor, returning None if it is malformed or was made for another sort"""
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+
+    if not isinstance(payload, dict) or payload.get("sort_by") != sort_by:
+        return None
+
+    if not isinstance(payload.get("movie_id"), int):
+        return None
+
+    if sort_by == "release_date":
+        try:
+            payload["value"] = date.fromisoformat(payload["value"])
+        except (TypeError, ValueError):
+            return None
+
+    return payload
+
+
+def build_keyset(sort_by: str = None, sort_order: str = None,
+                 cursor: dict = None) -> tuple[str, list, str]:
+    """Builds the seek predicate and ORDER BY for keyset pagination"""
+    direction = "DESC" if sort_order == "desc" else "ASC"
+    comparison = "<" if sort_order == "desc" else ">"
+
+    if sort_by:
+        order_by = f"{sort_by} {direction}, movie_id {direction}"
+    else:
+        order_by = f"movie_id {direction}"
+
+    if not cursor:
+        return None, [], order_by
 
     if sort_by:
-        query += " ORDER BY " + sort_by
-        if sort_order:
-            query += " " + sort_order
+        return (f"({sort_by}, movie_id) {comparison} (%s, %s)",
+                [cursor["value"], cursor["movie_id"]], order_by)
+
+    return f"movie_id {comparison} %s", [cursor["movie_id"]], order_by
+
+
+def parse_filters(args: dict) -> tuple[dict, str]:
+    """Parses the filter parameters of a request, returning the filters or an error message"""
+    filters = {}
+
+    for name in RANGE_FILTERS:
+        value = args.get(name)
+        if value is None:
+            continue
+
+        try:
+            if name.endswith("release_date"):
+                filters[name] = datetime.strptime(value, "%m/%d/%Y").date()
+            else:
+                filters[name] = float(value)
+                if not math.isfinite(filters[name]):
+                    raise ValueError
+        except ValueError:
+            return None, f"Invalid {name} parameter"
+
+    if args.get("genre") is not None:
+        try:
+            filters["genre"] = [int(genre_id) for genre_id in args["genre"].split(",")]
+        except ValueError:
+            return None, "Invalid genre parameter, ensure it is a comma separated list of genre ids"
+
+    if args.get("country") is not None:
+        country_ids = [get_country_key(code.strip()) for code in args["country"].split(",")]
+        if None in country_ids:
+            return None, "Invalid country parameter, ensure it is a comma separated list of country codes"
+        filters["country"] = country_ids
+
+    if args.get("language") is not None:
+        language_id = reference_cache.get_key("language", args["language"].strip())
+        if language_id is None:
+            return None, "Invalid language parameter"
+        filters["language"] = language_id
+
+    return filters, None
+
+
+def build_filters(filters: dict = None) -> tuple[list[str], list]:
+    """Compiles parsed filters into WHERE conditions on the movie table"""
+    filters = filters or {}
+    conditions = []
+    params = []
+
+    for name, value in filters.items():
+        if name in RANGE_FILTERS:
+            column, operator = RANGE_FILTERS[name]
+            conditions.append(f"movie.{column} {operator} %s")
+            params.append(value)
+
+    if "country" in filters:
+        conditions.append("movie.country_id = ANY(%s)")
+        params.append(filters["country"])
+
+    if "language" in filters:
+        conditions.append("movie.orig_lang = %s")
+        params.append(filters["language"])
+
+    if "genre" in filters:
+        # Overlap with any of the genres, answered by the GIN index on genre_ids
+        conditions.append("movie.genre_ids && %s::int[]")
+        params.append(filters["genre"])
+
+    return conditions, params
+
+
+def parse_fields(fields: str) -> list[str]:
+    """Parses a comma separated list of movie columns, returning None if any are unknown"""
+    names = [name.strip() for name in fields.split(",")]
+
+    if any(name not in MOVIE_COLUMNS for name in names):
+        return None
+
+    # Drops repeats while keeping the order the client asked for
+    return list(dict.fromkeys(names))
+
+
+def select_list(fields: list[str] = None, limit: int = None, sort_by: str = None,
+                default: str = MOVIE_SELECT) -> str:
+    """Builds the SELECT column list, adding any columns a page cursor is built from"""
+    if not fields:
+        return default
+
+    columns = list(fields)
+    if limit:
+        for column in ["movie_id", sort_by]:
+            if column and column not in columns:
+                columns.append(column)
+
+    return ", ".join(columns)
+
+
+def get_sort_key(sort_by: str = None, search: str = None) -> str:
+    """Gets the key results are ordered by, which is relevance for an unsorted search"""
+    if search and not sort_by:
+        return "relevance"
+
+    return sort_by
+
+
+def split_page(rows: list[dict], limit: int, sort_by: str = None,
+               fields: list[str] = None) -> tuple[list[dict], str]:
+    """Trims the look-ahead row from a page and returns the next page cursor"""
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1], sort_by)
+
+    # Columns only selected to build the cursor are not part of the response
+    if fields:
+        rows = [add_genre_names({field: row[field] for field in fields}) for row in rows]
+
+    return rows, next_cursor
+
+
+def add_genre_names(row: dict) -> dict:
+    """Adds the names of a movie's genre_ids from the reference cache, so no join is needed"""
+    if row is not None and "genre_ids" in row:
+        names = reference_cache.get_id_names("genre")
+        row["genres"] = [names.get(genre_id) for genre_id in row["genre_ids"]]
+    return row
+
+
+def fetch_rows(query: str, params: list) -> list[dict]:
+    """Runs a read-only query on a pooled connection and returns every row"""
+    with get_connection(read_only=True) as conn:
+        curs = get_cursor(conn)
+        curs.execute(query, tuple(params) if params else None)
+        data = curs.fetchall()
+        curs.close()
+
+    return [add_genre_names(row) for row in data]
+
 
-    curs.execute(query, tuple(params) if params else None)
-    data = curs.fetchall()
-    curs.close()
+def stream_rows(query: str, params: list, batch_size: int = STREAM_BATCH_SIZE):
+    """Yields rows from a server side cursor so the result is never held in memory"""
+    with get_connection(read_only=True) as conn:
+        # Named cursors are declared on the server and fetched batch_size rows at a time
+        curs = conn.cursor(name=f"stream_{uuid.uuid4().hex}",
+                           cursor_factory=InstrumentedCursor)
+        curs.itersize = batch_size
+        try:
+            curs.execute(query, tuple(params) if params else None)
+            for row in curs:
+                yield add_genre_names(row)
+        finally:
+            curs.close()
 
-    return data
 
+def movies_query(search: str = None, sort_by: str = None, sort_order: str = None,
+                 limit: int = None, cursor: dict = None,
+                 fields: list[str] = None, filters: dict = None) -> tuple[str, list]:
+    """Builds the query for a page of movies, with one extra row to detect a next page"""
+    conditions, params = build_filters(filters)
 
+    sort_by = get_sort_key(sort_by, search)
+    if sort_by == "relevance" and not sort_order:
+        sort_order = "desc"
+
+    if search:
+        # Full text matches on title, orig_title and overview plus fuzzy title
+        # matches, both served by GIN indexes and ranked by relevance
+        filter_sql = "".join(f" AND {condition}" for condition in conditions)
+        query = f"""SELECT {select_list(fields, limit, sort_by, "*")} FROM (
+                    SELECT {MOVIE_SELECT},
+                    -- Both scores are real, widened so cursors round trip exactly
+                    (ts_rank(search_vector, websearch_to_tsquery('english', %s))
+                        + similarity(title, %s))::float8 AS relevance
+                    FROM movie
+                    WHERE (search_vector @@ websearch_to_tsquery('english', %s)
+                    OR title %% %s){filter_sql}) AS results"""
+        params = [search] * 4 + params
+        conditions = []
+    else:
+        query = f"SELECT {select_list(fields, limit, sort_by)} FROM movie"
+
+    seek, seek_params, order_by = build_keyset(sort_by, sort_order, cursor)
+    if seek:
+        conditions.append(seek)
+        params.extend(seek_params)
+
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+
+    query += " ORDER BY " + order_by
+
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit + 1)
+
+    return query, params
+
+
+@instrumented
+def get_movies(search: str = None, sort_by: str = None, sort_order: str = None,
+               limit: int = None, cursor: dict = None,
+               fields: list[str] = None, filters: dict = None) -> list[dict]:
+    """Gets a page of movies from table, fetching one extra row to detect a next page"""
+    return fetch_rows(*movies_query(search, sort_by, sort_order, limit, cursor,
+                                    fields, filters))
+
+
+@instrumented
+def iter_movies(search: str = None, sort_by: str = None, sort_order: str = None,
+                limit: int = None, cursor: dict = None, fields: list[str] = None,
+                filters: dict = None):
+    """Streams movies from table"""
+    return stream_rows(*movies_query(search, sort_by, sort_order, limit, cursor,
+                                     fields, filters))
+
+
+@instrumented
 def add_movie(title: str, release_date: date, score: int,
               overview: str, orig_title: str, orig_lang: str,
               budget: int, revenue: int, country: str) -> dict:
     """Add's movie to table"""
-    conn = get_connection()
-    curs = get_cursor(conn)
-
     # Converting language and country key to their ID's to fit schema
     country_key = get_country_key(country)
     language_key = get_language_key(orig_lang)
 
-    curs.execute("""INSERT INTO movie (title, release_date, score,
-                overview, orig_title, orig_lang, budget,
-                revenue, country_id)
-                 VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s) RETURNING *;""",
-                 (title, release_date, score, overview, orig_title,
-                  language_key, budget, revenue, country_key))
+    with get_connection() as conn:
+        curs = get_cursor(conn)
+        curs.execute(f"""INSERT INTO movie (title, release_date, score,
+                    overview, orig_title, orig_lang, budget,
+                    revenue, country_id)
+                     VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s) RETURNING {MOVIE_SELECT};""",
+                     (title, release_date, score, overview, orig_title,
+                      language_key, budget, revenue, country_key))
+
+        data = curs.fetchall()
+        conn.commit()
+        curs.close()
 
-    data = curs.fetchall()
-    curs.close()
-    return data
+    return [add_genre_names(row) for row in data]
 
 
 def get_genre(genre_id: int) -> dict:
     """Gets genre name given the genre id"""
-    conn = get_connection()
-    curs = get_cursor(conn)
-    curs.execute("SELECT genre_name FROM genre WHERE genre_id = %s;",
-                 (genre_id,))
-    data = curs.fetchone()
-    curs.close()
+    genre_name = reference_cache.get_name("genre", genre_id)
+    if genre_name is None:
+        return None
 
-    return data
+    return {"genre_name": genre_name}
 
 
+def movies_by_genre_query(genre_id: int) -> tuple[str, list]:
+    """Builds the query for movies of a genre"""
+    # The name comes from the reference cache and genre_ids is GIN indexed, so nothing is joined
+    return ("""SELECT title, %s::text AS genre_name
+            FROM movie
+            WHERE genre_ids @> ARRAY[%s]::int[]
+            ORDER BY movie_id;""",
+            [reference_cache.get_name("genre", genre_id), genre_id])
+
+
+@instrumented
 def get_movies_by_genre(genre_id: int) -> list[dict]:
     """Gets movies by genre"""
-    conn = get_connection()
-    curs = get_cursor(conn)
-    curs.execute("""SELECT m.title, g.genre_name
-                FROM movie as m
-                JOIN movie_genres as mg ON mg.movie_id = m.movie_id
-                JOIN genre as g ON mg.genre_id = g.genre_id
-                WHERE g.genre_id = %s;""",
-                 (genre_id,))
-    data = curs.fetchall()
-    curs.close()
+    return fetch_rows(*movies_by_genre_query(genre_id))
+
 
-    return data
+@instrumented
+def iter_movies_by_genre(genre_id: int):
+    """Streams movies by genre"""
+    return stream_rows(*movies_by_genre_query(genre_id))
 
 
 def get_genres() -> list[dict[str, str]]:
     """Gets all possible genre of movies"""
-    conn = get_connection()
-    curs = get_cursor(conn)
+    return [{"genre_name": genre_name}
+            for genre_name in reference_cache.get_names("genre")]
 
-    curs.execute("SELECT genre_name FROM genre;")
 
-    data = curs.fetchall()
-    curs.close()
+def get_country_key(country_code: str) -> int:
+    """Gets the country id for a country code, or None if it is unknown"""
+    return reference_cache.get_key("country", country_code)
 
-    return data
 
+def movies_by_country_query(country_id: int, sort_by: str = None,
+                            sort_order: str = None, limit: int = None,
+                            cursor: dict = None,
+                            fields: list[str] = None) -> tuple[str, list]:
+    """Builds the query for a page of movies from a given country"""
+    query = f"SELECT {select_list(fields, limit, sort_by)} FROM movie WHERE country_id = %s"
+    params = [country_id]
 
-def get_country_key(country_code: str) -> int:
-    conn = get_connection()
-    curs = get_cursor(conn)
+    seek, seek_params, order_by = build_keyset(sort_by, sort_order, cursor)
+    if seek:
+        query += " AND " + seek
+        params.extend(seek_params)
 
-    curs.execute("SELECT country_id from country where country_name ILIKE %s",
-                 (country_code,))
+    query += " ORDER BY " + order_by
 
-    data = curs.fetchone()
-    curs.close()
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit + 1)
 
-    return data["country_id"]
+    return query, params
 
 
+@instrumented
 def get_movies_by_country(country_id: int, sort_by: str = None,
-                          sort_order: str = None) -> list[dict]:
-    """Gets all movies from a given country"""
-    conn = get_connection()
-    curs = get_cursor(conn)
-
-    query = "SELECT * FROM movie WHERE country_id = %s"
+                          sort_order: str = None, limit: int = None,
+                          cursor: dict = None, fields: list[str] = None) -> list[dict]:
+    """Gets a page of movies from a given country"""
+    return fetch_rows(*movies_by_country_query(country_id, sort_by, sort_order,
+                                               limit, cursor, fields))
 
-    if sort_by:
-        query += " ORDER BY " + sort_by
-        if sort_order:
-            query += " " + sort_order
-
-    curs.execute(query, (country_id,))
-    data = curs.fetchall()
-    curs.close()
 
-    return data
+@instrumented
+def iter_movies_by_country(country_id: int, sort_by: str = None,
+                           sort_order: str = None, limit: int = None,
+                           cursor: dict = None, fields: list[str] = None):
+    """Streams movies from a given country"""
+    return stream_rows(*movies_by_country_query(country_id, sort_by, sort_order,
+                                                limit, cursor, fields))
 
 
-def get_movie_by_id(movie_id: int) -> list[dict]:
+@instrumented
+def get_movie_by_id(movie_id: int, fields: list[str] = None) -> list[dict]:
     """Gets a movie from it's id"""
-    conn = get_connection()
-    curs = get_cursor(conn)
-
-    query = "SELECT * FROM movie WHERE movie_id = %s"
+    query = f"SELECT {select_list(fields)} FROM movie WHERE movie_id = %s"
 
-    curs.execute(query, (movie_id,))
-    data = curs.fetchone()
-    curs.close()
+    with get_connection(read_only=True) as conn:
+        curs = get_cursor(conn)
+        curs.execute(query, (movie_id,))
+        data = curs.fetchone()
+        curs.close()
 
-    return data
+    return add_genre_names(data)
 
 
+@instrumented
 def delete_movie(movie_id: int) -> bool:
-    conn = get_connection()
-    curs = get_cursor(conn)
-
     query = "DELETE FROM movie WHERE movie_id = %s;"
 
-    curs.execute(query, (movie_id,))
+    with get_connection() as conn:
+        curs = get_cursor(conn)
+        curs.execute(query, (movie_id,))
 
-    # Checks number of rows fetched(deleted) by the cursor
-    rows_deleted = curs.rowcount
-    conn.commit()
+        # Checks number of rows fetched(deleted) by the cursor
+        rows_deleted = curs.rowcount
+        conn.commit()
+        curs.close()
 
     return rows_deleted > 0
 
 
+def parse_ids(ids: str) -> list[int]:
+    """Parses a comma separated list of movie ids, returning None if it is invalid"""
+    try:
+        movie_ids = [int(movie_id) for movie_id in ids.split(",")]
+    except ValueError:
+        return None
+
+    if not 1 <= len(movie_ids) <= MAX_BATCH_SIZE:
+        return None
+
+    return movie_ids
+
+
+@instrumented
+def get_movies_by_ids(movie_ids: list[int], fields: list[str] = None) -> list[dict]:
+    """Gets many movies in one query, in the order their ids were given"""
+    return fetch_rows(f"""SELECT {select_list(fields)} FROM movie
+                      WHERE movie_id = ANY(%s)
+                      ORDER BY array_position(%s::int[], movie_id);""",
+                      [movie_ids, movie_ids])
+
+
+@instrumented
+def add_movies(movies: list[dict]) -> list[dict]:
+    """Adds many movies with a multi-row insert in one transaction"""
+    rows = [(movie["title"], movie["release_date"], movie["score"],
+             movie["overview"], movie["orig_title"],
+             get_language_key(movie["orig_lang"]), movie["budget"],
+             movie["revenue"], get_country_key(movie["country"]))
+            for movie in movies]
+
+    with get_connection() as conn:
+        curs = get_cursor(conn)
+        data = psycopg2.extras.execute_values(
+            curs, f"""INSERT INTO movie (title, release_date, score,
+                    overview, orig_title, orig_lang, budget,
+                    revenue, country_id)
+                    VALUES %s RETURNING {MOVIE_SELECT};""",
+            rows, page_size=MAX_BATCH_SIZE, fetch=True)
+        conn.commit()
+        curs.close()
+
+    return [add_genre_names(row) for row in data]
+
+
+@instrumented
+def delete_movies(movie_ids: list[int]) -> list[int]:
+    """Deletes many movies in one statement, returning the ids that existed"""
+    with get_connection() as conn:
+        curs = get_cursor(conn)
+        curs.execute("""DELETE FROM movie WHERE movie_id = ANY(%s)
+                     RETURNING movie_id;""",
+                     (movie_ids,))
+        deleted = [row["movie_id"] for row in curs.fetchall()]
+        conn.commit()
+        curs.close()
+
+    return deleted
+
+
 def validate_data_types(items, data_type):
     """Validate that all items in the list are of the given data type."""
     for item in items:
-        if not isinstance(item, data_type):
+        # JSON true and false decode to bool, which is a subclass of int
+        if not isinstance(item, data_type) or isinstance(item, bool):
             return False
     return True
 
 
-def update_movie(title: str, release_date: date, score: float,
-                 overview: str, orig_title: str, orig_lang: str,
-                 budget: int, revenue: int, country: str) -> dict[str]:
-    """Updates movie in database"""
-    conn = get_connection()
-    curs = get_cursor(conn)
+MISSING_FIELDS_ERROR = "Missing required fields, ensure data has the following columns: title, release_date, score, overview, orig_title, orig_lang, budget, revenue, country"
+INVALID_TYPES_ERROR = "Post request has invalid data types, ensure budget,revenue and score values are floats and the other values are strings"
+
+
+def validate_movie(data: dict) -> tuple[dict, str]:
+    """Validates a movie from a request body, returning the movie or an error message"""
+    try:
+        title = data["title"]
+        release_date = data["release_date"]
+        score = float(data["score"])
+        orig_title = data["orig_title"]
+        orig_lang = data["orig_lang"]
+        overview = data["overview"]
+        budget = float(data["budget"])
+        revenue = float(data["revenue"])
+        country = data["country"]
+
+    except KeyError:
+        return None, MISSING_FIELDS_ERROR
+    except (ValueError, TypeError):
+        return None, INVALID_TYPES_ERROR
+
+    str_params = [title, release_date, orig_title,
+                  orig_lang, overview, country]
+    float_params = [score, budget, revenue]
+
+    if not validate_data_types(str_params, str):
+        return None, INVALID_TYPES_ERROR
+
+    if not validate_data_types(float_params, float):
+        return None, INVALID_TYPES_ERROR
+
+    try:
+        datetime.strptime(release_date, "%m/%d/%Y")
+    except ValueError:
+        return None, "Invalid release_date format. Please use MM/DD/YYYY"
+
+    return {"title": title, "release_date": release_date, "score": score,
+            "overview": overview, "orig_title": orig_title, "orig_lang": orig_lang,
+            "budget": budget, "revenue": revenue, "country": country}, None
+
+
+class VersionConflictError(Exception):
+    """Raised when a movie was changed since the version a client last read"""
+
+    def __init__(self, current_version: int):
+        super().__init__(f"Movie has been modified, current version is {current_version}")
+        self.current_version = current_version
+
+
+# Fields a PATCH may change, mapped to their column and expected type
+MOVIE_UPDATE_FIELDS = {
+    "title": ("title", str),
+    "release_date": ("release_date", str),
+    "score": ("score", float),
+    "overview": ("overview", str),
+    "orig_title": ("orig_title", str),
+    "orig_lang": ("orig_lang", str),
+    "budget": ("budget", float),
+    "revenue": ("revenue", float),
+    "country": ("country_id", str)
+}
+
+
+def validate_movie_changes(data: dict) -> tuple[dict, str]:
+    """Validates a partial movie from a request body, returning the changed columns or an error message"""
+    if not isinstance(data, dict) or not data:
+        return None, "Patch request has no fields to update"
+
+    unknown = [name for name in data if name not in MOVIE_UPDATE_FIELDS]
+    if unknown:
+        return None, f"Unknown fields: {', '.join(unknown)}"
+
+    changes = {}
+    for name, value in data.items():
+        column, data_type = MOVIE_UPDATE_FIELDS[name]
+
+        if data_type is float:
+            try:
+                value = float(value)
+            except (ValueError, TypeError):
+                return None, INVALID_TYPES_ERROR
+        elif not isinstance(value, str) or not value:
+            return None, INVALID_TYPES_ERROR
+
+        changes[column] = value
+
+    if "release_date" in changes:
+        try:
+            changes["release_date"] = datetime.strptime(
+                changes["release_date"], "%m/%d/%Y").date()
+        except ValueError:
+            return None, "Invalid release_date format. Please use MM/DD/YYYY"
+
+    # Converting language and country key to their ID's to fit schema
+    if "orig_lang" in changes:
+        changes["orig_lang"] = get_language_key(changes["orig_lang"])
+
+    if "country_id" in changes:
+        changes["country_id"] = get_country_key(changes["country_id"])
+        if changes["country_id"] is None:
+            return None, "Unable to find country with given country code"
+
+    return changes, None
+
+
+def parse_version(version) -> int:
+    """Parses a movie version from a request body or If-Match header, returning None if it is invalid"""
+    if isinstance(version, str):
+        version = version.strip().removeprefix("W/").strip('"')
+
+    if isinstance(version, bool):
+        return None
+
+    try:
+        version = int(version)
+    except (ValueError, TypeError):
+        return None
+
+    return version if version > 0 else None
+
+
+def update_movie_query(movie_id: int, changes: dict,
+                       version: int = None) -> tuple[str, list]:
+    """Builds an UPDATE of one movie's changed columns that bumps its version and returns the row"""
+    assignments = ", ".join(f"{column} = %s" for column in changes)
+    query = f"UPDATE movie SET {assignments}, version = version + 1 WHERE movie_id = %s"
+    params = [*changes.values(), movie_id]
+
+    if version is not None:
+        query += " AND version = %s"
+        params.append(version)
+
+    return query + f" RETURNING {MOVIE_SELECT};", params
+
+
+@instrumented
+def update_movie(movie_id: int, changes: dict, version: int = None) -> dict:
+    """Updates the given columns of one movie, returning the updated row or None if it does not exist"""
+    with get_connection() as conn:
+        curs = get_cursor(conn)
+        curs.execute(*update_movie_query(movie_id, changes, version))
+        movie = curs.fetchone()
+
+        if movie is None and version is not None:
+            # Only a failed update pays for a second query to tell why
+            curs.execute("SELECT version FROM movie WHERE movie_id = %s;", (movie_id,))
+            current = curs.fetchone()
+            if current is not None:
+                curs.close()
+                raise VersionConflictError(current["version"])
+
+        conn.commit()
+        curs.close()
+
+    return add_genre_names(movie)
+
+
+def stats_query(group: str) -> str:
+    """Builds the query that reads a statistics group from its materialized view"""
+    view, key = STATS_VIEWS[group]
+    return f"SELECT * FROM {view} ORDER BY {key};"
+
+
+def format_stats(rows: list[dict]) -> list[dict]:
+    """Labels each row's return on investment percentiles"""
+    for row in rows:
+        percentiles = row.pop("roi_percentiles") or [None] * len(ROI_PERCENTILES)
+        row["roi_percentiles"] = dict(zip(ROI_PERCENTILES, percentiles))
+    return rows
 
-    country_key = get_country_key(country)
-    language_key = get_language_key(orig_lang)
 
-    curs.execute("""UPDATE movie SET title = %s, release_date = %s, score = %s,
-                        overview = %s, orig_title = %s, orig_lang = %s,
-                        budget = %s, revenue = %s, country_id = %s;""",
-                 (title, release_date, score, overview, orig_title,
-                  language_key, budget, revenue, country_key))
+@instrumented
+def get_stats(group: str) -> list[dict]:
+    """Gets the precomputed statistics for a group"""
+    return format_stats(fetch_rows(stats_query(group), []))
 
-    rows_updated = curs.rowcount
-    conn.commit()
-    curs.close()
 
-    return rows_updated > 0
+@instrumented
+def refresh_stats() -> None:
+    """Rebuilds every statistics view without blocking readers"""
+    with get_connection() as conn:
+        curs = get_cursor(conn)
+        for view, _ in STATS_VIEWS.values():
+            curs.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view};")
+        conn.commit()
+        curs.close()
@@ -1,101 +1,552 @@
 """Script of function's that load the csv into our psql movies database"""
 
+import argparse
+import contextlib
 import csv
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from typing import Callable, Iterable, Iterator
 import psycopg2
-import psycopg2.extras
-
-
-conn = psycopg2.connect(host='localhost', user='joel',
-                        dbname='movies', port=5432)
+from connection_pool import get_connection
+from metrics import InstrumentedCursor
+from reference_cache import reference_cache
 
 
 def get_cursor(connection: psycopg2.extensions.connection) -> psycopg2.extensions.cursor:
     """Sets up cursor"""
-    return connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    return connection.cursor(cursor_factory=InstrumentedCursor)
+
 
+def read_movies(filename: str) -> Iterator[dict]:
+    """Streams the csv's rows one at a time rather than loading the whole file"""
+    with open(filename, encoding="utf-8", newline="") as f:
+        yield from csv.DictReader(f)
 
-def load_to_csv(filename: str) -> list[dict]:
-    """Load's csv file to a list of dictionaries"""
-    with open(filename, encoding="utf-8") as f:
-        data = []
-        for line in csv.DictReader(f):
-            data.append(line)
-    return data
+
+def batched(rows: Iterable, size: int) -> Iterator[list]:
+    """Groups an iterable into lists of at most size items"""
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
 
 
 def get_genre_key(genre: str) -> int:
     """Gets genre key"""
-    curs = get_cursor(conn)
-    curs.execute("""SELECT genre_id
-                   FROM genre
-                   WHERE genre_name LIKE %s;""",
-                 (genre,))
-    data = curs.fetchone()
-    curs.close()
-    if data:
-        return data["genre_id"]
+    genre_id = reference_cache.get_key("genre", genre)
+    if genre_id:
+        return genre_id
 
     return 20
 
 
 def get_language_key(language: str) -> int:
     """Gets language key"""
-    curs = get_cursor(conn)
-    curs.execute("""SELECT language_id
-                   FROM languages
-                   WHERE language_name LIKE %s
-                 ;""",
-                 (language.strip(),))
-    data = curs.fetchone()
-    curs.close()
-    if data:
-        return data["language_id"]
+    language_id = reference_cache.get_key("language", language.strip())
+    if language_id:
+        return language_id
     return 32
 
 
 def get_country_key(country_code: str) -> int:
     """"Gets country key"""
-    curs = get_cursor(conn)
-    curs.execute("""SELECT country_id
-                   FROM country
-                   WHERE country_name LIKE %s;""",
-                 (country_code,))
-    data = curs.fetchone()
-    curs.close()
-    if data:
-        return data["country_id"]
+    country_id = reference_cache.get_key("country", country_code)
+    if country_id:
+        return country_id
     return 61
 
 
-def import_movies_to_database(movies_list: list[dict]) -> None:
+def parse_movie_row(row: dict) -> tuple[tuple, list[int]]:
+    """Cleans a csv row into movie column values and its distinct genre ids"""
+    release_date = datetime.strptime(row['date_x'].strip(), "%m/%d/%Y").date()
+    movie = (row['names'], release_date, row['score'], row['overview'],
+             row['orig_title'], get_language_key(row.get('orig_lang', 'No language')),
+             row['budget_x'], row['revenue'], get_country_key(row.get('country')))
+    genre_ids = list(dict.fromkeys(get_genre_key(genre)
+                                   for genre in row.get('genre').split(', ')))
+    return movie, genre_ids
+
+
+def parse_movies(rows: list[dict]) -> list[tuple[str, tuple, list[int]]]:
+    """Cleans a batch of csv rows into (fingerprint, movie, genre_ids), run in worker processes"""
+    parsed = []
+    for row in rows:
+        movie, genre_ids = parse_movie_row(row)
+        fingerprint = hashlib.md5(json.dumps([*movie, genre_ids], default=str)
+                                  .encode()).hexdigest()
+        parsed.append((fingerprint, movie, genre_ids))
+    return parsed
+
+
+def movie_key(movie: tuple) -> str:
+    """Gets the title|release date|country key shared by every repeat of a movie"""
+    return f"{movie[0]}|{movie[1].isoformat()}|{movie[8]}"
+
+
+def init_parse_worker(tables: dict[str, list[tuple[int, str]]]) -> None:
+    """Gives a worker process the parent's reference tables so it never queries the database"""
+    reference_cache.ttl = float("inf")
+    reference_cache.load(tables)
+
+
+def ordered_map(function: Callable, batches: Iterable[list], workers: int) -> Iterator[list]:
+    """Maps function over batches in a process pool, yielding results in input order.
+
+    At most two batches per worker are in flight, so a slow consumer stops the
+    csv being read ahead instead of letting parsed rows pile up in memory.
+    """
+    with ProcessPoolExecutor(workers, initializer=init_parse_worker,
+                             initargs=(reference_cache.dump(),)) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.submit(function, batch))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def parsed_batches(movies: Iterable[dict], batch_size: int = 1000,
+                   workers: int = 0) -> Iterator[list[tuple[str, tuple, list[int]]]]:
+    """Parses csv rows in batches, spread over worker processes when workers is set"""
+    batches = batched(movies, batch_size)
+    if workers:
+        return ordered_map(parse_movies, batches, workers)
+    return map(parse_movies, batches)
+
+
+def keyed_movies(movies: Iterable[dict], batch_size: int = 1000,
+                 workers: int = 0) -> Iterator[tuple[str, str, tuple, list[int]]]:
+    """Yields (source_key, fingerprint, movie, genre_ids) for each csv row.
+
+    The csv has no id, so a movie is keyed by title, release date and country,
+    numbering repeats in file order the same way migration 005 backfilled them.
+    Parsing can be spread over worker processes, keys are always assigned here
+    as they depend on every earlier row. That means holding a count for every
+    distinct key, so memory grows with the file; the COPY based imports stage
+    rows unkeyed and number repeats in SQL instead.
+    """
+    repeats = Counter()
+    for parsed in parsed_batches(movies, batch_size, workers):
+        for fingerprint, movie, genre_ids in parsed:
+            key = movie_key(movie)
+            repeats[key] += 1
+            if repeats[key] > 1:
+                key += f"#{repeats[key]}"
+            yield key, fingerprint, movie, genre_ids
+
+
+def refresh_stats_views() -> None:
+    """Rebuilds the statistics views once an import has committed, so /stats includes it"""
+    # database_functions imports this module, so its helper can only be imported once both are loaded
+    from database_functions import refresh_stats
+    refresh_stats()
+
+
+def import_movies_to_database(movies_list: Iterable[dict]) -> None:
     """Import movies to database"""
-    curs = get_cursor(conn)
-    for row in movies_list:
-        genre_list = row.get('genre').split(', ')
-        language_key = get_language_key(row.get('orig_lang', 'No language'))
-        country_key = get_country_key(row.get('country'))
-
-        # Insert movie details into the movie table
-        curs.execute("""INSERT INTO movie(title, release_date, score,
-                     overview, orig_title, orig_lang, budget, revenue,
-                     country_id)
-                     VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                     RETURNING movie_id;""",
-                     (row['names'], row['date_x'].strip(), row['score'],
-                      row['overview'], row['orig_title'], language_key,
-                      row['budget_x'], row['revenue'], country_key))
-        movie_id = curs.fetchone().get('movie_id')
+    with get_connection() as conn:
+        curs = get_cursor(conn)
+        for source_key, fingerprint, movie, genre_ids in keyed_movies(movies_list):
+            # Insert movie details into the movie table
+            curs.execute("""INSERT INTO movie(title, release_date, score,
+                         overview, orig_title, orig_lang, budget, revenue,
+                         country_id, source_key, fingerprint, genre_ids)
+                         VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                         RETURNING movie_id;""",
+                         (*movie, source_key, fingerprint, genre_ids))
+            movie_id = curs.fetchone().get('movie_id')
+            conn.commit()
+
+            # Insert genres into the movie_genres table
+            for genre_id in genre_ids:
+                curs.execute("""INSERT INTO movie_genres(movie_id, genre_id)
+                             VALUES (%s, %s);""",
+                             (movie_id, genre_id))
+                conn.commit()
+        curs.close()
+
+    refresh_stats_views()
+
+
+def copy_rows(curs: psycopg2.extensions.cursor, table: str,
+              columns: list[str], rows: list[tuple]) -> None:
+    """Streams rows into a table with COPY"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    curs.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                     buffer)
+
+
+# Every staged column but the key, which is only unique once repeats are numbered
+MOVIE_STAGING_COLUMNS = """fingerprint TEXT,
+                        title TEXT,
+                        release_date DATE,
+                        score FLOAT,
+                        overview TEXT,
+                        orig_title VARCHAR(191),
+                        orig_lang INT,
+                        budget FLOAT,
+                        revenue FLOAT,
+                        country_id INT,
+                        genre_ids INT[]"""
+STAGED_MOVIE_COLUMNS = ["source_key", "fingerprint", "title", "release_date", "score",
+                        "overview", "orig_title", "orig_lang", "budget", "revenue",
+                        "country_id", "genre_ids"]
+# Rows are staged by their chunk of the file and position in it, as keys need numbering
+STAGED_ROW_COLUMNS = ["chunk", "row_no", "base_key"] + STAGED_MOVIE_COLUMNS[1:]
+STAGED_ROWS_DDL = f"""chunk INT,
+                        row_no INT,
+                        base_key TEXT,
+                        {MOVIE_STAGING_COLUMNS}"""
+STAGED_GENRES_DDL = """chunk INT,
+                        row_no INT,
+                        genre_id BIGINT"""
+
+
+def array_literal(values: list[int]) -> str:
+    """Formats ids as a Postgres array literal for COPY"""
+    return "{" + ",".join(str(value) for value in values) + "}"
+
+
+def copy_parsed_movies(curs: psycopg2.extensions.cursor, movie_table: str, genre_table: str,
+                       chunk: int, row_no: int,
+                       parsed: list[tuple[str, tuple, list[int]]]) -> int:
+    """Copies parsed movies into staging tables numbered on from row_no, returning the last number"""
+    movie_rows = []
+    genre_rows = []
+    for fingerprint, movie, genre_ids in parsed:
+        row_no += 1
+        movie_rows.append((chunk, row_no, movie_key(movie), fingerprint, *movie,
+                           array_literal(genre_ids)))
+        genre_rows.extend((chunk, row_no, genre_id) for genre_id in genre_ids)
+
+    copy_rows(curs, movie_table, STAGED_ROW_COLUMNS, movie_rows)
+    copy_rows(curs, genre_table, ["chunk", "row_no", "genre_id"], genre_rows)
+    return row_no
+
+
+def stage_movies(curs: psycopg2.extensions.cursor, movies_list: Iterable[dict],
+                 movie_table: str, genre_table: str, batch_size: int,
+                 workers: int = 0) -> int:
+    """Copies csv rows into staging tables in batches, returning how many were staged"""
+    start = time.perf_counter()
+    staged = 0
+
+    for parsed in parsed_batches(movies_list, batch_size, workers):
+        staged = copy_parsed_movies(curs, movie_table, genre_table, 0, staged, parsed)
+
+        elapsed = time.perf_counter() - start
+        print(f"Staged {staged} movies ({staged / elapsed:.0f} rows/sec)")
+
+    return staged
+
+
+def numbered_movies(table: str) -> str:
+    """Selects staged rows with their source_key, numbering repeats in file order as keyed_movies does"""
+    return f"""SELECT chunk, row_no,
+               CASE WHEN repeat = 1 THEN base_key
+                    ELSE base_key || '#' || repeat END AS source_key,
+               {", ".join(STAGED_MOVIE_COLUMNS[1:])}
+               FROM (SELECT *, row_number() OVER (PARTITION BY base_key
+                                                  ORDER BY chunk, row_no) AS repeat
+                     FROM {table}) AS numbered
+               ORDER BY chunk, row_no"""
+
+
+def merge_staged_movies(curs: psycopg2.extensions.cursor, movie_table: str,
+                        genre_table: str) -> None:
+    """Inserts staged rows into movie and movie_genres with keys and ids in file order"""
+    curs.execute(f"ANALYZE {movie_table}, {genre_table};")
+
+    # Allocate ids up front so genres can be linked without reading them back
+    curs.execute(f"""CREATE TEMP TABLE movie_staging ON COMMIT DROP AS
+                 SELECT nextval(pg_get_serial_sequence('movie', 'movie_id')) AS movie_id, *
+                 FROM ({numbered_movies(movie_table)}) AS keyed;""")
+    curs.execute("""INSERT INTO movie(movie_id, title, release_date, score,
+                 overview, orig_title, orig_lang, budget, revenue,
+                 country_id, source_key, fingerprint, genre_ids)
+                 OVERRIDING SYSTEM VALUE
+                 SELECT movie_id, title, release_date, score, overview,
+                 orig_title, orig_lang, budget, revenue, country_id,
+                 source_key, fingerprint, genre_ids
+                 FROM movie_staging
+                 ORDER BY movie_id;""")
+    curs.execute(f"""INSERT INTO movie_genres(movie_id, genre_id)
+                 SELECT ms.movie_id, gs.genre_id
+                 FROM {genre_table} AS gs
+                 JOIN movie_staging AS ms
+                 ON ms.chunk = gs.chunk AND ms.row_no = gs.row_no
+                 ORDER BY ms.movie_id;""")
+
+
+def bulk_import_movies_to_database(movies_list: Iterable[dict], batch_size: int = 1000,
+                                   workers: int = 0) -> int:
+    """Import movies to database through COPY and set based inserts in one transaction"""
+    start = time.perf_counter()
+
+    with get_connection() as conn:
+        curs = get_cursor(conn)
+
+        curs.execute(f"""CREATE TEMP TABLE movie_import(
+                        {STAGED_ROWS_DDL}
+                     ) ON COMMIT DROP;
+                     CREATE TEMP TABLE genre_import(
+                        {STAGED_GENRES_DDL}
+                     ) ON COMMIT DROP;""")
+
+        total = stage_movies(curs, movies_list, "movie_import", "genre_import",
+                             batch_size, workers)
+        merge_staged_movies(curs, "movie_import", "genre_import")
+        conn.commit()
+        curs.close()
+
+    refresh_stats_views()
+    elapsed = time.perf_counter() - start
+    print(f"Imported {total} movies in {elapsed:.2f}s "
+          f"({total / elapsed if elapsed else 0:.0f} rows/sec)")
+    return total
+
+
+def sync_movies_to_database(movies_list: Iterable[dict], batch_size: int = 1000,
+                            workers: int = 0) -> dict[str, int]:
+    """Brings the movie table in line with the csv, writing only new, changed and removed movies"""
+    start = time.perf_counter()
+
+    with get_connection() as conn:
+        curs = get_cursor(conn)
+
+        curs.execute(f"""CREATE TEMP TABLE movie_import(
+                        {STAGED_ROWS_DDL}
+                     ) ON COMMIT DROP;
+                     CREATE TEMP TABLE genre_import(
+                        {STAGED_GENRES_DDL}
+                     ) ON COMMIT DROP;
+                     CREATE TEMP TABLE synced_movies(
+                        movie_id INT,
+                        source_key TEXT,
+                        inserted BOOLEAN
+                     ) ON COMMIT DROP;""")
+
+        total = stage_movies(curs, movies_list, "movie_import", "genre_import",
+                             batch_size, workers)
+        curs.execute(f"""CREATE TEMP TABLE movie_sync ON COMMIT DROP AS
+                     {numbered_movies("movie_import")};
+                     ALTER TABLE movie_sync ADD PRIMARY KEY (source_key);
+                     ANALYZE movie_sync, genre_import;""")
+
+        # Movies loaded before migration 005 have no fingerprint. Where they still match
+        # the csv they take its fingerprint, so they are not rewritten with a new version
+        values = STAGED_MOVIE_COLUMNS[2:]
+        curs.execute(f"""UPDATE movie AS m SET fingerprint = s.fingerprint
+                     FROM movie_sync AS s
+                     WHERE m.source_key = s.source_key
+                     AND m.fingerprint IS NULL
+                     AND ({", ".join(f"m.{column}" for column in values)})
+                         IS NOT DISTINCT FROM ({", ".join(f"s.{column}" for column in values)});""")
+
+        # Rows whose fingerprint matches are never written, so only changes cost WAL
+        curs.execute(f"""WITH upserted AS (
+                        INSERT INTO movie(title, release_date, score, overview,
+                        orig_title, orig_lang, budget, revenue, country_id,
+                        source_key, fingerprint, genre_ids)
+                        SELECT s.title, s.release_date, s.score, s.overview,
+                        s.orig_title, s.orig_lang, s.budget, s.revenue, s.country_id,
+                        s.source_key, s.fingerprint, s.genre_ids
+                        FROM movie_sync AS s
+                        LEFT JOIN movie AS m ON m.source_key = s.source_key
+                        WHERE m.fingerprint IS DISTINCT FROM s.fingerprint
+                        ON CONFLICT (source_key) DO UPDATE SET
+                            {", ".join(f"{column} = EXCLUDED.{column}"
+                                       for column in STAGED_MOVIE_COLUMNS[1:])},
+                            version = movie.version + 1
+                        RETURNING movie_id, source_key, xmax = 0 AS inserted
+                     )
+                     INSERT INTO synced_movies SELECT * FROM upserted;""")
+        upserted = curs.rowcount
+
+        curs.execute("""DELETE FROM movie_genres AS mg
+                     USING synced_movies AS sm
+                     WHERE mg.movie_id = sm.movie_id
+                     AND NOT EXISTS (SELECT 1 FROM movie_sync AS s
+                                     JOIN genre_import AS gs
+                                     ON gs.chunk = s.chunk AND gs.row_no = s.row_no
+                                     WHERE s.source_key = sm.source_key
+                                     AND gs.genre_id = mg.genre_id);""")
+        curs.execute("""INSERT INTO movie_genres(movie_id, genre_id)
+                     SELECT sm.movie_id, gs.genre_id
+                     FROM synced_movies AS sm
+                     JOIN movie_sync AS s ON s.source_key = sm.source_key
+                     JOIN genre_import AS gs ON gs.chunk = s.chunk AND gs.row_no = s.row_no
+                     ON CONFLICT (movie_id, genre_id) DO NOTHING;""")
+
+        # Only movies an import created are removed, never ones added through the API
+        curs.execute("""DELETE FROM movie AS m
+                     WHERE m.fingerprint IS NOT NULL
+                     AND NOT EXISTS (SELECT 1 FROM movie_sync AS s
+                                     WHERE s.source_key = m.source_key);""")
+        deleted = curs.rowcount
+
+        curs.execute("SELECT count(*) AS inserted FROM synced_movies WHERE inserted;")
+        inserted = curs.fetchone()["inserted"]
+        conn.commit()
+        curs.close()
+
+    if upserted or deleted:
+        refresh_stats_views()
+    counts = {"inserted": inserted, "updated": upserted - inserted,
+              "unchanged": total - upserted, "deleted": deleted}
+    elapsed = time.perf_counter() - start
+    print(f"Synced {total} movies in {elapsed:.2f}s: " +
+          ", ".join(f"{count} {name}" for name, count in counts.items()))
+    return counts
+
+
+def chunk_ranges(filename: str, chunks: int) -> list[tuple[int, int]]:
+    """Splits the csv after its header into about equal byte ranges that start on a record.
+
+    Quoted fields may hold newlines, so a line only starts a record when an
+    even number of quotes came before it.
+    """
+    size = os.path.getsize(filename)
+    ranges = []
+    with open(filename, "rb") as f:
+        f.readline()
+        start = position = f.tell()
+        target = start + (size - start) / chunks
+        quoted = False
+
+        for line in f:
+            if not quoted and position >= target and position > start:
+                ranges.append((start, position))
+                start = position
+                target = start + (size - start) / (chunks - len(ranges))
+            position += len(line)
+            quoted ^= line.count(b'"') % 2 == 1
+
+    if position > start:
+        ranges.append((start, position))
+    return ranges
+
+
+def read_range(filename: str, start: int, end: int) -> Iterator[dict]:
+    """Streams the csv rows held between two byte offsets from chunk_ranges"""
+    with open(filename, "rb") as f:
+        header = next(csv.reader([f.readline().decode("utf-8")]))
+        f.seek(start)
+
+        def lines():
+            position = start
+            while position < end:
+                line = f.readline()
+                position += len(line)
+                yield line.decode("utf-8")
+
+        yield from csv.DictReader(lines(), fieldnames=header)
+
+
+def load_chunk(filename: str, chunk: int, start: int, end: int, movie_table: str,
+               genre_table: str, tables: dict[str, list[tuple[int, str]]],
+               batch_size: int) -> int:
+    """Parses one byte range of the csv and copies it into the shared staging tables"""
+    init_parse_worker(tables)
+    staged = 0
+
+    with get_connection() as conn:
+        curs = get_cursor(conn)
+        for batch in batched(read_range(filename, start, end), batch_size):
+            staged = copy_parsed_movies(curs, movie_table, genre_table, chunk, staged,
+                                        parse_movies(batch))
         conn.commit()
+        curs.close()
 
-        # Insert genres into the movie_genres table
-        for genre in genre_list:
-            genre_id = get_genre_key(genre)
-            curs.execute("""INSERT INTO movie_genres(movie_id, genre_id)
-                         VALUES (%s, %s);""",
-                         (movie_id, genre_id))
+    print(f"Staged chunk {chunk}: {staged} movies")
+    return staged
+
+
+def drop_tables(conn: psycopg2.extensions.connection, curs: psycopg2.extensions.cursor,
+                tables: list[str]) -> None:
+    """Drops tables outside of any transaction left open"""
+    conn.rollback()
+    curs.execute(f"DROP TABLE IF EXISTS {', '.join(tables)};")
+    conn.commit()
+
+
+def parallel_import_movies_to_database(filename: str, workers: int = None,
+                                       batch_size: int = 1000) -> int:
+    """Import movies by loading byte ranges of the csv in parallel, then merging them in one transaction"""
+    start = time.perf_counter()
+    workers = workers or os.cpu_count()
+    # Named per process so two imports never share staging tables
+    movie_table = f"movie_import_{os.getpid()}"
+    genre_table = f"genre_import_{os.getpid()}"
+
+    with get_connection() as conn:
+        curs = get_cursor(conn)
+        # Unlogged, as the rows are only kept until the merge
+        curs.execute(f"""CREATE UNLOGGED TABLE {movie_table}(
+                        {STAGED_ROWS_DDL}
+                     );
+                     CREATE UNLOGGED TABLE {genre_table}(
+                        {STAGED_GENRES_DDL}
+                     );""")
+        conn.commit()
+
+        try:
+            ranges = chunk_ranges(filename, workers)
+            # Spawned workers open their own connections instead of sharing this pool's sockets
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = [pool.submit(load_chunk, filename, chunk, chunk_start, chunk_end,
+                                       movie_table, genre_table, reference_cache.dump(),
+                                       batch_size)
+                           for chunk, (chunk_start, chunk_end) in enumerate(ranges)]
+                total = sum(future.result() for future in futures)
+
+            merge_staged_movies(curs, movie_table, genre_table)
             conn.commit()
+        except BaseException:
+            # Failing to drop the tables must not hide why the import stopped
+            with contextlib.suppress(psycopg2.Error):
+                drop_tables(conn, curs, [movie_table, genre_table])
+            raise
+        drop_tables(conn, curs, [movie_table, genre_table])
+        curs.close()
+
+    refresh_stats_views()
+    elapsed = time.perf_counter() - start
+    print(f"Imported {total} movies in {elapsed:.2f}s with {len(ranges)} workers "
+          f"({total / elapsed if elapsed else 0:.0f} rows/sec)")
+    return total
 
 
 if __name__ == "__main__":
-    movies = load_to_csv("imdb_movies.csv")
-    import_movies_to_database(movies)
+    parser = argparse.ArgumentParser(description="Load a movies csv into the database")
+    parser.add_argument("filename", nargs="?", default="imdb_movies.csv")
+    parser.add_argument("--mode", choices=["bulk", "parallel", "rows", "sync"], default="bulk",
+                        help="bulk loads through COPY, parallel loads chunks of the file in "
+                             "worker processes, rows inserts one movie at a time, "
+                             "sync updates an existing catalogue with only what changed")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="rows parsed and copied per batch")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="processes to parse the csv with, 0 parses in this process "
+                             "(in parallel mode, loading processes, 0 uses every core)")
+    args = parser.parse_args()
+
+    movies = read_movies(args.filename)
+    if args.mode == "parallel":
+        parallel_import_movies_to_database(args.filename, args.workers, args.batch_size)
+    elif args.mode == "bulk":
+        bulk_import_movies_to_database(movies, args.batch_size, args.workers)
+    elif args.mode == "sync":
+        sync_movies_to_database(movies, args.batch_size, args.workers)
+    else:
+        import_movies_to_database(movies)
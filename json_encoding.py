@@ -0,0 +1,94 @@
+"""Fast JSON encoding of responses, with movie rows cached as pre-encoded fragments"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Rows holding anything else, such as a search's relevance, are encoded every time
+FRAGMENT_COLUMNS = {"movie_id", "title", "release_date", "score", "overview", "orig_title",
+                    "orig_lang", "budget", "revenue", "country_id", "version", "genre_ids",
+                    "genres"}
+
+
+def default(obj):
+    """Encodes the types the standard JSON encoder cannot, as Flask does"""
+    if isinstance(obj, date):
+        return http_date(obj)
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> bytes:
+    """Encodes obj as compact JSON with sorted keys, using orjson when it is installed"""
+    if orjson is not None:
+        # Dates are passed to default so they keep Flask's HTTP date format
+        return orjson.dumps(obj, default=default,
+                            option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(obj, default=default, sort_keys=True, separators=(",", ":")).encode()
+
+
+class FragmentCache:
+    """Thread safe LRU of encoded movie rows keyed by movie_id, version and columns"""
+
+    def __init__(self, max_entries: int = 20000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, tuple] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, row: dict) -> bytes:
+        """Gets a movie row's JSON, encoding it only the first time this version is seen"""
+        if not self.max_entries or "version" not in row or "movie_id" not in row:
+            return dumps(row)
+
+        key = (row["movie_id"], row["version"], tuple(row))
+        # Genre names come from the reference cache, so they can change without a new version
+        genres = row.get("genres")
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == genres:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        fragment = dumps(row)
+        # Only stored rows can be hits, so the columns are checked here alone
+        if FRAGMENT_COLUMNS.issuperset(row):
+            with self._lock:
+                self._entries[key] = (genres, fragment)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return fragment
+
+    def encode_list(self, rows: list[dict]) -> bytes:
+        """Joins the rows' fragments into a JSON array"""
+        return b"[" + b",".join([self.encode(row) for row in rows]) + b"]"
+
+    def clear(self) -> None:
+        """Drops every fragment and resets the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """Returns the cache size and hit counts for monitoring"""
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
+
+
+fragment_cache = FragmentCache(int(os.environ.get("MOVIES_JSON_FRAGMENT_CACHE_SIZE", 20000)))
@@ -0,0 +1,289 @@
+"""Request, query and serialisation metrics exposed in the Prometheus text format"""
+
+import contextvars
+import inspect
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+import psycopg2.extras
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from json_encoding import dumps, fragment_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_QUERY_SECONDS = float(os.environ.get("MOVIES_SLOW_QUERY_MS", 500)) / 1000
+
+# Name of the database function whose queries are currently running
+current_query = contextvars.ContextVar("current_query", default="unlabelled")
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    """Renders label pairs as {name="value",...}"""
+    pairs = [name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic count per combination of label values"""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        """Adds amount to the count for the given label values"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        """Renders the counter's samples"""
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative bucketed observations per combination of label values"""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # Per label values: a count for each bucket plus +Inf, then the sum
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float) -> None:
+        """Records one observation"""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def render(self) -> list[str]:
+        """Renders the histogram's buckets, sum and count"""
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, counts in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip((*self.buckets, "+Inf"), counts):
+                    cumulative += count
+                    bucket = format_labels(self.labels, labels, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+                rendered = format_labels(self.labels, labels)
+                lines.append(f"{self.name}_sum{rendered} {counts[-1]}")
+                lines.append(f"{self.name}_count{rendered} {cumulative}")
+        return lines
+
+
+REQUESTS = Counter("movies_http_requests_total", "HTTP requests handled",
+                   ("method", "route", "status"))
+REQUEST_SECONDS = Histogram("movies_http_request_duration_seconds",
+                            "Time to build each HTTP response", ("method", "route"))
+QUERY_SECONDS = Histogram("movies_db_query_duration_seconds",
+                          "Time spent in each database function's queries", ("query", "phase"))
+QUERY_ROWS = Counter("movies_db_query_rows_total",
+                     "Rows returned by each database function", ("query",))
+JSON_SECONDS = Histogram("movies_json_encode_duration_seconds",
+                         "Time spent serialising JSON per route", ("route",))
+
+METRICS = [REQUESTS, REQUEST_SECONDS, QUERY_SECONDS, QUERY_ROWS, JSON_SECONDS]
+
+
+def render_gauges(name: str, documentation: str, values: dict) -> list[str]:
+    """Renders a snapshot such as pool statistics as one gauge per key"""
+    lines = []
+    for key, value in values.items():
+        lines.extend([f"# HELP {name}_{key} {documentation} ({key})",
+                      f"# TYPE {name}_{key} gauge",
+                      f"{name}_{key} {value}"])
+    return lines
+
+
+def render_metrics(gauges: dict[str, tuple[str, dict]] = None) -> str:
+    """Renders every metric, plus snapshot gauges, in the Prometheus text format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for name, (documentation, values) in (gauges or {}).items():
+        lines.extend(render_gauges(name, documentation, values))
+    return "\n".join(lines) + "\n"
+
+
+def instrumented(function):
+    """Labels the queries run by a database function with its name"""
+    name = function.__name__
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        token = current_query.set(name)
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            current_query.reset(token)
+
+        if inspect.isgenerator(result):
+            return labelled_rows(result, name)
+        return result
+
+    return wrapper
+
+
+def labelled_rows(rows, name: str):
+    """Iterates a streamed result with its queries labelled, as they only run once iterated"""
+    context = contextvars.copy_context()
+    context.run(current_query.set, name)
+    try:
+        while True:
+            try:
+                row = context.run(next, rows)
+            except StopIteration:
+                return
+            yield row
+    finally:
+        rows.close()
+
+
+class InstrumentedCursor(psycopg2.extras.RealDictCursor):
+    """Dict cursor that times each statement's execute and fetch separately and logs slow ones"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.label = current_query.get()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.execute_seconds = 0.0
+        self.fetch_seconds = 0.0
+        self.rows_fetched = 0
+        self.statement = None
+
+    def execute(self, query, vars=None):
+        # A cursor can run many statements, each is recorded on its own
+        if self.statement is not None:
+            self.record()
+
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self.execute_seconds += time.perf_counter() - start
+            self.statement = self.query
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            self.fetch_seconds += time.perf_counter() - start
+
+    def fetchone(self):
+        row = self._timed_fetch(super().fetchone)
+        self.rows_fetched += row is not None
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed_fetch(super().fetchmany, size or self.arraysize)
+        self.rows_fetched += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed_fetch(super().fetchall)
+        self.rows_fetched += len(rows)
+        return rows
+
+    def __iter__(self):
+        # Server side cursors fetch in batches while being iterated
+        rows = super().__iter__()
+        while True:
+            start = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                self.fetch_seconds += time.perf_counter() - start
+                return
+            self.fetch_seconds += time.perf_counter() - start
+            self.rows_fetched += 1
+            yield row
+
+    def close(self):
+        if not self.closed and self.statement is not None:
+            self.record()
+        super().close()
+
+    def record(self) -> None:
+        """Publishes the last statement's timings and logs it if it was slow"""
+        QUERY_SECONDS.observe((self.label, "execute"), self.execute_seconds)
+        QUERY_SECONDS.observe((self.label, "fetch"), self.fetch_seconds)
+        QUERY_ROWS.inc((self.label,), self.rows_fetched)
+
+        elapsed = self.execute_seconds + self.fetch_seconds
+        if elapsed >= SLOW_QUERY_SECONDS:
+            statement = (self.statement or b"").decode(errors="replace")
+            logger.warning("Slow query in %s took %.1f ms (execute %.1f ms, fetch %.1f ms, "
+                           "%d rows): %s", self.label, elapsed * 1000,
+                           self.execute_seconds * 1000, self.fetch_seconds * 1000,
+                           self.rows_fetched, " ".join(statement.split())[:1000])
+        self._reset()
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes with the fast encoder and records how long it takes per route"""
+
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            # Indented debug output is left to the standard encoder
+            if "indent" in kwargs:
+                return super().dumps(obj, **kwargs)
+            return dumps(obj).decode()
+        finally:
+            observe_json_seconds(start)
+
+    def movies_response(self, movies):
+        """Returns a movie, or a list of them, as JSON built from their cached fragments"""
+        start = time.perf_counter()
+        try:
+            if isinstance(movies, list):
+                body = fragment_cache.encode_list(movies) + b"\n"
+            else:
+                body = fragment_cache.encode(movies) + b"\n"
+        finally:
+            observe_json_seconds(start)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+    def row_bytes(self, row: dict) -> bytes:
+        """Gets one movie row's JSON from its cached fragment"""
+        start = time.perf_counter()
+        try:
+            return fragment_cache.encode(row)
+        finally:
+            observe_json_seconds(start)
+
+
+def observe_json_seconds(start: float) -> None:
+    """Records time spent serialising JSON against the current route"""
+    route = (request.url_rule.rule if has_request_context() and request.url_rule
+             else "unmatched")
+    JSON_SECONDS.observe((route,), time.perf_counter() - start)
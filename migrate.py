@@ -0,0 +1,52 @@
+"""Script that applies the versioned SQL migrations to our psql movies database"""
+
+import os
+from connection_pool import get_connection
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def get_migrations() -> list[tuple[str, str]]:
+    """Gets every migration file as (version, path), in version order"""
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        if filename.endswith(".sql"):
+            migrations.append((filename.removesuffix(".sql"),
+                               os.path.join(MIGRATIONS_DIR, filename)))
+    return migrations
+
+
+def apply_migrations() -> list[str]:
+    """Applies every migration not yet recorded, each in its own transaction"""
+    applied = []
+    with get_connection() as conn:
+        curs = conn.cursor()
+        curs.execute("""CREATE TABLE IF NOT EXISTS schema_migrations(
+                        version TEXT PRIMARY KEY,
+                        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                     );""")
+        conn.commit()
+
+        curs.execute("SELECT version FROM schema_migrations;")
+        done = {row[0] for row in curs.fetchall()}
+
+        for version, path in get_migrations():
+            if version in done:
+                continue
+
+            with open(path, encoding="utf-8") as f:
+                curs.execute(f.read())
+            curs.execute("INSERT INTO schema_migrations(version) VALUES (%s);",
+                         (version,))
+            conn.commit()
+            applied.append(version)
+            print(f"Applied migration {version}")
+
+        curs.close()
+
+    return applied
+
+
+if __name__ == "__main__":
+    if not apply_migrations():
+        print("Database is up to date")
@@ -0,0 +1,15 @@
+-- Full text and trigram search over movie titles and overviews
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Kept up to date by Postgres on every insert and update
+ALTER TABLE movie ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', title), 'A') ||
+        setweight(to_tsvector('english', orig_title), 'B') ||
+        setweight(to_tsvector('english', overview), 'C')
+    ) STORED;
+
+CREATE INDEX movie_search_vector_idx ON movie USING GIN (search_vector);
+
+CREATE INDEX movie_title_trgm_idx ON movie USING GIN (title gin_trgm_ops);
@@ -0,0 +1,39 @@
+-- Foreign keys plus indexes matching the filter and sort of each endpoint
+
+ALTER TABLE movie
+    ADD CONSTRAINT movie_country_id_fkey
+    FOREIGN KEY (country_id) REFERENCES country(country_id);
+
+ALTER TABLE movie
+    ADD CONSTRAINT movie_orig_lang_fkey
+    FOREIGN KEY (orig_lang) REFERENCES languages(language_id);
+
+-- Deleting a movie removes its genre links rather than leaving orphans
+ALTER TABLE movie_genres
+    ADD CONSTRAINT movie_genres_movie_id_fkey
+    FOREIGN KEY (movie_id) REFERENCES movie(movie_id) ON DELETE CASCADE;
+
+ALTER TABLE movie_genres
+    ADD CONSTRAINT movie_genres_genre_id_fkey
+    FOREIGN KEY (genre_id) REFERENCES genre(genre_id);
+
+-- GET /movies?sort_by=... keyset pages on (sort key, movie_id)
+CREATE INDEX movie_title_idx ON movie (title, movie_id);
+CREATE INDEX movie_release_date_idx ON movie (release_date, movie_id);
+CREATE INDEX movie_revenue_idx ON movie (revenue, movie_id);
+CREATE INDEX movie_budget_idx ON movie (budget, movie_id);
+CREATE INDEX movie_score_idx ON movie (score, movie_id);
+
+-- GET /countries/<code>?sort_by=... filters on country then pages on the sort key
+CREATE INDEX movie_country_idx ON movie (country_id, movie_id);
+CREATE INDEX movie_country_title_idx ON movie (country_id, title, movie_id);
+CREATE INDEX movie_country_release_date_idx ON movie (country_id, release_date, movie_id);
+CREATE INDEX movie_country_revenue_idx ON movie (country_id, revenue, movie_id);
+CREATE INDEX movie_country_budget_idx ON movie (country_id, budget, movie_id);
+CREATE INDEX movie_country_score_idx ON movie (country_id, score, movie_id);
+
+CREATE INDEX movie_orig_lang_idx ON movie (orig_lang);
+
+-- GET /genres/<id>/movies walks genre -> movie, deletes cascade movie -> genre
+CREATE INDEX movie_genres_genre_id_idx ON movie_genres (genre_id, movie_id);
+CREATE INDEX movie_genres_movie_id_idx ON movie_genres (movie_id);
@@ -0,0 +1,72 @@
+-- Materialized rollups behind the /stats endpoints, refreshed concurrently after writes
+
+CREATE MATERIALIZED VIEW genre_stats AS
+SELECT g.genre_id,
+    g.genre_name,
+    COUNT(m.movie_id) AS movie_count,
+    AVG(m.score) AS avg_score,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY m.score) AS median_score,
+    SUM(m.budget) AS total_budget,
+    AVG(m.budget) AS avg_budget,
+    SUM(m.revenue) AS total_revenue,
+    AVG(m.revenue) AS avg_revenue,
+    percentile_cont(ARRAY[0.25, 0.5, 0.75, 0.9]) WITHIN GROUP (
+        ORDER BY (m.revenue - m.budget) / m.budget) FILTER (WHERE m.budget > 0) AS roi_percentiles
+FROM genre AS g
+JOIN movie_genres AS mg ON mg.genre_id = g.genre_id
+JOIN movie AS m ON m.movie_id = mg.movie_id
+GROUP BY g.genre_id, g.genre_name;
+
+CREATE UNIQUE INDEX genre_stats_genre_id_idx ON genre_stats (genre_id);
+
+CREATE MATERIALIZED VIEW country_stats AS
+SELECT c.country_id,
+    c.country_name,
+    COUNT(m.movie_id) AS movie_count,
+    AVG(m.score) AS avg_score,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY m.score) AS median_score,
+    SUM(m.budget) AS total_budget,
+    AVG(m.budget) AS avg_budget,
+    SUM(m.revenue) AS total_revenue,
+    AVG(m.revenue) AS avg_revenue,
+    percentile_cont(ARRAY[0.25, 0.5, 0.75, 0.9]) WITHIN GROUP (
+        ORDER BY (m.revenue - m.budget) / m.budget) FILTER (WHERE m.budget > 0) AS roi_percentiles
+FROM country AS c
+JOIN movie AS m ON m.country_id = c.country_id
+GROUP BY c.country_id, c.country_name;
+
+CREATE UNIQUE INDEX country_stats_country_id_idx ON country_stats (country_id);
+
+CREATE MATERIALIZED VIEW language_stats AS
+SELECT l.language_id,
+    l.language_name,
+    COUNT(m.movie_id) AS movie_count,
+    AVG(m.score) AS avg_score,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY m.score) AS median_score,
+    SUM(m.budget) AS total_budget,
+    AVG(m.budget) AS avg_budget,
+    SUM(m.revenue) AS total_revenue,
+    AVG(m.revenue) AS avg_revenue,
+    percentile_cont(ARRAY[0.25, 0.5, 0.75, 0.9]) WITHIN GROUP (
+        ORDER BY (m.revenue - m.budget) / m.budget) FILTER (WHERE m.budget > 0) AS roi_percentiles
+FROM languages AS l
+JOIN movie AS m ON m.orig_lang = l.language_id
+GROUP BY l.language_id, l.language_name;
+
+CREATE UNIQUE INDEX language_stats_language_id_idx ON language_stats (language_id);
+
+CREATE MATERIALIZED VIEW year_stats AS
+SELECT EXTRACT(YEAR FROM m.release_date)::INT AS release_year,
+    COUNT(m.movie_id) AS movie_count,
+    AVG(m.score) AS avg_score,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY m.score) AS median_score,
+    SUM(m.budget) AS total_budget,
+    AVG(m.budget) AS avg_budget,
+    SUM(m.revenue) AS total_revenue,
+    AVG(m.revenue) AS avg_revenue,
+    percentile_cont(ARRAY[0.25, 0.5, 0.75, 0.9]) WITHIN GROUP (
+        ORDER BY (m.revenue - m.budget) / m.budget) FILTER (WHERE m.budget > 0) AS roi_percentiles
+FROM movie AS m
+GROUP BY release_year;
+
+CREATE UNIQUE INDEX year_stats_release_year_idx ON year_stats (release_year);
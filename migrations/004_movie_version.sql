@@ -0,0 +1,4 @@
+-- Row version for optimistic concurrency on PATCH /movies/<id>
+
+-- A constant default only touches the catalog, so existing rows are not rewritten
+ALTER TABLE movie ADD COLUMN version INT NOT NULL DEFAULT 1;
@@ -0,0 +1,36 @@
+-- Natural keys and row fingerprints so imports.py can sync the csv incrementally
+
+-- title|release_date|country_id, with #2, #3... for repeats in file order
+ALTER TABLE movie ADD COLUMN source_key TEXT;
+-- Hash of the csv row a movie was last loaded from, NULL for movies added through the API
+ALTER TABLE movie ADD COLUMN fingerprint TEXT;
+
+-- Movies were imported in file order, so movie_id order numbers the repeats the same way
+UPDATE movie SET source_key = keyed.source_key
+FROM (
+    SELECT movie_id,
+        title || '|' || release_date || '|' || country_id
+            || CASE WHEN repeat > 1 THEN '#' || repeat ELSE '' END AS source_key
+    FROM (
+        SELECT movie_id, title, release_date, country_id,
+            row_number() OVER (PARTITION BY title, release_date, country_id
+                               ORDER BY movie_id) AS repeat
+        FROM movie
+    ) AS numbered
+) AS keyed
+WHERE movie.movie_id = keyed.movie_id;
+
+CREATE UNIQUE INDEX movie_source_key_idx ON movie (source_key);
+
+-- Genre links become upsertable, one per movie and genre
+DELETE FROM movie_genres AS duplicate
+USING movie_genres AS kept
+WHERE duplicate.movie_id = kept.movie_id
+AND duplicate.genre_id = kept.genre_id
+AND duplicate.id > kept.id;
+
+ALTER TABLE movie_genres
+    ADD CONSTRAINT movie_genres_movie_id_genre_id_key UNIQUE (movie_id, genre_id);
+
+-- The unique index leads with movie_id, so it also serves cascading deletes
+DROP INDEX movie_genres_movie_id_idx;
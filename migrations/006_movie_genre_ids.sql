@@ -0,0 +1,16 @@
+-- Each movie's genre ids copied from movie_genres, so genre lookups need no join
+
+-- A constant default only touches the catalog, so existing rows are not rewritten here
+ALTER TABLE movie ADD COLUMN genre_ids INT[] NOT NULL DEFAULT '{}';
+
+-- Kept in the order the genres were linked, which is the csv's order
+UPDATE movie SET genre_ids = linked.genre_ids
+FROM (
+    SELECT movie_id, array_agg(genre_id::int ORDER BY id) AS genre_ids
+    FROM movie_genres
+    GROUP BY movie_id
+) AS linked
+WHERE movie.movie_id = linked.movie_id;
+
+-- GET /genres/<id>/movies (@>) and GET /movies?genre= (&&) are answered from this index
+CREATE INDEX movie_genre_ids_idx ON movie USING GIN (genre_ids);
@@ -0,0 +1,39 @@
+-- Tells listeners such as the in-process catalogue snapshot which movies changed
+
+-- One notification per statement listing the changed ids, or '*' when a statement
+-- touches so many movies (an import, say) that reloading everything is cheaper
+CREATE OR REPLACE FUNCTION notify_movie_changes() RETURNS trigger AS $$
+DECLARE
+    changed_ids TEXT;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        PERFORM pg_notify('movie_changes', '*');
+        RETURN NULL;
+    END IF;
+
+    SELECT CASE WHEN count(*) > 500 THEN '*' ELSE string_agg(movie_id::text, ',') END
+    INTO changed_ids
+    FROM (SELECT movie_id FROM changed_movies LIMIT 501) AS changed;
+
+    IF changed_ids IS NOT NULL THEN
+        PERFORM pg_notify('movie_changes', changed_ids);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- Transition tables allow a single event per trigger, so each event has its own
+CREATE TRIGGER movie_insert_notify AFTER INSERT ON movie
+    REFERENCING NEW TABLE AS changed_movies
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_movie_changes();
+
+CREATE TRIGGER movie_update_notify AFTER UPDATE ON movie
+    REFERENCING NEW TABLE AS changed_movies
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_movie_changes();
+
+CREATE TRIGGER movie_delete_notify AFTER DELETE ON movie
+    REFERENCING OLD TABLE AS changed_movies
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_movie_changes();
+
+CREATE TRIGGER movie_truncate_notify AFTER TRUNCATE ON movie
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_movie_changes();
@@ -0,0 +1,283 @@
+"""Similar movie recommendations from overview TF-IDF vectors and shared genres, language and country"""
+
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+import numpy as np
+import psycopg2
+from scipy import sparse
+from connection_pool import PoolTimeoutError, get_connection
+from imports import get_cursor
+from metrics import instrumented
+
+logger = logging.getLogger(__name__)
+
+# Share of the similarity score each kind of feature contributes, adding up to 1
+WEIGHTS = {"overview": 0.6, "genres": 0.25, "language": 0.1, "country": 0.05}
+DEFAULT_SIMILAR = 10
+MAX_SIMILAR = 100
+# Words in fewer movies than this can only ever match their own movie
+MIN_DOCUMENT_FREQUENCY = 2
+# Words in more than this share of movies say little about any of them
+MAX_DOCUMENT_SHARE = 0.5
+WORD = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset("""a about after all also an and any are as at be been before but by can
+    could do does for from had has have he her his how if in into is it its just more most my
+    no not of on one or other our out over she so some than that the their them then there
+    these they this those through to up was we were what when where which while who will with
+    would you your""".split())
+
+
+def parse_similar_limit(limit: str) -> int:
+    """Parses how many similar movies to return, returning None if it is not a whole number in range"""
+    try:
+        limit = int(limit)
+    except ValueError:
+        return None
+
+    return limit if 1 <= limit <= MAX_SIMILAR else None
+
+
+def tokenize(text: str) -> list[str]:
+    """Splits text into lower case words, leaving out stop words"""
+    return [word for word in WORD.findall(text.lower())
+            if len(word) > 1 and word not in STOP_WORDS]
+
+
+class SimilarityModel:
+    """Feature vectors of every movie from one read of the catalogue, with later writes layered on top.
+
+    Each movie's overview TF-IDF vector and genre vector are normalised and scaled
+    by the square root of their weight, so the dot product of two movies is the
+    weighted sum of their cosine similarities. Language and country only ever
+    match exactly, so they are compared as arrays instead of stored as features.
+    """
+
+    def __init__(self, movies: list[dict]):
+        self.built_at = time.time()
+        documents = [Counter(tokenize(movie["overview"] or "")) for movie in movies]
+        frequencies = Counter(word for document in documents for word in document)
+        most = MAX_DOCUMENT_SHARE * len(movies)
+        words = sorted(word for word, frequency in frequencies.items()
+                       if MIN_DOCUMENT_FREQUENCY <= frequency <= most)
+
+        self.columns = {word: column for column, word in enumerate(words)}
+        self.idf = {word: math.log((1 + len(movies)) / (1 + frequencies[word])) + 1
+                    for word in words}
+        genre_ids = sorted({genre_id for movie in movies for genre_id in movie["genre_ids"]})
+        self.genre_columns = {genre_id: len(words) + index
+                              for index, genre_id in enumerate(genre_ids)}
+        self.width = len(words) + len(genre_ids)
+
+        self.movie_ids = np.array([movie["movie_id"] for movie in movies], dtype=np.int64)
+        self.positions = {movie["movie_id"]: position for position, movie in enumerate(movies)}
+        self.languages = np.array([movie["orig_lang"] for movie in movies], dtype=np.int64)
+        self.countries = np.array([movie["country_id"] for movie in movies], dtype=np.int64)
+        self.vectors = self.to_matrix([self.features(movie, document)
+                                       for movie, document in zip(movies, documents)])
+        # Feature by movie, so a query only reads the movies sharing one of its features
+        self.postings = self.vectors.T.tocsr()
+
+        # Built movies that were changed or deleted since
+        self.stale = np.zeros(len(movies), dtype=bool)
+        # Features of movies added or changed since, by movie_id
+        self.changes = {}
+        self.changed = self.changed_arrays()
+
+    def features(self, movie: dict, document: Counter = None) -> tuple[list[int], list[float]]:
+        """Gets a movie's feature columns and values in the vocabulary of this build"""
+        if document is None:
+            document = Counter(tokenize(movie["overview"] or ""))
+
+        text = {self.columns[word]: (1 + math.log(count)) * self.idf[word]
+                for word, count in document.items() if word in self.columns}
+        genres = [self.genre_columns[genre_id] for genre_id in dict.fromkeys(movie["genre_ids"])
+                  if genre_id in self.genre_columns]
+
+        columns, values = [], []
+        norm = math.sqrt(sum(value * value for value in text.values()))
+        if norm:
+            scale = math.sqrt(WEIGHTS["overview"]) / norm
+            columns.extend(text)
+            values.extend(value * scale for value in text.values())
+        if genres:
+            columns.extend(genres)
+            values.extend([math.sqrt(WEIGHTS["genres"] / len(genres))] * len(genres))
+        return columns, values
+
+    def to_matrix(self, features: list[tuple[list[int], list[float]]]) -> sparse.csr_matrix:
+        """Stacks feature lists into a movie by feature matrix"""
+        indptr = np.zeros(len(features) + 1, dtype=np.int64)
+        np.cumsum([len(columns) for columns, _ in features], out=indptr[1:])
+        indices = np.fromiter((column for columns, _ in features for column in columns),
+                              dtype=np.int32, count=indptr[-1])
+        data = np.fromiter((value for _, values in features for value in values),
+                           dtype=np.float32, count=indptr[-1])
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(features), self.width))
+
+    def changed_arrays(self) -> tuple:
+        """Gets the ids, feature matrix, languages and countries of the changed movies"""
+        changes = list(self.changes.items())
+        return (np.array([movie_id for movie_id, _ in changes], dtype=np.int64),
+                self.to_matrix([change[:2] for _, change in changes]),
+                np.array([change[2] for _, change in changes], dtype=np.int64),
+                np.array([change[3] for _, change in changes], dtype=np.int64))
+
+    def apply(self, movies: list[dict] = (), removed_ids: list[int] = ()) -> None:
+        """Layers added, updated and deleted movies over the build"""
+        for movie in movies:
+            self.changes[movie["movie_id"]] = (*self.features(movie), movie["orig_lang"],
+                                               movie["country_id"])
+        for movie_id in removed_ids:
+            self.changes.pop(movie_id, None)
+
+        for movie_id in [*(movie["movie_id"] for movie in movies), *removed_ids]:
+            position = self.positions.get(movie_id)
+            if position is not None:
+                self.stale[position] = True
+        self.changed = self.changed_arrays()
+
+    def similar(self, movie_id: int, limit: int) -> list[tuple[int, float]]:
+        """Gets the ids and scores of the movies most similar to one, or None if it is unknown"""
+        changed_ids, changed_vectors, changed_languages, changed_countries = self.changed
+        position = self.positions.get(movie_id)
+        rows = np.flatnonzero(changed_ids == movie_id)
+
+        if len(rows):
+            row = rows[0]
+            vector = changed_vectors[row]
+            language, country = changed_languages[row], changed_countries[row]
+        elif position is not None and not self.stale[position]:
+            vector = self.vectors[position]
+            language, country = self.languages[position], self.countries[position]
+        else:
+            return None
+
+        scores = (vector @ self.postings).toarray().ravel()
+        scores += WEIGHTS["language"] * (self.languages == language)
+        scores += WEIGHTS["country"] * (self.countries == country)
+        scores[self.stale] = -np.inf
+        if position is not None:
+            scores[position] = -np.inf
+
+        changed_scores = (changed_vectors @ vector.T).toarray().ravel()
+        changed_scores += WEIGHTS["language"] * (changed_languages == language)
+        changed_scores += WEIGHTS["country"] * (changed_countries == country)
+        changed_scores[changed_ids == movie_id] = -np.inf
+
+        # Only the best limit of the built movies can make the final list
+        if len(scores) > limit:
+            best = np.argpartition(scores, -limit)[-limit:]
+        else:
+            best = np.arange(len(scores))
+        ids = np.concatenate([self.movie_ids[best], changed_ids])
+        scores = np.concatenate([scores[best], changed_scores])
+
+        order = np.lexsort((ids, -scores))[:limit]
+        return [(int(ids[index]), float(scores[index])) for index in order
+                if scores[index] > -np.inf]
+
+
+class SimilarityIndex:
+    """Finds similar movies, building the model on first use and rebuilding it in the background.
+
+    Writes made through the API are applied straight away in the vocabulary of the
+    last build. Once changes pass rebuild_share of the catalogue, or the build is
+    older than interval seconds, the model is rebuilt so word weights stay current.
+    """
+
+    def __init__(self, rebuild_share: float = 0.05, interval: float = 3600.0):
+        self.rebuild_share = rebuild_share
+        self.interval = interval
+        self._model = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._thread = None
+        # Writes made while a rebuild reads the catalogue, applied to the new model too
+        self._replay = None
+
+    @instrumented
+    def load_movies(self) -> list[dict]:
+        """Reads the columns similarity is computed from"""
+        with get_connection(read_only=True) as conn:
+            curs = get_cursor(conn)
+            curs.execute("""SELECT movie_id, overview, orig_lang, country_id, genre_ids
+                         FROM movie ORDER BY movie_id;""")
+            movies = curs.fetchall()
+            curs.close()
+        return movies
+
+    def build(self, missing_only: bool = False) -> None:
+        """Builds a new model from the catalogue and swaps it in"""
+        with self._build_lock:
+            if missing_only and self._model is not None:
+                return
+
+            with self._lock:
+                self._replay = []
+            try:
+                model = SimilarityModel(self.load_movies())
+                with self._lock:
+                    for movies, removed_ids in self._replay:
+                        model.apply(movies, removed_ids)
+                    self._model = model
+            finally:
+                with self._lock:
+                    self._replay = None
+
+    def get_model(self) -> SimilarityModel:
+        """Gets the current model, building the first one if there is none"""
+        if self._model is None:
+            self.build(missing_only=True)
+        elif time.time() - self._model.built_at > self.interval:
+            self.request_rebuild()
+        return self._model
+
+    def similar(self, movie_id: int, limit: int = DEFAULT_SIMILAR) -> list[tuple[int, float]]:
+        """Gets the ids and scores of the movies most similar to one, or None if it is unknown"""
+        return self.get_model().similar(movie_id, limit)
+
+    def update(self, movies: list[dict] = (), removed_ids: list[int] = ()) -> None:
+        """Applies movies written through the API, if a model has been built"""
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append((movies, removed_ids))
+            model = self._model
+            if model is None:
+                return
+            model.apply(movies, removed_ids)
+            pending = len(model.changes) + int(model.stale.sum())
+
+        if pending > self.rebuild_share * len(model.movie_ids):
+            self.request_rebuild()
+
+    def request_rebuild(self) -> None:
+        """Starts a background rebuild unless one is already running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._rebuild, daemon=True,
+                                                name="similarity-index")
+                self._thread.start()
+
+    def _rebuild(self) -> None:
+        try:
+            self.build()
+        except (psycopg2.Error, PoolTimeoutError):
+            logger.exception("Rebuilding the similar movies index failed")
+
+    def stats(self) -> dict:
+        """Returns the model's size, age and pending changes for monitoring"""
+        model = self._model
+        if model is None:
+            return {"movies": 0, "features": 0, "changes": 0, "age_seconds": 0}
+        return {"movies": len(model.movie_ids), "features": model.width,
+                "changes": len(model.changes), "age_seconds": time.time() - model.built_at}
+
+
+similarity_index = SimilarityIndex(
+    float(os.environ.get("MOVIES_SIMILAR_REBUILD_SHARE", 0.05)),
+    float(os.environ.get("MOVIES_SIMILAR_REBUILD_INTERVAL", 3600)))
@@ -0,0 +1,109 @@
+"""In-process cache of the genre, language and country lookup tables"""
+
+import os
+import threading
+import time
+from connection_pool import get_connection
+
+REFERENCE_TABLES = {
+    "genre": ("genre", "genre_id", "genre_name"),
+    "language": ("languages", "language_id", "language_name"),
+    "country": ("country", "country_id", "country_name")
+}
+
+
+class ReferenceCache:
+    """Serves id <-> name lookups for the small static tables from memory"""
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._tables = None
+        self._loaded_at = 0.0
+
+    def _fetch_tables(self) -> dict[str, list[tuple[int, str]]]:
+        """Reads every reference table from the database"""
+        tables = {}
+        with get_connection(read_only=True) as conn:
+            curs = conn.cursor()
+            for name, (table, key_column, name_column) in REFERENCE_TABLES.items():
+                curs.execute(f"""SELECT {key_column}, {name_column}
+                             FROM {table} ORDER BY {key_column};""")
+                tables[name] = curs.fetchall()
+            curs.close()
+        return tables
+
+    def _expired(self) -> bool:
+        """Checks whether the tables need loading"""
+        return self._tables is None or time.monotonic() - self._loaded_at > self.ttl
+
+    def refresh(self, force: bool = True) -> None:
+        """Reloads every table, keeping the old copy if the database is unreachable"""
+        with self._lock:
+            # Another thread may have reloaded while we waited for the lock
+            if not force and not self._expired():
+                return
+
+            try:
+                rows = self._fetch_tables()
+            except Exception:
+                if self._tables is None:
+                    raise
+                # Serve the stale copy and try again once the ttl runs out
+                self._loaded_at = time.monotonic()
+                return
+
+            self._store(rows)
+
+    def _store(self, rows: dict[str, list[tuple[int, str]]]) -> None:
+        """Indexes freshly read tables by id and by name"""
+        tables = {}
+        for name, pairs in rows.items():
+            tables[name] = {
+                "by_id": dict(pairs),
+                "by_name": {value.casefold(): key for key, value in pairs}
+            }
+        self._tables = tables
+        self._loaded_at = time.monotonic()
+
+    def load(self, rows: dict[str, list[tuple[int, str]]]) -> None:
+        """Replaces the tables with rows read elsewhere, such as by an async driver"""
+        with self._lock:
+            self._store(rows)
+
+    def dump(self) -> dict[str, list[tuple[int, str]]]:
+        """Gets every table as (id, name) pairs, in the form load accepts"""
+        return {name: list(self._table(name)["by_id"].items()) for name in REFERENCE_TABLES}
+
+    def invalidate(self) -> None:
+        """Drops the cached tables so the next lookup reloads them"""
+        with self._lock:
+            self._tables = None
+
+    def _table(self, name: str) -> dict:
+        """Returns a cached table, loading it if missing or expired"""
+        if self._expired():
+            self.refresh(force=False)
+        return self._tables[name]
+
+    def get_key(self, table: str, name: str) -> int:
+        """Gets the id for a name, ignoring case"""
+        if name is None:
+            return None
+        return self._table(table)["by_name"].get(name.casefold())
+
+    def get_name(self, table: str, key: int) -> str:
+        """Gets the name for an id"""
+        return self._table(table)["by_id"].get(key)
+
+    def get_id_names(self, table: str) -> dict[int, str]:
+        """Gets a table's id to name mapping, for naming many ids with one lookup"""
+        return self._table(table)["by_id"]
+
+    def get_names(self, table: str) -> list[str]:
+        """Gets every name in a table ordered by id"""
+        return list(self._table(table)["by_id"].values())
+
+
+reference_cache = ReferenceCache(
+    float(os.environ.get("MOVIES_REFERENCE_TTL", 300)))
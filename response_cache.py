@@ -0,0 +1,97 @@
+"""Bounded LRU cache of rendered GET responses"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from response_compression import compress
+
+
+@dataclass
+class CachedResponse:
+    """A rendered response body with the headers needed to replay it"""
+    body: bytes
+    mimetype: str
+    headers: dict = field(default_factory=dict)
+    etag: str = None
+    created_at: float = field(default_factory=time.monotonic)
+    # Compressed copies of the body by content encoding
+    encoded: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        if self.etag is None:
+            self.etag = hashlib.sha1(self.body).hexdigest()
+
+    def get_body(self, encoding: str = None) -> bytes:
+        """Gets the body in an encoding, compressing it only for the first request that asks"""
+        if encoding is None:
+            return self.body
+
+        body = self.encoded.get(encoding)
+        if body is None:
+            body = self.encoded[encoding] = compress(self.body, encoding)
+        return body
+
+
+class ResponseCache:
+    """Thread safe LRU of responses keyed by route and query, expiring after a ttl"""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+        # Bumped on every invalidation so responses rendered before a write are not stored
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> CachedResponse:
+        """Gets a fresh entry and marks it as recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry.created_at > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: tuple, entry: CachedResponse, generation: int = None) -> None:
+        """Stores an entry, evicting the least recently used beyond max_entries"""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """Drops every entry after the data changes"""
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def clear(self) -> None:
+        """Drops every entry and resets the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """Returns the cache size and hit counts for monitoring"""
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
+
+
+response_cache = ResponseCache(
+    int(os.environ.get("MOVIES_RESPONSE_CACHE_SIZE", 256)),
+    float(os.environ.get("MOVIES_RESPONSE_CACHE_TTL", 60)))
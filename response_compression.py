@@ -0,0 +1,94 @@
+"""Response body compression negotiated from the Accept-Encoding header"""
+
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bodies smaller than this gain too little to be worth compressing
+MIN_SIZE = int(os.environ.get("MOVIES_COMPRESSION_MIN_SIZE", 1024))
+LEVELS = {
+    "zstd": int(os.environ.get("MOVIES_ZSTD_LEVEL", 3)),
+    "br": int(os.environ.get("MOVIES_BROTLI_LEVEL", 5)),
+    "gzip": int(os.environ.get("MOVIES_GZIP_LEVEL", 6))
+}
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/x-ndjson", "text/plain"}
+# In order of preference when the client accepts several equally
+ENCODINGS = [encoding for encoding, module in [("zstd", zstandard), ("br", brotli),
+                                               ("gzip", zlib)] if module is not None]
+
+
+class BrotliCompressor:
+    """Gives brotli's streaming compressor the same methods as zlib's"""
+
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+def choose_encoding(accept_encodings) -> str:
+    """Gets the best encoding the client accepts, or None to send the body as it is"""
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def get_compressor(encoding: str):
+    """Creates a streaming compressor with compress and flush methods"""
+    level = LEVELS[encoding]
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    if encoding == "br":
+        return BrotliCompressor(level)
+    # A window of 31 writes the gzip header and trailer
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Compresses a whole body"""
+    compressor = get_compressor(encoding)
+    return compressor.compress(body) + compressor.flush()
+
+
+def compress_chunks(chunks, encoding: str):
+    """Compresses a streamed body, passing output on as the compressor produces it"""
+    compressor = get_compressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        # Closing the source hands its connection back if the client disconnects early
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+async def compress_async_chunks(chunks, encoding: str):
+    """Compresses an asynchronously streamed body, as compress_chunks does"""
+    compressor = get_compressor(encoding)
+    try:
+        async for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
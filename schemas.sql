@@ -1,10 +1,16 @@
 -- This file contains all of the SQL commands to create the database, tables and relationships for the Movies Database
 
+DROP MATERIALIZED VIEW IF EXISTS genre_stats;
+DROP MATERIALIZED VIEW IF EXISTS country_stats;
+DROP MATERIALIZED VIEW IF EXISTS language_stats;
+DROP MATERIALIZED VIEW IF EXISTS year_stats;
+DROP TABLE IF EXISTS schema_migrations;
 DROP TABLE IF EXISTS movie_genres;
+DROP TABLE IF EXISTS movie;
 DROP TABLE IF EXISTS genre;
 DROP TABLE IF EXISTS languages;
 DROP TABLE IF EXISTS country;
-DROP TABLE IF EXISTS movie;
+DROP FUNCTION IF EXISTS notify_movie_changes() CASCADE;
 
 CREATE TABLE movie_genres(
     id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
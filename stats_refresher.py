@@ -0,0 +1,65 @@
+"""Background refresh of the materialized statistics views"""
+
+import logging
+import os
+import threading
+import time
+import psycopg2
+from connection_pool import PoolTimeoutError
+from database_functions import refresh_stats
+from response_cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+
+class StatsRefresher:
+    """Refreshes the statistics views on a schedule and shortly after writes.
+
+    Writes only mark the views as stale, so a burst of writes is folded into a
+    single refresh once delay seconds have passed since the first of them.
+    """
+
+    def __init__(self, interval: float = 3600.0, delay: float = 5.0):
+        self.interval = interval
+        self.delay = delay
+        self.last_refreshed = None
+        self._stale = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self) -> None:
+        """Starts the background thread if it is not already running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name="stats-refresher")
+                self._thread.start()
+
+    def request_refresh(self) -> None:
+        """Marks the views as stale after a write"""
+        self._stale.set()
+        self.start()
+
+    def _run(self) -> None:
+        while True:
+            if self._stale.wait(self.interval):
+                time.sleep(self.delay)
+            self._stale.clear()
+
+            try:
+                refresh_stats()
+                # Cached /stats responses were rendered from the old views
+                response_cache.invalidate()
+                self.last_refreshed = time.time()
+            except (psycopg2.Error, PoolTimeoutError):
+                logger.exception("Refreshing the statistics views failed")
+
+
+stats_refresher = StatsRefresher(
+    float(os.environ.get("MOVIES_STATS_REFRESH_INTERVAL", 3600)),
+    float(os.environ.get("MOVIES_STATS_REFRESH_DELAY", 5)))
+
+
+if __name__ == "__main__":
+    refresh_stats()
+    print("Refreshed statistics views")
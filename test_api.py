@@ -1,11 +1,18 @@
+import gzip
+import json
 from unittest.mock import patch
 import pytest
 from api import app
+from response_cache import response_cache
+from response_compression import compress
+from database_functions import (encode_cursor, decode_cursor, split_page, VersionConflictError,
+                                movies_by_genre_query)
 
 
 @pytest.fixture
 def client():
     """Fixture to set up the test client."""
+    response_cache.clear()
     with app.test_client() as client:
         yield client
 
@@ -77,8 +84,6 @@ def test_get_movies_with_search_failure(mock_get_movies, client):
     ("title", "desc", ["Interstellar", "Inception"]),
     ("release_date", "asc", ["Inception", "Interstellar"]),
     ("release_date", "desc", ["Interstellar", "Inception"]),
-    ("genre", "asc", ["Interstellar", "Inception"]),
-    ("genre", "desc", ["Inception", "Interstellar"]),
     ("revenue", "asc", ["Interstellar", "Inception"]),
     ("revenue", "desc", ["Inception", "Interstellar"]),
     ("budget", "asc", ["Inception", "Interstellar"]),
@@ -121,8 +126,6 @@ def test_movies_sort_order(mock_get_movies, client, sort_by, sort_order, expecte
             return [movie_1, movie_2] if sort_order == "asc" else [movie_2, movie_1]
         if sort_by == "release_date":
             return [movie_1, movie_2] if sort_order == "asc" else [movie_2, movie_1]
-        if sort_by == "genre":
-            return [movie_2, movie_1] if sort_order == "asc" else [movie_1, movie_2]
         if sort_by == "revenue":
             return [movie_2, movie_1] if sort_order == "asc" else [movie_1, movie_2]
         if sort_by == "budget":
@@ -131,7 +134,7 @@ def test_movies_sort_order(mock_get_movies, client, sort_by, sort_order, expecte
             return [movie_2, movie_1] if sort_order == "asc" else [movie_1, movie_2]
         return [movie_1, movie_2]
 
-    mock_get_movies.side_effect = lambda search, sort_by, sort_order: get_sorted_movies(
+    mock_get_movies.side_effect = lambda search, sort_by, sort_order, **kwargs: get_sorted_movies(
         sort_by, sort_order)
 
     response = client.get(f'/movies?sort_by={sort_by}&sort_order={sort_order}')
@@ -143,16 +146,104 @@ def test_movies_sort_order(mock_get_movies, client, sort_by, sort_order, expecte
     assert returned_movie_titles == expected_movies
 
 
+@pytest.mark.parametrize("sort_by", ["invalid_field", "genre"])
 @patch('api.get_movies')
-def test_endpoint_invalid_sort_by(mock_get_movies, client):
-    """Test's that it returns error if invalid parameter is passed through"""
+def test_endpoint_invalid_sort_by(mock_get_movies, client, sort_by):
+    """Test's that it returns error if invalid parameter is passed through, including genre which is not a movie column"""
     mock_get_movies.return_value = []
 
-    response = client.get('/movies?sort_by=invalid_field')
+    response = client.get(f'/movies?sort_by={sort_by}')
     assert response.status_code == 400
     assert response.get_json() == {"error": "Invalid sort_by parameter"}
 
 
+@patch('api.get_movies')
+def test_get_movies_returns_next_page_cursor(mock_get_movies, client):
+    """Test's that a full page links to the next page with a cursor"""
+    mock_get_movies.return_value = [
+        {"movie_id": 1, "title": "Movie 1"},
+        {"movie_id": 2, "title": "Movie 2"},
+        {"movie_id": 3, "title": "Movie 3"}
+    ]
+
+    response = client.get("/movies?limit=2&sort_by=title")
+
+    assert response.status_code == 200
+    assert [movie["movie_id"] for movie in response.get_json()] == [1, 2]
+    cursor = response.headers["X-Next-Cursor"]
+    assert decode_cursor(cursor, "title") == {
+        "sort_by": "title", "value": "Movie 2", "movie_id": 2}
+    assert "cursor=" + cursor in response.headers["Link"]
+    mock_get_movies.assert_called_once_with(None, "title", None, limit=2, cursor=None,
+                                            fields=None, filters={})
+
+
+@patch('api.get_movies')
+def test_get_movies_search_pages_by_relevance(mock_get_movies, client):
+    """Test's that an unsorted search is paged by relevance"""
+    mock_get_movies.return_value = [
+        {"movie_id": 4, "title": "Space Chimps", "relevance": 1.2},
+        {"movie_id": 9, "title": "Lost in Space", "relevance": 0.8}
+    ]
+    cursor = encode_cursor({"movie_id": 3, "relevance": 1.5}, "relevance")
+
+    response = client.get(f"/movies?search=space&limit=1&cursor={cursor}")
+
+    assert response.status_code == 200
+    assert decode_cursor(response.headers["X-Next-Cursor"], "relevance") == {
+        "sort_by": "relevance", "value": 1.2, "movie_id": 4}
+    mock_get_movies.assert_called_once_with(
+        "space", None, None, limit=1,
+        cursor={"sort_by": "relevance", "value": 1.5, "movie_id": 3}, fields=None, filters={})
+
+
+@patch('api.get_movies')
+def test_get_movies_last_page_has_no_cursor(mock_get_movies, client):
+    """Test's that the final page does not advertise a next page"""
+    mock_get_movies.return_value = [{"movie_id": 1, "title": "Movie 1"}]
+
+    response = client.get("/movies?limit=2")
+
+    assert response.status_code == 200
+    assert "X-Next-Cursor" not in response.headers
+
+
+@pytest.mark.parametrize("query, error", [
+    ("limit=0", "Invalid limit parameter"),
+    ("limit=abc", "Invalid limit parameter"),
+    ("limit=100000", "Invalid limit parameter"),
+    ("cursor=not-a-cursor", "Invalid cursor parameter"),
+    ("sort_by=score&cursor=" + encode_cursor({"movie_id": 1, "title": "A"}, "title"),
+     "Invalid cursor parameter"),
+])
+@patch('api.get_movies')
+def test_get_movies_invalid_page_parameters(mock_get_movies, client, query, error):
+    """Test's that malformed limit and cursor parameters are rejected"""
+    response = client.get(f"/movies?{query}")
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": error}
+    mock_get_movies.assert_not_called()
+
+
+@patch('api.get_movies_by_country')
+@patch('api.get_country_key')
+def test_get_movies_by_country_passes_cursor(mock_get_country_key,
+                                             mock_get_movies_by_country, client):
+    """Test's that the country route forwards the decoded cursor"""
+    mock_get_country_key.return_value = 2
+    mock_get_movies_by_country.return_value = [{"movie_id": 8, "score": 70.0}]
+    cursor = encode_cursor({"movie_id": 7, "score": 71.0}, "score")
+
+    response = client.get(
+        f"/countries/US?sort_by=score&sort_order=desc&limit=5&cursor={cursor}")
+
+    assert response.status_code == 200
+    mock_get_movies_by_country.assert_called_once_with(
+        2, "score", "desc", limit=5,
+        cursor={"sort_by": "score", "value": 71.0, "movie_id": 7}, fields=None)
+
+
 @pytest.mark.parametrize("missing_field", [
     "title",
     "release_date",
@@ -306,46 +397,492 @@ def test_get_movie_by_id_not_found(mock_get_movie_by_id, client):
     assert response.get_json() == {"error": "Movie not found"}
 
 
-@pytest.fixture
-def create_movie(client):
-    """Fixture to create a movie that can be updated."""
-    movie_data = {
-        "title": "Inception",
-        "release_date": "07/16/2010",
-        "score": 8.8,
-        "orig_title": "Inception",
-        "orig_lang": "English",
-        "overview": "A mind-bending thriller",
-        "budget": 160000000,
-        "revenue": 829895144,
-        "country": "US"
-    }
-    response = client.post("/movies", json=movie_data)
-    assert response.status_code == 201
-    return response.get_json()["success"]
+@patch('api.get_movies_by_ids')
+@patch('api.similarity_index')
+def test_get_similar_movies(mock_similarity_index, mock_get_movies_by_ids, client):
+    """Test's that similar movies are returned best first with their scores"""
+    mock_similarity_index.similar.return_value = [(2, 0.91234), (3, 0.5)]
+    mock_get_movies_by_ids.return_value = [{"movie_id": 2, "title": "Creed II"},
+                                           {"movie_id": 3, "title": "Rocky"}]
 
+    response = client.get("/movies/1/similar?limit=2")
 
-def test_patch_movie_success(client, create_movie):
-    """Test successful movie update using PATCH."""
-    movie_id = create_movie
-    update_data = {
-        "title": "Inception (Updated)",
-        "release_date": "07/16/2010",
-        "score": 9.0,
-        "orig_title": "Inception",
-        "orig_lang": "English",
-        "overview": "A mind-bending thriller",
-        "budget": 160000000,
-        "revenue": 829895144,
-        "country": "US"
-    }
+    assert response.status_code == 200
+    assert response.get_json() == [{"movie_id": 2, "title": "Creed II", "similarity": 0.9123},
+                                   {"movie_id": 3, "title": "Rocky", "similarity": 0.5}]
+    mock_similarity_index.similar.assert_called_once_with(1, 2)
+    mock_get_movies_by_ids.assert_called_once_with([2, 3])
+
+
+@patch('api.similarity_index')
+def test_get_similar_movies_errors(mock_similarity_index, client):
+    """Test's that bad limits are rejected and unknown movies are not found"""
+    mock_similarity_index.similar.return_value = None
+
+    assert client.get("/movies/1/similar?limit=101").status_code == 400
+    assert client.get("/movies/1/similar?limit=x").status_code == 400
+    assert client.get("/movies/1/similar?limit=²").status_code == 400
+    response = client.get("/movies/9999/similar")
+
+    assert response.status_code == 404
+    assert response.get_json() == {"error": "Movie not found"}
+
+
+@patch('api.update_movie')
+def test_patch_movie_success(mock_update_movie, client):
+    """Test's that PATCH only updates the supplied fields and returns the new row."""
+    updated = {"movie_id": 1, "title": "Inception (Updated)", "score": 9.0, "version": 2}
+    mock_update_movie.return_value = updated
+
+    response = client.patch("/movies/1", json={"title": "Inception (Updated)", "score": 9})
+
+    assert response.status_code == 200
+    assert response.get_json() == updated
+    mock_update_movie.assert_called_once_with(
+        1, {"title": "Inception (Updated)", "score": 9.0}, None)
+
+
+@pytest.mark.parametrize("body, headers", [
+    ({"score": 9.0, "version": 1}, {}),
+    ({"score": 9.0}, {"If-Match": '"1"'})
+])
+@patch('api.update_movie')
+def test_patch_movie_with_version(mock_update_movie, client, body, headers):
+    """Test's that the expected version is read from the body or If-Match header"""
+    mock_update_movie.return_value = {"movie_id": 1, "score": 9.0, "version": 2}
+
+    response = client.patch("/movies/1", json=body, headers=headers)
+
+    assert response.status_code == 200
+    mock_update_movie.assert_called_once_with(1, {"score": 9.0}, 1)
+
+
+@patch('api.update_movie')
+def test_patch_movie_version_conflict(mock_update_movie, client):
+    """Test's that a stale version is rejected with a 409"""
+    mock_update_movie.side_effect = VersionConflictError(3)
+
+    response = client.patch("/movies/1", json={"score": 9.0, "version": 2})
+
+    assert response.status_code == 409
+    assert response.get_json()["version"] == 3
+
+
+@patch('api.update_movie')
+def test_patch_movie_not_found(mock_update_movie, client):
+    """Test's that patching a missing movie returns a 404"""
+    mock_update_movie.return_value = None
+
+    response = client.patch("/movies/999", json={"score": 9.0})
+
+    assert response.status_code == 404
+    assert response.get_json() == {"error": "Movie not found"}
+
+
+@pytest.mark.parametrize("body", [{}, {"rating": 5}, {"score": "high"},
+                                  {"release_date": "2010-07-16"}, {"score": 9.0, "version": "x"},
+                                  5, "abc", [1, 2], [["title", "x"]]])
+@patch('api.update_movie')
+def test_patch_movie_invalid_body(mock_update_movie, client, body):
+    """Test's that invalid patches are rejected without touching the database"""
+    response = client.patch("/movies/1", json=body)
+
+    assert response.status_code == 400
+    mock_update_movie.assert_not_called()
+
+
+@patch('api.replica_stats')
+@patch('api.pool_stats')
+def test_health_reports_pool_stats(mock_pool_stats, mock_replica_stats, client):
+    """Test's that the health route exposes the connection pool and replica statistics"""
+    mock_pool_stats.return_value = {"size": 2, "idle": 1, "in_use": 1}
+    mock_replica_stats.return_value = {"replicas": 2, "healthy": 1}
+
+    response = client.get("/health")
+
+    assert response.status_code == 200
+    assert response.get_json() == {"status": "ok",
+                                   "pool": {"size": 2, "idle": 1, "in_use": 1},
+                                   "replicas": {"replicas": 2, "healthy": 1}}
+
+
+@patch('api.iter_movies')
+def test_get_movies_stream_json(mock_iter_movies, client):
+    """Test's that streamed listings are emitted as a JSON array"""
+    mock_movies = [{"movie_id": 1, "title": "Movie 1"},
+                   {"movie_id": 2, "title": "Movie 2"}]
+    mock_iter_movies.return_value = (movie for movie in mock_movies)
+
+    response = client.get("/movies?stream=json")
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.get_json() == mock_movies
+    mock_iter_movies.assert_called_once_with(None, None, None, cursor=None, fields=None,
+                                             filters={})
+
+
+@patch('api.iter_movies_by_country')
+@patch('api.get_country_key')
+def test_get_movies_by_country_stream_ndjson(mock_get_country_key,
+                                             mock_iter_movies_by_country, client):
+    """Test's that NDJSON is streamed when the client accepts it"""
+    mock_get_country_key.return_value = 2
+    mock_iter_movies_by_country.return_value = (
+        {"movie_id": movie_id} for movie_id in [1, 2, 3])
+
+    response = client.get("/countries/US?limit=2",
+                          headers={"Accept": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert response.get_data(as_text=True) == '{"movie_id":1}\n{"movie_id":2}\n'
+
+
+@patch('api.iter_movies_by_genre')
+@patch('api.get_genre')
+def test_get_movies_by_genre_stream_empty(mock_get_genre,
+                                          mock_iter_movies_by_genre, client):
+    """Test's that an empty stream still returns a 404"""
+    mock_get_genre.return_value = {"genre_name": "Action"}
+    mock_iter_movies_by_genre.return_value = (movie for movie in [])
+
+    response = client.get("/genres/16/movies?stream=ndjson")
+
+    assert response.status_code == 404
+    assert response.get_json() == {"error": "No movies found for this genre"}
+
+
+def test_get_movies_invalid_stream_format(client):
+    """Test's that unknown streaming formats are rejected"""
+    response = client.get("/movies?stream=xml")
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid stream parameter"}
+
+
+@patch('api.get_movie_by_id')
+def test_get_movie_served_from_cache(mock_get_movie_by_id, client):
+    """Test's that a repeated GET is served from the response cache"""
+    mock_get_movie_by_id.return_value = {"movie_id": 1, "title": "Inception"}
+
+    first = client.get("/movies/1")
+    second = client.get("/movies/1")
+
+    assert first.get_json() == second.get_json() == {"movie_id": 1, "title": "Inception"}
+    assert first.headers["ETag"] == second.headers["ETag"]
+    assert "Last-Modified" not in second.headers
+    mock_get_movie_by_id.assert_called_once()
+
+
+@patch('api.get_movie_by_id')
+def test_pinned_reads_skip_cache(mock_get_movie_by_id, client):
+    """Test's that a client that just wrote is not served a response cached before its write"""
+    mock_get_movie_by_id.return_value = {"movie_id": 1, "title": "Inception"}
+    client.get("/movies/1")
+
+    mock_get_movie_by_id.return_value = {"movie_id": 1, "title": "Inception 2"}
+    client.set_cookie("movies_read_primary", "1")
+    response = client.get("/movies/1")
+
+    assert response.get_json()["title"] == "Inception 2"
+    assert mock_get_movie_by_id.call_count == 2
+
+
+@patch('api.get_genres')
+def test_get_genres_not_modified(mock_get_genres, client):
+    """Test's that a matching If-None-Match gets a 304 without a body"""
+    mock_get_genres.return_value = [{"genre_name": "Action"}]
+    etag = client.get("/genres").headers["ETag"]
+
+    response = client.get("/genres", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.get_data() == b""
+
+
+@patch('api.get_genres')
+def test_if_modified_since_is_not_trusted(mock_get_genres, client):
+    """Test's that only the ETag can make a 304, as another worker may have changed the data"""
+    mock_get_genres.return_value = [{"genre_name": "Action"}]
+    client.get("/genres")
+
+    response = client.get("/genres", headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+
+    assert response.status_code == 200
+
+
+@patch('api.delete_movie')
+@patch('api.get_movie_by_id')
+def test_delete_movie_invalidates_cache(mock_get_movie_by_id, mock_delete_movie, client):
+    """Test's that a write clears cached responses"""
+    mock_get_movie_by_id.return_value = {"movie_id": 1, "title": "Inception"}
+    mock_delete_movie.return_value = True
+    client.get("/movies/1")
+
+    client.delete("/movies/1")
+    mock_get_movie_by_id.return_value = None
+    response = client.get("/movies/1")
+
+    assert response.status_code == 404
+    assert mock_get_movie_by_id.call_count == 2
+
+
+@patch('api.get_movies')
+def test_get_movies_errors_are_not_cached(mock_get_movies, client):
+    """Test's that error responses are rendered fresh every time"""
+    mock_get_movies.return_value = []
+    client.get("/movies")
+
+    mock_get_movies.return_value = [{"movie_id": 1, "title": "Movie 1"}]
+    response = client.get("/movies")
+
+    assert response.status_code == 200
+    assert mock_get_movies.call_count == 2
+
+
+LONG_MOVIES = [{"movie_id": movie_id, "title": f"Movie {movie_id}",
+                "overview": "A retired thief is drawn back for one last job."}
+               for movie_id in range(1, 51)]
+
+
+@patch('response_cache.compress', wraps=compress)
+@patch('api.get_movies')
+def test_get_movies_compressed_once(mock_get_movies, mock_compress, client):
+    """Test's that a cached listing is gzipped once and small responses are left as they are"""
+    mock_get_movies.return_value = LONG_MOVIES
+    plain = client.get("/movies")
+
+    first = client.get("/movies", headers={"Accept-Encoding": "br;q=0.5, gzip"})
+    second = client.get("/movies", headers={"Accept-Encoding": "gzip"})
+    small = client.get("/movies?limit=1", headers={"Accept-Encoding": "gzip"})
+
+    assert first.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(second.get_data()) == plain.get_data()
+    assert len(first.get_data()) < len(plain.get_data()) / 4
+    assert first.headers["ETag"] == second.headers["ETag"] != plain.headers["ETag"]
+    assert "Accept-Encoding" in plain.headers["Vary"]
+    assert "Content-Encoding" not in small.headers
+    mock_compress.assert_called_once()
+
+
+@patch('api.iter_movies')
+def test_get_movies_stream_compressed(mock_iter_movies, client):
+    """Test's that a streamed listing is compressed as it is sent"""
+    mock_iter_movies.return_value = (movie for movie in LONG_MOVIES)
+
+    response = client.get("/movies?stream=ndjson", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    lines = gzip.decompress(response.get_data()).decode().splitlines()
+    assert [json.loads(line) for line in lines] == LONG_MOVIES
+
+
+VALID_MOVIE = {
+    "title": "Inception",
+    "release_date": "07/16/2010",
+    "score": 8.8,
+    "orig_title": "Inception",
+    "orig_lang": "English",
+    "overview": "A mind-bending thriller",
+    "budget": 160000000.1,
+    "revenue": 829895144.1,
+    "country": "US"
+}
+
+
+@patch('api.add_movies')
+def test_post_movies_batch_success(mock_add_movies, client):
+    """Test's that a list of movies is added in one call"""
+    mock_add_movies.return_value = [{"movie_id": 1}, {"movie_id": 2}]
+
+    response = client.post("/movies/batch", json=[VALID_MOVIE, VALID_MOVIE])
 
-    response = client.patch(f"/movies/{movie_id}", json=update_data)
     assert response.status_code == 201
-    assert response.get_json()["success"] == True
+    assert response.get_json() == {"success": [{"movie_id": 1}, {"movie_id": 2}]}
+    assert len(mock_add_movies.call_args.args[0]) == 2
+
+
+@patch('api.add_movies')
+def test_post_movies_batch_rejects_invalid_movie(mock_add_movies, client):
+    """Test's that one invalid movie rejects the whole batch and names its index"""
+    invalid_movie = dict(VALID_MOVIE, score="high")
+
+    response = client.post("/movies/batch", json=[VALID_MOVIE, invalid_movie])
+
+    assert response.status_code == 400
+    assert response.get_json()["index"] == 1
+    mock_add_movies.assert_not_called()
+
+
+@patch('api.get_movies_by_ids')
+def test_get_movies_by_ids(mock_get_movies_by_ids, client):
+    """Test's that many movies can be fetched by id in one request"""
+    mock_get_movies_by_ids.return_value = [{"movie_id": 3}, {"movie_id": 1}]
+
+    response = client.get("/movies?ids=3,1")
+
+    assert response.status_code == 200
+    assert response.get_json() == [{"movie_id": 3}, {"movie_id": 1}]
+    mock_get_movies_by_ids.assert_called_once_with([3, 1], None)
+
+
+def test_get_movies_by_invalid_ids(client):
+    """Test's that non numeric ids are rejected"""
+    response = client.get("/movies?ids=1,two")
+
+    assert response.status_code == 400
+
+
+@patch('api.delete_movies')
+def test_delete_movies_batch(mock_delete_movies, client):
+    """Test's that many movies can be deleted in one request"""
+    mock_delete_movies.return_value = [1, 2]
+
+    response = client.delete("/movies/batch", json={"ids": [1, 2, 3]})
+
+    assert response.status_code == 200
+    assert response.get_json() == {"deleted": [1, 2]}
+    mock_delete_movies.assert_called_once_with([1, 2, 3])
+
+
+@pytest.mark.parametrize("ids", [[True], [1, False], [1.0], ["1"], []])
+@patch('api.delete_movies')
+def test_delete_movies_batch_rejects_invalid_ids(mock_delete_movies, client, ids):
+    """Test's that ids must be whole numbers, so true is never read as movie 1"""
+    response = client.delete("/movies/batch", json={"ids": ids})
+
+    assert response.status_code == 400
+    mock_delete_movies.assert_not_called()
+
+
+@patch('api.get_movies')
+def test_get_movies_with_fields(mock_get_movies, client):
+    """Test's that only the requested fields are returned on a page"""
+    mock_get_movies.return_value = [
+        {"title": "Movie 1", "score": 70.0, "movie_id": 1},
+        {"title": "Movie 2", "score": 60.0, "movie_id": 2}
+    ]
+
+    response = client.get("/movies?fields=title,score&sort_by=score&limit=1")
+
+    assert response.status_code == 200
+    assert response.get_json() == [{"title": "Movie 1", "score": 70.0}]
+    assert decode_cursor(response.headers["X-Next-Cursor"], "score")["movie_id"] == 1
+    assert mock_get_movies.call_args.kwargs["fields"] == ["title", "score"]
+
+
+@patch('api.get_movie_by_id')
+def test_get_movie_by_id_with_fields(mock_get_movie_by_id, client):
+    """Test's that the detail route passes the requested fields down"""
+    mock_get_movie_by_id.return_value = {"title": "Inception"}
+
+    response = client.get("/movies/1?fields=title")
+
+    assert response.status_code == 200
+    mock_get_movie_by_id.assert_called_once_with(1, ["title"])
+
+
+@pytest.mark.parametrize("url", ["/movies?fields=title,password",
+                                 "/movies/1?fields=",
+                                 "/countries/US?fields=search_vector"])
+def test_invalid_fields_rejected(client, url):
+    """Test's that fields outside the whitelist are rejected"""
+    response = client.get(url)
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid fields parameter"}
+
+
+@patch('api.get_stats')
+def test_get_stats_success(mock_get_stats, client):
+    """Test's that statistics are served for a known group"""
+    mock_get_stats.return_value = [{"genre_id": 1, "genre_name": "Drama", "movie_count": 3}]
+
+    response = client.get("/stats/genres")
+
+    assert response.status_code == 200
+    assert response.get_json() == mock_get_stats.return_value
+    mock_get_stats.assert_called_once_with("genres")
+
+
+def test_get_stats_unknown_group(client):
+    """Test's that an unknown statistics group returns a 404"""
+    response = client.get("/stats/directors")
+
+    assert response.status_code == 404
+    assert response.get_json() == {"error": "Unknown statistics group"}
+
+
+@patch('api.stats_refresher')
+@patch('api.delete_movie')
+def test_delete_movie_requests_stats_refresh(mock_delete_movie, mock_refresher, client):
+    """Test's that a write marks the statistics as stale"""
+    mock_delete_movie.return_value = True
+
+    response = client.delete("/movies/1")
+
+    assert response.status_code == 200
+    mock_refresher.request_refresh.assert_called_once()
+
+
+@patch('api.get_movies')
+@patch('api.parse_filters')
+def test_get_movies_with_filters(mock_parse_filters, mock_get_movies, client):
+    """Test's that parsed filters are passed through to the query"""
+    mock_parse_filters.return_value = ({"min_score": 70.0, "genre": [16]}, None)
+    mock_get_movies.return_value = [{"title": "Movie 1"}]
+
+    response = client.get("/movies?min_score=70&genre=16")
+
+    assert response.status_code == 200
+    assert mock_get_movies.call_args.kwargs["filters"] == {"min_score": 70.0, "genre": [16]}
+
+
+@pytest.mark.parametrize("query, error", [
+    ("min_score=high", "Invalid min_score parameter"),
+    ("max_budget=inf", "Invalid max_budget parameter"),
+    ("min_release_date=2010-01-01", "Invalid min_release_date parameter"),
+    ("genre=action", "Invalid genre parameter, ensure it is a comma separated list of genre ids")
+])
+def test_get_movies_invalid_filters(client, query, error):
+    """Test's that malformed filters are rejected before querying"""
+    response = client.get(f"/movies?{query}")
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": error}
+
+
+@patch('database_functions.reference_cache')
+def test_trimmed_pages_name_their_genres(mock_reference_cache):
+    """Test's that genre names come from the cache and survive trimming a page to fields"""
+    mock_reference_cache.get_id_names.return_value = {7: "Drama", 16: "Action"}
+    rows = [{"movie_id": 1, "title": "Heat", "genre_ids": [16, 7]}]
+
+    page, _ = split_page(rows, None, fields=["title", "genre_ids"])
+
+    assert page == [{"title": "Heat", "genre_ids": [16, 7], "genres": ["Action", "Drama"]}]
+
+
+@patch('database_functions.reference_cache')
+def test_movies_by_genre_query_needs_no_join(mock_reference_cache):
+    """Test's that movies of a genre are read from the genre_ids array alone"""
+    mock_reference_cache.get_name.return_value = "Action"
+
+    query, params = movies_by_genre_query(16)
+
+    assert "JOIN" not in query.upper()
+    assert "genre_ids @>" in query
+    assert params == ["Action", 16]
+
+
+@patch('api.get_replicas')
+@patch('api.delete_movie')
+def test_writes_pin_later_reads_to_primary(mock_delete_movie, mock_get_replicas, client):
+    """Test's that a successful write sets the cookie that sends the client's reads to the primary"""
+    mock_delete_movie.return_value = True
+
+    response = client.delete("/movies/1")
 
-    response = client.get(f"/movies/{movie_id}")
     assert response.status_code == 200
-    movie = response.get_json()
-    assert movie["title"] == "Inception (Updated)"
-    assert movie["score"] == 9.0
+    assert "movies_read_primary=1" in response.headers["Set-Cookie"]
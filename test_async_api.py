@@ -0,0 +1,113 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+from async_api import app, to_asyncpg
+
+
+def request(method: str, url: str, **kwargs):
+    """Runs a request against the async app without starting the pool"""
+    async def run():
+        response = await getattr(app.test_client(), method)(url, **kwargs)
+        return response.status_code, await response.get_json()
+    return asyncio.run(run())
+
+
+def test_to_asyncpg_numbers_placeholders():
+    """Test's that psycopg2 placeholders become asyncpg ones and %% is unescaped"""
+    query = "SELECT * FROM movie WHERE title %% %s AND movie_id > %s LIMIT %s"
+
+    assert to_asyncpg(query) == "SELECT * FROM movie WHERE title % $1 AND movie_id > $2 LIMIT $3"
+
+
+@patch('async_api.fetch_rows', new_callable=AsyncMock)
+def test_get_movies_matches_sync_contract(mock_fetch_rows):
+    """Test's that /movies returns the same JSON list as the sync API"""
+    mock_fetch_rows.return_value = [{"movie_id": 1, "title": "Movie 1"}]
+
+    status, body = request("get", "/movies?limit=5")
+
+    assert status == 200
+    assert body == [{"movie_id": 1, "title": "Movie 1"}]
+    assert mock_fetch_rows.call_args.args[1][-1] == 6
+
+
+@patch('async_api.fetch_rows', new_callable=AsyncMock)
+def test_get_movie_not_found(mock_fetch_rows):
+    """Test's that a missing movie is a 404"""
+    mock_fetch_rows.return_value = []
+
+    status, body = request("get", "/movies/9999")
+
+    assert status == 404
+    assert body == {"error": "Movie not found"}
+
+
+def test_post_movie_invalid_data_types():
+    """Test's that the async POST validates movies like the sync API"""
+    status, body = request("post", "/movies", json={"title": 1})
+
+    assert status == 400
+    assert body == {"error": "Missing required fields, ensure data has the following columns: title, release_date, score, overview, orig_title, orig_lang, budget, revenue, country"}
+
+
+def test_patch_movie_rejects_non_object_body():
+    """Test's that a PATCH body that is not a JSON object is a 400, not a 500"""
+    status, body = request("patch", "/movies/1", json=[["title", "x"]])
+
+    assert status == 400
+    assert body == {"error": "Request body must be a JSON object of the fields to update"}
+
+
+@patch('async_api.similarity_index')
+@patch('async_api.stats_refresher')
+@patch('async_api.fetch_rows', new_callable=AsyncMock)
+def test_batch_delete_requests_stats_refresh(mock_fetch_rows, mock_refresher, mock_similarity_index):
+    """Test's that an async write marks the statistics as stale, as the sync API does"""
+    mock_fetch_rows.return_value = [{"movie_id": 1}, {"movie_id": 2}]
+
+    status, body = request("delete", "/movies/batch", json={"ids": [1, 2]})
+
+    assert status == 200
+    assert body == {"deleted": [1, 2]}
+    mock_refresher.request_refresh.assert_called_once()
+
+
+def test_metrics_route_counts_requests():
+    """Test's that the async app exposes the same request metrics as the sync API"""
+    async def run():
+        client = app.test_client()
+        await client.get("/")
+        response = await client.get("/metrics")
+        return response.status_code, response.mimetype, await response.get_data(as_text=True)
+
+    status, mimetype, body = asyncio.run(run())
+
+    assert status == 200
+    assert mimetype == "text/plain"
+    assert 'movies_http_requests_total{method="GET",route="/",status="200"}' in body
+    assert "movies_db_pool_in_use 0" in body
+
+
+def test_similar_movies_rejects_non_ascii_digit_limit():
+    """Test's that a limit of digits int cannot parse is a 400, not a 500"""
+    status, body = request("get", "/movies/1/similar", query_string={"limit": "²"})
+
+    assert status == 400
+    assert body == {"error": "Invalid limit parameter, ensure it is between 1 and 100"}
+
+
+def test_batch_delete_rejects_boolean_ids():
+    """Test's that true is not taken for movie 1, as in the sync API"""
+    status, body = request("delete", "/movies/batch", json={"ids": [True]})
+
+    assert status == 400
+    assert body == {"error": "Request body must contain ids, a list of 1 to 1000 movie ids"}
+
+
+@patch('async_api.fetch_rows', new_callable=AsyncMock)
+def test_get_movies_rejects_genre_sort(mock_fetch_rows):
+    """Test's that sorting by genre, which is not a movie column, is a 400 rather than a failed query"""
+    status, body = request("get", "/movies?sort_by=genre")
+
+    assert status == 400
+    assert body == {"error": "Invalid sort_by parameter"}
+    mock_fetch_rows.assert_not_called()
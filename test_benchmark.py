@@ -0,0 +1,54 @@
+from benchmark import (READ_SCENARIOS, WRITE_SCENARIOS, compare_to_baseline, get_scenarios,
+                       percentile)
+
+SETTINGS = {"movies": 1000, "concurrency": 4, "requests": 100,
+            "with_cache": False, "python": "3.11.7"}
+
+
+def result(rps: float, p95_ms: float, errors: int = 0) -> dict:
+    """Builds a route result with the fields the comparison reads"""
+    return {"requests": 100, "errors": errors, "rps": rps,
+            "p50_ms": 1.0, "p95_ms": p95_ms, "p99_ms": p95_ms}
+
+
+def test_percentile_uses_nearest_rank():
+    """Test's that percentiles pick an observed latency"""
+    latencies = [float(value) for value in range(1, 101)]
+
+    assert percentile(latencies, 50) == 50.0
+    assert percentile(latencies, 99) == 99.0
+    assert percentile([], 99) == 0.0
+
+
+def test_compare_to_baseline_within_tolerance():
+    """Test's that small changes are not reported as regressions"""
+    baseline = {"settings": SETTINGS, "results": {"GET /": result(100, 10)}}
+
+    assert compare_to_baseline({"GET /": result(90, 11)}, SETTINGS, baseline, 0.2) == []
+
+
+def test_compare_to_baseline_reports_regressions():
+    """Test's that slower routes, lost throughput and failures are all reported"""
+    baseline = {"settings": SETTINGS, "results": {"GET /": result(100, 10)}}
+
+    regressions = compare_to_baseline({"GET /": result(50, 20, errors=3)},
+                                      SETTINGS, baseline, 0.2)
+
+    assert len(regressions) == 3
+
+
+def test_compare_to_baseline_rejects_different_settings():
+    """Test's that runs with different settings are never compared"""
+    baseline = {"settings": dict(SETTINGS, concurrency=8), "results": {}}
+
+    assert compare_to_baseline({}, SETTINGS, baseline, 0.2)
+
+
+def test_existing_databases_are_only_written_to_on_request():
+    """Test's that write routes run against a provisioned database but need --include-writes with --dsn"""
+    dsn = "dbname=staging"
+
+    assert get_scenarios(None, False, False) == READ_SCENARIOS + WRITE_SCENARIOS
+    assert get_scenarios(None, True, False) == READ_SCENARIOS
+    assert get_scenarios(dsn, False, False) == READ_SCENARIOS
+    assert get_scenarios(dsn, False, True) == READ_SCENARIOS + WRITE_SCENARIOS
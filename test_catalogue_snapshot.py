@@ -0,0 +1,186 @@
+from unittest.mock import MagicMock, patch
+import pytest
+from catalogue_snapshot import (SORT_KEYS, Catalogue, CatalogueSnapshot, MovieRecord,
+                                place_records, str_value)
+from connection_pool import pin_to_primary
+from database_functions import MOVIE_COLUMNS
+
+
+def make_movie(movie_id: int, title: str, score: float, country_id: int, genre_ids: list) -> dict:
+    """Creates a movie row with every column set"""
+    movie = dict.fromkeys(MOVIE_COLUMNS)
+    movie.update({"movie_id": movie_id, "title": title, "score": score,
+                  "country_id": country_id, "genre_ids": genre_ids})
+    return movie
+
+
+MOVIES = [make_movie(1, "Drive", 78.0, 2, [7]),
+          make_movie(2, "Alien", 85.0, 4, [16, 7]),
+          make_movie(3, "Cars", 70.0, 2, [16]),
+          make_movie(4, "Brazil", 78.0, 2, [])]
+
+
+def get_orders(movies: list[dict]) -> dict:
+    """Sorts the movie ids the way the orders query does, ties broken by movie_id"""
+    return {key: [movie["movie_id"] for movie in
+                  sorted(movies, key=lambda movie: (movie[key] or 0, movie["movie_id"]))]
+            for key in SORT_KEYS}
+
+
+def placement_rows(movies: list[dict], movie_ids: set) -> list[dict]:
+    """Builds the rows PLACEMENT_QUERY returns for the given movies of the catalogue"""
+    rows = [dict(movie) for movie in movies if movie["movie_id"] in movie_ids]
+    for key in SORT_KEYS:
+        ordered = sorted(movies, key=lambda movie: (movie[key] or 0, movie["movie_id"]))
+        for row in rows:
+            index = [movie["movie_id"] for movie in ordered].index(row["movie_id"])
+            before = ordered[index - 1] if index else None
+            row[f"after_{key}"] = (None if before is None else
+                                   [str(before["movie_id"]), str_value(before[key])])
+        for place, row in enumerate(sorted(rows, key=lambda row: (row[key] or 0,
+                                                                  row["movie_id"]))):
+            row[f"place_{key}"] = place + 1
+    return rows
+
+
+@pytest.fixture
+def snapshot():
+    """Creates an enabled snapshot already holding MOVIES"""
+    snapshot = CatalogueSnapshot(enabled=True)
+    snapshot._thread = MagicMock()
+    snapshot._catalogue = Catalogue({movie["movie_id"]: MovieRecord(movie) for movie in MOVIES},
+                                    get_orders(MOVIES))
+    pin_to_primary(False)
+    with patch("catalogue_snapshot.add_genre_names", side_effect=lambda row: row):
+        yield snapshot
+
+
+def test_movies_follow_sort_order(snapshot):
+    """Test's that listings come back in the database's order for each sort"""
+    by_id = snapshot.get_movies()
+    by_score = snapshot.get_movies(sort_by="score", sort_order="desc", fields=["title"])
+
+    assert [movie["movie_id"] for movie in by_id] == [1, 2, 3, 4]
+    assert by_score == [{"title": "Alien"}, {"title": "Brazil"},
+                        {"title": "Drive"}, {"title": "Cars"}]
+
+
+def test_only_pages_add_cursor_columns(snapshot):
+    """Test's that unpaged rows hold just the fields, as the SQL select list does"""
+    streamed = list(snapshot.iter_movies(sort_by="score", fields=["title"]))
+    page = snapshot.get_movies(sort_by="score", limit=1, fields=["title"])
+
+    assert streamed[0] == {"title": "Cars"}
+    assert page[0] == {"title": "Cars", "movie_id": 3, "score": 70.0}
+
+
+def test_refresh_drops_cached_responses(snapshot):
+    """Test's that responses cached from the old snapshot are dropped once it is refreshed"""
+    curs = MagicMock()
+    curs.fetchall.return_value = placement_rows(MOVIES, {1})
+
+    with patch("catalogue_snapshot.get_connection"), \
+            patch("catalogue_snapshot.get_cursor", return_value=curs), \
+            patch("catalogue_snapshot.response_cache") as mock_response_cache:
+        snapshot.refresh({1})
+
+    mock_response_cache.invalidate.assert_called_once()
+
+
+def test_cursor_continues_after_last_movie(snapshot):
+    """Test's that a cursor seeks past the movie it was made from, including ties"""
+    page = snapshot.get_movies(sort_by="score", limit=1, fields=["title"],
+                               cursor={"movie_id": 1, "value": 78.0})
+
+    assert [movie["title"] for movie in page] == ["Brazil", "Alien"]
+
+
+def test_country_and_genre_listings(snapshot):
+    """Test's that country and genre listings only hold their own movies"""
+    page = snapshot.get_movies(sort_by="title", country_id=2, fields=["title"])
+
+    assert [movie["title"] for movie in page] == ["Brazil", "Cars", "Drive"]
+    with patch("catalogue_snapshot.reference_cache") as mock_cache:
+        mock_cache.get_name.return_value = "Action"
+        assert snapshot.get_movies_by_genre(16) == [{"title": "Alien", "genre_name": "Action"},
+                                                    {"title": "Cars", "genre_name": "Action"}]
+
+
+@pytest.mark.parametrize("kwargs", [{"search": "alien"},
+                                    {"filters": {"min_score": 80}},
+                                    {"sort_by": "relevance"},
+                                    {"sort_by": "score", "cursor": {"movie_id": 1, "value": 50.0}}])
+def test_unanswerable_listings_fall_back(snapshot, kwargs):
+    """Test's that searches, filters and stale cursors are left to SQL"""
+    assert snapshot.get_movies(**kwargs) is None
+
+
+def test_pinned_and_disabled_reads_fall_back(snapshot):
+    """Test's that clients reading their own writes and a disabled snapshot use SQL"""
+    pin_to_primary(True)
+    assert snapshot.get_movies() is None
+    pin_to_primary(False)
+
+    snapshot.enabled = False
+    assert snapshot.get_movies_by_genre(7) is None
+
+
+def test_refresh_places_only_changed_movies(snapshot):
+    """Test's that a refresh re-reads the notified movies, drops deleted ones and sorts
+    the rest exactly as a full reload would, without reading the whole sort orders"""
+    changed = make_movie(3, "Cars 2", 90.0, 4, [16])
+    new = make_movie(5, "Up", 83.0, 2, [16])
+    current = [MOVIES[0], MOVIES[1], changed, new]
+    curs = MagicMock()
+    curs.fetchall.return_value = placement_rows(current, {3, 4, 5})
+
+    with patch("catalogue_snapshot.get_connection"), \
+            patch("catalogue_snapshot.get_cursor", return_value=curs):
+        snapshot.refresh({3, 4, 5})
+
+    assert curs.execute.call_args.args[1] == ([3, 4, 5],)
+    assert curs.fetchone.call_count == 0
+    reloaded = Catalogue({movie["movie_id"]: MovieRecord(movie) for movie in current},
+                         get_orders(current))
+    catalogue = snapshot._catalogue
+    for key in [None, *SORT_KEYS]:
+        assert ([record.movie_id for record in catalogue.orders[key]] ==
+                [record.movie_id for record in reloaded.orders[key]])
+    assert [movie["title"] for movie in snapshot.get_movies(sort_by="score", country_id=2)] == \
+        ["Drive", "Up"]
+    assert [movie["title"] for movie in snapshot.get_movies_by_genre(16)] == \
+        ["Alien", "Cars 2", "Up"]
+    assert snapshot.stats()["movies"] == 4
+
+
+def test_refresh_reads_neighbours_written_since():
+    """Test's that a movie is never placed after one whose snapshot position is out of date"""
+    snapshot = CatalogueSnapshot(enabled=True)
+    snapshot._catalogue = Catalogue({movie["movie_id"]: MovieRecord(movie) for movie in MOVIES},
+                                    get_orders(MOVIES))
+    # Alien was re-scored after the notification for Cars was sent
+    current = [MOVIES[0], make_movie(2, "Alien", 60.0, 4, [16, 7]), *MOVIES[2:]]
+    curs = MagicMock()
+    curs.fetchall.side_effect = lambda: placement_rows(current, set(curs.execute.call_args.args[1][0]))
+
+    with patch("catalogue_snapshot.get_connection"), \
+            patch("catalogue_snapshot.get_cursor", return_value=curs):
+        snapshot.refresh({3})
+
+    assert curs.execute.call_args.args[1] == ([2, 3],)
+    assert ([record.movie_id for record in snapshot._catalogue.orders["score"]] ==
+            get_orders(current)["score"])
+
+
+def test_place_records_renumbers_a_used_up_gap():
+    """Test's that many movies placed at one spot keep their order once ranks run out"""
+    records = {movie_id: MovieRecord(make_movie(movie_id, "", 0.0, 2, []))
+               for movie_id in range(1, 201)}
+    order, ranks = [records[1], records[2]], {1: 0.0, 2: 1.0}
+
+    for movie_id in range(3, 201):
+        after_id = movie_id - 1 if movie_id > 3 else 1
+        order, ranks = place_records(order, ranks, [], [(records[movie_id], after_id)])
+
+    assert [record.movie_id for record in order] == [1, *range(3, 201), 2]
+    assert sorted(order, key=lambda record: ranks[record.movie_id]) == order
@@ -0,0 +1,151 @@
+from unittest.mock import MagicMock, patch
+import psycopg2
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+from connection_pool import (ConnectionPool, PoolTimeoutError, ReplicaRouter,
+                             get_connection, pin_to_primary)
+
+
+def make_connection():
+    """Creates a fake psycopg2 connection"""
+    conn = MagicMock()
+    conn.closed = 0
+    conn.info.transaction_status = TRANSACTION_STATUS_IDLE
+    return conn
+
+
+@pytest.fixture
+def mock_connect():
+    """Patches psycopg2.connect to hand out fake connections"""
+    with patch("connection_pool.psycopg2.connect") as connect:
+        connect.side_effect = lambda dsn: make_connection()
+        yield connect
+
+
+def test_pool_opens_min_size_connections(mock_connect):
+    """Test's that the pool is pre-filled up to min_size"""
+    pool = ConnectionPool("dsn", min_size=2, max_size=4)
+
+    assert mock_connect.call_count == 2
+    assert pool.stats()["idle"] == 2
+
+
+def test_pool_reuses_returned_connections(mock_connect):
+    """Test's that a returned connection is handed out again"""
+    pool = ConnectionPool("dsn", min_size=0, max_size=2)
+
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert pool.stats()["in_use"] == 1
+
+    assert first is second
+    assert mock_connect.call_count == 1
+
+
+def test_pool_checkout_timeout(mock_connect):
+    """Test's that checkout fails once max_size connections are in use"""
+    pool = ConnectionPool("dsn", min_size=0, max_size=1, timeout=0.05)
+    pool.getconn()
+
+    with pytest.raises(PoolTimeoutError):
+        pool.getconn()
+
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_pool_rolls_back_on_return(mock_connect):
+    """Test's that an open transaction is rolled back when the connection returns"""
+    pool = ConnectionPool("dsn", min_size=0, max_size=1)
+
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            conn.info.transaction_status = TRANSACTION_STATUS_INTRANS
+            raise RuntimeError("query failed")
+
+    conn.rollback.assert_called_once()
+    assert pool.stats()["idle"] == 1
+
+
+def test_pool_discards_closed_connections(mock_connect):
+    """Test's that broken connections are replaced rather than reused"""
+    pool = ConnectionPool("dsn", min_size=1, max_size=1)
+    conn = pool.getconn()
+    conn.closed = 1
+    pool.putconn(conn)
+
+    with pool.connection() as replacement:
+        assert replacement is not conn
+
+    assert pool.stats()["connections_discarded"] == 1
+
+
+def test_router_round_robins_healthy_replicas():
+    """Test's that reads rotate over replicas and skip ones that failed or lag"""
+    router = ReplicaRouter(3, max_lag=5.0)
+
+    assert [router.candidates()[0] for _ in range(3)] == [0, 1, 2]
+
+    router.mark_failed(1)
+    router.record_check(2, 30.0)
+
+    assert router.candidates() == [0]
+    assert router.stats()["failovers"] == 2
+
+
+def test_router_only_claims_due_checks():
+    """Test's that each replica is checked once per interval, however many callers ask"""
+    router = ReplicaRouter(2, check_interval=60.0)
+
+    assert router.due_checks() == [0, 1]
+    assert router.due_checks() == []
+
+
+@pytest.fixture
+def mock_replicas():
+    """Routes reads to one fake replica pool and writes to a fake primary pool"""
+    router = ReplicaRouter(1, check_interval=60.0)
+    router.due_checks()
+    replica, primary = MagicMock(), MagicMock()
+    pin_to_primary(False)
+    with patch("connection_pool.get_replicas", return_value=(router, [replica])), \
+            patch("connection_pool.get_pool", return_value=primary):
+        yield router, replica, primary
+    pin_to_primary(False)
+
+
+def test_reads_go_to_replicas_and_writes_to_primary(mock_replicas):
+    """Test's that only read_only connections are taken from a replica"""
+    router, replica, primary = mock_replicas
+
+    with get_connection(read_only=True) as conn:
+        assert conn is replica.getconn.return_value
+    with get_connection():
+        pass
+
+    replica.putconn.assert_called_once_with(replica.getconn.return_value)
+    primary.connection.assert_called_once()
+
+
+def test_reads_fail_over_to_primary(mock_replicas):
+    """Test's that an unreachable replica is skipped and the primary serves the read"""
+    router, replica, primary = mock_replicas
+    replica.getconn.side_effect = psycopg2.OperationalError
+
+    with get_connection(read_only=True):
+        pass
+
+    primary.connection.assert_called_once()
+    assert router.stats()["healthy"] == 0
+
+
+def test_pinned_reads_go_to_primary(mock_replicas):
+    """Test's that reads after a write in the same request see the primary"""
+    router, replica, primary = mock_replicas
+    pin_to_primary()
+
+    with get_connection(read_only=True):
+        pass
+
+    replica.getconn.assert_not_called()
+    assert router.stats()["primary_reads"] == 1
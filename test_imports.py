@@ -0,0 +1,200 @@
+import csv
+from unittest.mock import MagicMock, patch
+import psycopg2
+import pytest
+import imports
+from reference_cache import ReferenceCache
+
+TABLES = {
+    "genre": [(1, "Drama"), (16, "Action")],
+    "language": [(1, "English")],
+    "country": [(2, "US")]
+}
+
+
+def make_row(**overrides) -> dict:
+    """Builds a csv row as read by read_movies"""
+    row = {"names": "Heat", "date_x": "12/15/1995 ", "score": "82", "genre": "Action, Drama, Action",
+           "overview": "A heist.", "orig_title": "Heat", "orig_lang": " English",
+           "budget_x": "60000000.0", "revenue": "187436818.0", "country": "US"}
+    row.update(overrides)
+    return row
+
+
+@pytest.fixture(autouse=True)
+def mock_reference_cache():
+    """Serves the lookups from a fixed set of reference tables"""
+    cache = ReferenceCache()
+    cache.load(TABLES)
+    with patch("imports.reference_cache", cache):
+        yield cache
+
+
+def test_parse_movie_row_cleans_values():
+    """Test's that a row is cleaned into column values with distinct genre ids"""
+    movie, genre_ids = imports.parse_movie_row(make_row())
+
+    assert movie[1].isoformat() == "1995-12-15"
+    assert movie[5] == 1
+    assert movie[8] == 2
+    assert genre_ids == [16, 1]
+
+
+def test_keyed_movies_numbers_repeats():
+    """Test's that repeated title, date and country combinations get ordinal keys"""
+    rows = [make_row(), make_row(overview="Remastered."), make_row(names="Ronin")]
+
+    keys = [key for key, *_ in imports.keyed_movies(rows)]
+
+    assert keys == ["Heat|1995-12-15|2", "Heat|1995-12-15|2#2", "Ronin|1995-12-15|2"]
+
+
+@patch("imports.copy_rows")
+def test_stage_movies_leaves_numbering_to_sql(mock_copy_rows):
+    """Test's that staged rows carry their base key and file position instead of a numbered key"""
+    rows = [make_row(), make_row(overview="Remastered."), make_row(names="Ronin")]
+
+    staged = imports.stage_movies(None, rows, "movie_import", "genre_import", batch_size=2)
+
+    movie_rows = [row for call in mock_copy_rows.call_args_list
+                  if call.args[1] == "movie_import" for row in call.args[3]]
+    assert staged == 3
+    assert [row[:3] for row in movie_rows] == [(0, 1, "Heat|1995-12-15|2"),
+                                               (0, 2, "Heat|1995-12-15|2"),
+                                               (0, 3, "Ronin|1995-12-15|2")]
+    assert "row_number() OVER (PARTITION BY base_key" in imports.numbered_movies("movie_import")
+
+
+def test_keyed_movies_fingerprint_tracks_content():
+    """Test's that the fingerprint only changes when a movie's values change"""
+    first, again, changed = (next(imports.keyed_movies([row]))[1]
+                             for row in (make_row(), make_row(), make_row(score="83")))
+
+    assert first == again
+    assert first != changed
+
+
+def test_batched_groups_rows_lazily():
+    """Test's that batches are cut at the size without reading past them"""
+    rows = iter(range(5))
+
+    batches = imports.batched(rows, 2)
+
+    assert next(batches) == [0, 1]
+    assert next(rows) == 2
+    assert list(batches) == [[3, 4]]
+
+
+def test_keyed_movies_parses_in_workers_in_file_order():
+    """Test's that parsing in worker processes yields the same keys and rows in order"""
+    rows = [make_row(names=f"Movie {i % 7}", score=str(i)) for i in range(50)]
+
+    sequential = list(imports.keyed_movies(rows, batch_size=4))
+    parallel = list(imports.keyed_movies(iter(rows), batch_size=4, workers=2))
+
+    assert parallel == sequential
+    assert sequential[7][0] == "Movie 0|1995-12-15|2#2"
+
+
+def test_chunk_ranges_split_on_records(tmp_path):
+    """Test's that byte ranges never split a record, even one with quoted newlines"""
+    filename = tmp_path / "movies.csv"
+    rows = [make_row(names=f"Movie {i}", overview=f"Line one.\nLine {i}, with \"quotes\".")
+            for i in range(40)]
+    with open(filename, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    ranges = imports.chunk_ranges(str(filename), 3)
+    chunked = [row for start, end in ranges
+               for row in imports.read_range(str(filename), start, end)]
+
+    assert len(ranges) == 3
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+    assert chunked == list(imports.read_movies(str(filename)))
+
+
+def test_parallel_import_failure_is_not_hidden_by_cleanup():
+    """Test's that the error stopping a parallel import is raised even when dropping its tables fails"""
+    conn = MagicMock()
+    conn.rollback.side_effect = psycopg2.InterfaceError("connection already closed")
+
+    with patch("imports.get_connection") as mock_get_connection, \
+            patch("imports.get_cursor"), \
+            patch("imports.chunk_ranges", side_effect=FileNotFoundError("movies.csv")):
+        mock_get_connection.return_value.__enter__.return_value = conn
+        with pytest.raises(FileNotFoundError):
+            imports.parallel_import_movies_to_database("movies.csv", workers=2)
+
+
+def test_copy_rows_streams_csv():
+    """Test's that rows are written as csv and copied into the named columns"""
+    copied = []
+    curs = MagicMock()
+    curs.copy_expert.side_effect = lambda sql, buffer: copied.append((sql, buffer.read()))
+
+    imports.copy_rows(curs, "movie_import", ["title", "genre_ids"],
+                      [("Heat, the movie", imports.array_literal([16, 1])), ("Ronin", "{}")])
+
+    assert copied == [("COPY movie_import (title, genre_ids) FROM STDIN WITH (FORMAT csv)",
+                       '"Heat, the movie","{16,1}"\r\nRonin,{}\r\n')]
+
+
+@patch("database_functions.refresh_stats")
+@patch("imports.copy_rows")
+def test_bulk_import_loads_in_one_transaction(mock_copy_rows, mock_refresh_stats):
+    """Test's that the bulk loader stages every row, moves them into the tables with one commit
+    and then refreshes the statistics views"""
+    conn = MagicMock()
+    curs = MagicMock()
+    rows = [make_row(), make_row(names="Ronin", genre="Drama")]
+
+    with patch("imports.get_connection") as mock_get_connection, \
+            patch("imports.get_cursor", return_value=curs):
+        mock_get_connection.return_value.__enter__.return_value = conn
+        total = imports.bulk_import_movies_to_database(iter(rows))
+
+    statements = [call.args[0] for call in curs.execute.call_args_list]
+    genre_rows = [row for call in mock_copy_rows.call_args_list
+                  if call.args[1] == "genre_import" for row in call.args[3]]
+    assert total == 2
+    assert genre_rows == [(0, 1, 16), (0, 1, 1), (0, 2, 1)]
+    assert any("INSERT INTO movie(" in statement for statement in statements)
+    assert any("INSERT INTO movie_genres" in statement for statement in statements)
+    conn.commit.assert_called_once()
+    mock_refresh_stats.assert_called_once()
+
+
+@pytest.mark.parametrize("rowcount, refreshed", [(0, False), (1, True)])
+@patch("database_functions.refresh_stats")
+@patch("imports.copy_rows")
+def test_sync_refreshes_stats_only_after_changes(mock_copy_rows, mock_refresh_stats,
+                                                 rowcount, refreshed):
+    """Test's that a sync that wrote movies refreshes the statistics views and one that did not skips it"""
+    curs = MagicMock()
+    curs.rowcount = rowcount
+    curs.fetchone.return_value = {"inserted": 0}
+
+    with patch("imports.get_connection"), patch("imports.get_cursor", return_value=curs):
+        imports.sync_movies_to_database(iter([make_row()]))
+
+    assert mock_refresh_stats.called == refreshed
+
+
+@patch("database_functions.refresh_stats")
+@patch("imports.copy_rows")
+def test_sync_fills_in_missing_fingerprints_before_upserting(mock_copy_rows, mock_refresh_stats):
+    """Test's that a sync gives unchanged movies without a fingerprint the csv one before the upsert compares them"""
+    curs = MagicMock()
+    curs.rowcount = 0
+    curs.fetchone.return_value = {"inserted": 0}
+
+    with patch("imports.get_connection"), patch("imports.get_cursor", return_value=curs):
+        imports.sync_movies_to_database(iter([make_row()]))
+
+    statements = [call.args[0] for call in curs.execute.call_args_list]
+    backfill = next(i for i, sql in enumerate(statements) if "m.fingerprint IS NULL" in sql)
+    upsert = next(i for i, sql in enumerate(statements) if "INSERT INTO movie(" in sql)
+    assert backfill < upsert
+    assert "IS NOT DISTINCT FROM" in statements[backfill]
@@ -0,0 +1,56 @@
+import json
+from datetime import date
+from decimal import Decimal
+from json_encoding import FragmentCache, dumps
+
+MOVIE = {"movie_id": 7, "title": "Drive", "release_date": date(2011, 9, 16), "score": 78.0,
+         "version": 1, "genre_ids": [16], "genres": ["Action"]}
+
+
+def test_dumps_matches_flask_format():
+    """Test's that keys are sorted and dates and decimals are encoded as Flask does"""
+    encoded = dumps({"score": Decimal("7.5"), "movie_id": 1, "release_date": date(2020, 1, 2)})
+
+    assert encoded == b'{"movie_id":1,"release_date":"Thu, 02 Jan 2020 00:00:00 GMT","score":"7.5"}'
+
+
+def test_fragment_is_reused_until_version_changes():
+    """Test's that a movie is only encoded again once its version changes"""
+    cache = FragmentCache()
+
+    first = cache.encode(dict(MOVIE))
+    assert cache.encode(dict(MOVIE)) is first
+    updated = cache.encode({**MOVIE, "title": "Drive 2", "version": 2})
+
+    assert json.loads(updated)["title"] == "Drive 2"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_fragments_are_keyed_by_columns_and_genre_names():
+    """Test's that other field selections and renamed genres are not served a stale fragment"""
+    cache = FragmentCache()
+    cache.encode(dict(MOVIE))
+
+    assert json.loads(cache.encode({"movie_id": 7, "version": 1})) == {"movie_id": 7, "version": 1}
+    assert json.loads(cache.encode({**MOVIE, "genres": ["Adventure"]}))["genres"] == ["Adventure"]
+
+
+def test_rows_with_other_columns_are_not_cached():
+    """Test's that search rows, whose relevance varies per query, are always encoded"""
+    cache = FragmentCache()
+
+    cache.encode({**MOVIE, "relevance": 0.5})
+    second = cache.encode({**MOVIE, "relevance": 0.9})
+
+    assert json.loads(second)["relevance"] == 0.9
+    assert cache.stats()["entries"] == 0
+
+
+def test_encode_list_joins_fragments():
+    """Test's that a list of rows encodes to the same JSON as the rows themselves"""
+    cache = FragmentCache(max_entries=1)
+    rows = [dict(MOVIE), {**MOVIE, "movie_id": 8}, {"title": "No version"}]
+
+    assert json.loads(cache.encode_list(rows)) == json.loads(dumps(rows))
+    assert cache.stats()["entries"] == 1
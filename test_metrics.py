@@ -0,0 +1,61 @@
+from metrics import Counter, Histogram, current_query, instrumented, render_metrics
+from api import app
+
+
+def test_histogram_buckets_are_cumulative():
+    """Test's that each bucket counts every observation at or below its bound"""
+    histogram = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    for value in [0.05, 0.5, 0.5, 5.0]:
+        histogram.observe(("/movies",), value)
+
+    lines = histogram.render()
+
+    assert 'latency_seconds_bucket{route="/movies",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/movies",le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{route="/movies",le="+Inf"} 4' in lines
+    assert 'latency_seconds_count{route="/movies"} 4' in lines
+
+
+def test_counter_escapes_label_values():
+    """Test's that quotes in label values cannot break the exposition format"""
+    counter = Counter("requests_total", "Requests", ("route",))
+    counter.inc(('/say "hi"',), 2)
+
+    assert 'requests_total{route="/say \\"hi\\""} 2' in counter.render()
+
+
+def test_instrumented_labels_queries_while_running():
+    """Test's that queries are labelled with the database function running them"""
+    @instrumented
+    def get_things():
+        return current_query.get()
+
+    assert get_things() == "get_things"
+    assert current_query.get() == "unlabelled"
+
+
+def test_instrumented_labels_streamed_queries_when_iterated():
+    """Test's that a streamed result is labelled while it is being consumed"""
+    @instrumented
+    def iter_things():
+        yield current_query.get()
+
+    assert list(iter_things()) == ["iter_things"]
+
+
+def test_render_metrics_includes_gauges():
+    """Test's that snapshot gauges are rendered alongside the metrics"""
+    body = render_metrics({"movies_db_pool": ("Pool", {"in_use": 3})})
+
+    assert "# TYPE movies_db_pool_in_use gauge\nmovies_db_pool_in_use 3" in body
+
+
+def test_metrics_route_counts_requests():
+    """Test's that handled requests show up on the metrics route by route template"""
+    with app.test_client() as client:
+        client.get("/")
+        response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert 'movies_http_requests_total{method="GET",route="/",status="200"}' in response.text
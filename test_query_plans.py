@@ -0,0 +1,102 @@
+"""Checks every endpoint query can be answered without a sequential scan of movie.
+
+These tests run EXPLAIN against a real database and are skipped when one is not
+reachable. Sequential scans are disabled while planning, so the planner only
+falls back to one when no index can serve the query.
+"""
+
+import psycopg2
+import pytest
+from connection_pool import get_connection
+from database_functions import (movies_query, movies_by_country_query,
+                                movies_by_genre_query, DEFAULT_PAGE_SIZE)
+
+SORT_KEYS = [None, "title", "release_date", "revenue", "budget", "score"]
+CURSOR_VALUES = {None: None, "title": "M", "release_date": "2000-01-01",
+                 "revenue": 1.0, "budget": 1.0, "score": 50.0}
+
+
+def get_plan(query: str, params: list) -> dict:
+    """Plans a query with sequential scans disabled"""
+    with get_connection() as conn:
+        curs = conn.cursor()
+        curs.execute("SET LOCAL enable_seqscan = off;")
+        curs.execute("EXPLAIN (FORMAT JSON) " + query, tuple(params) or None)
+        plan = curs.fetchone()[0][0]["Plan"]
+        curs.close()
+    return plan
+
+
+def seq_scanned_relations(plan: dict) -> list[str]:
+    """Gets every relation the plan reads with a sequential scan"""
+    relations = []
+    if plan["Node Type"] == "Seq Scan":
+        relations.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        relations.extend(seq_scanned_relations(child))
+    return relations
+
+
+@pytest.fixture(scope="module", autouse=True)
+def database():
+    """Skips these tests when there is no database to plan against"""
+    try:
+        with get_connection() as conn:
+            conn.cursor().execute("SELECT 1;")
+    except psycopg2.OperationalError:
+        pytest.skip("No database available for query plan checks")
+
+
+def keyset_cases():
+    """Every sort key and order, on the first page and a later page"""
+    for sort_by in SORT_KEYS:
+        for sort_order in ["asc", "desc"]:
+            for cursor in [None, {"value": CURSOR_VALUES[sort_by], "movie_id": 100}]:
+                yield sort_by, sort_order, cursor
+
+
+@pytest.mark.parametrize("sort_by, sort_order, cursor", list(keyset_cases()))
+def test_get_movies_uses_index(sort_by, sort_order, cursor):
+    """Test's that GET /movies pages are index range scans"""
+    plan = get_plan(*movies_query(None, sort_by, sort_order,
+                                  DEFAULT_PAGE_SIZE, cursor))
+
+    assert "movie" not in seq_scanned_relations(plan)
+
+
+def test_search_movies_uses_index():
+    """Test's that searches are served by the full text and trigram indexes"""
+    plan = get_plan(*movies_query("space", None, None, DEFAULT_PAGE_SIZE))
+
+    assert "movie" not in seq_scanned_relations(plan)
+
+
+@pytest.mark.parametrize("filters", [
+    {"min_score": 70.0, "max_score": 90.0},
+    {"min_budget": 1000000.0, "max_revenue": 50000000.0},
+    {"min_release_date": "2010-01-01", "max_release_date": "2020-12-31"},
+    {"country": [2, 4], "language": 1},
+    {"genre": [16, 14], "min_score": 70.0}
+])
+def test_filtered_movies_use_index(filters):
+    """Test's that GET /movies filters are pushed down to index scans"""
+    plan = get_plan(*movies_query(None, "score", "desc", DEFAULT_PAGE_SIZE,
+                                  filters=filters))
+
+    assert "movie" not in seq_scanned_relations(plan)
+
+
+@pytest.mark.parametrize("sort_by, sort_order, cursor", list(keyset_cases()))
+def test_get_movies_by_country_uses_index(sort_by, sort_order, cursor):
+    """Test's that GET /countries/<code> pages are index range scans"""
+    plan = get_plan(*movies_by_country_query(2, sort_by, sort_order,
+                                             DEFAULT_PAGE_SIZE, cursor))
+
+    assert "movie" not in seq_scanned_relations(plan)
+
+
+def test_get_movies_by_genre_uses_index():
+    """Test's that GET /genres/<id>/movies joins through indexes"""
+    plan = get_plan(*movies_by_genre_query(16))
+
+    assert "movie" not in seq_scanned_relations(plan)
@@ -0,0 +1,70 @@
+from unittest.mock import patch
+import pytest
+from recommendations import SimilarityIndex, SimilarityModel, tokenize
+
+
+def make_movie(movie_id: int, overview: str, genre_ids: list, orig_lang: int = 1,
+               country_id: int = 2) -> dict:
+    """Creates a row with the columns the index reads"""
+    return {"movie_id": movie_id, "overview": overview, "genre_ids": genre_ids,
+            "orig_lang": orig_lang, "country_id": country_id}
+
+
+MOVIES = [make_movie(1, "A boxer trains for the fight of his life", [7, 16]),
+          make_movie(2, "An aging boxer returns to the ring for one last fight", [7]),
+          make_movie(3, "A shark attacks swimmers at a beach town", [27]),
+          make_movie(4, "Giant shark hunts divers in the deep ocean", [27, 16], 2, 4),
+          make_movie(5, "A detective chases a killer through the city", [80])]
+
+
+@pytest.fixture
+def model():
+    """Builds a model over MOVIES"""
+    return SimilarityModel(MOVIES)
+
+
+def test_tokenize_drops_stop_words():
+    """Test's that text is lower cased and split without stop words"""
+    assert tokenize("The Shark, and a BEACH!") == ["shark", "beach"]
+
+
+def test_similar_ranks_by_overview_and_genres(model):
+    """Test's that movies sharing words and genres rank first, ties by id, without the movie itself"""
+    similar = model.similar(1, 4)
+
+    assert [movie_id for movie_id, _ in similar] == [2, 3, 5, 4]
+    assert similar[0][1] > similar[1][1] == similar[2][1] > similar[3][1]
+    assert model.similar(99, 3) is None
+
+
+def test_scores_weight_language_and_country(model):
+    """Test's that only language and country set two otherwise unrelated movies apart"""
+    scores = dict(model.similar(5, 4))
+
+    assert scores[3] == pytest.approx(0.15)
+    assert scores[4] == pytest.approx(0.0)
+
+
+def test_changes_apply_without_rebuilding(model):
+    """Test's that updated, added and deleted movies are reflected straight away"""
+    model.apply([make_movie(3, "A boxer fights a shark", [7]),
+                 make_movie(6, "A young boxer trains for the fight", [7, 16])], [2])
+
+    assert [movie_id for movie_id, _ in model.similar(1, 2)] == [6, 3]
+    assert model.similar(2, 2) is None
+    assert 1 in dict(model.similar(6, 4))
+
+
+def test_index_replays_writes_made_during_a_rebuild():
+    """Test's that a write landing while the catalogue is read is not lost on swap"""
+    index = SimilarityIndex()
+
+    def load_movies():
+        index.update([make_movie(6, "A boxer trains", [7])])
+        return MOVIES
+
+    with patch.object(index, "load_movies", side_effect=load_movies):
+        index.build()
+
+    assert 6 in dict(index.similar(1, 5))
+    assert index.stats()["changes"] == 1
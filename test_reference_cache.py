@@ -0,0 +1,59 @@
+from unittest.mock import patch
+import pytest
+from reference_cache import ReferenceCache
+
+TABLES = {
+    "genre": [(1, "Fantasy"), (16, "Action")],
+    "language": [(1, "English"), (2, "Spanish")],
+    "country": [(2, "US"), (4, "GB")]
+}
+
+
+@pytest.fixture
+def mock_fetch_tables():
+    """Patches the database read behind the cache"""
+    with patch.object(ReferenceCache, "_fetch_tables") as fetch_tables:
+        fetch_tables.return_value = TABLES
+        yield fetch_tables
+
+
+def test_lookups_are_served_from_one_load(mock_fetch_tables):
+    """Test's that repeated lookups only read the database once"""
+    cache = ReferenceCache()
+
+    assert cache.get_key("country", "us") == 2
+    assert cache.get_key("genre", "Action") == 16
+    assert cache.get_name("language", 2) == "Spanish"
+    assert cache.get_names("genre") == ["Fantasy", "Action"]
+    assert cache.get_key("country", "ZZ") is None
+    mock_fetch_tables.assert_called_once()
+
+
+def test_invalidate_reloads_tables(mock_fetch_tables):
+    """Test's that an invalidated cache reloads on the next lookup"""
+    cache = ReferenceCache()
+    cache.get_key("genre", "Fantasy")
+
+    cache.invalidate()
+    cache.get_key("genre", "Fantasy")
+
+    assert mock_fetch_tables.call_count == 2
+
+
+def test_expired_cache_keeps_stale_copy_on_error(mock_fetch_tables):
+    """Test's that the stale tables are served when a ttl reload fails"""
+    cache = ReferenceCache(ttl=0)
+    cache.get_key("genre", "Fantasy")
+    mock_fetch_tables.side_effect = RuntimeError("database unavailable")
+
+    assert cache.get_key("genre", "Fantasy") == 1
+
+
+def test_dump_round_trips_through_load(mock_fetch_tables):
+    """Test's that a dumped copy loads into another cache without reading the database"""
+    copy = ReferenceCache()
+    copy.load(ReferenceCache().dump())
+
+    assert copy.get_key("genre", "fantasy") == 1
+    assert copy.get_name("country", 4) == "GB"
+    mock_fetch_tables.assert_called_once()
@@ -0,0 +1,32 @@
+from response_cache import ResponseCache, CachedResponse
+
+
+def test_least_recently_used_entry_is_evicted():
+    """Test's that the cache holds at most max_entries responses"""
+    cache = ResponseCache(max_entries=2)
+    cache.set(("/a",), CachedResponse(b"a", "application/json"))
+    cache.set(("/b",), CachedResponse(b"b", "application/json"))
+    cache.get(("/a",))
+    cache.set(("/c",), CachedResponse(b"c", "application/json"))
+
+    assert cache.get(("/a",)).body == b"a"
+    assert cache.get(("/b",)) is None
+    assert cache.get(("/c",)).body == b"c"
+
+
+def test_expired_entries_are_not_served():
+    """Test's that entries older than the ttl are dropped"""
+    cache = ResponseCache(ttl=0)
+    cache.set(("/a",), CachedResponse(b"a", "application/json"))
+
+    assert cache.get(("/a",)) is None
+
+
+def test_responses_rendered_before_a_write_are_not_stored():
+    """Test's that an invalidation during rendering discards the stale response"""
+    cache = ResponseCache()
+    generation = cache.generation
+    cache.invalidate()
+    cache.set(("/a",), CachedResponse(b"a", "application/json"), generation)
+
+    assert cache.get(("/a",)) is None
@@ -0,0 +1,40 @@
+import gzip
+from unittest.mock import MagicMock, patch
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+from response_compression import choose_encoding, compress, compress_chunks
+
+
+def accept(header: str) -> Accept:
+    """Parses an Accept-Encoding header"""
+    return parse_accept_header(header, Accept)
+
+
+@patch('response_compression.ENCODINGS', ["zstd", "br", "gzip"])
+def test_choose_encoding_follows_client_preference():
+    """Test's that quality values win, with ties going to the better compressor"""
+    assert choose_encoding(accept("gzip, deflate, br, zstd")) == "zstd"
+    assert choose_encoding(accept("br;q=0.5, gzip")) == "gzip"
+    assert choose_encoding(accept("identity")) is None
+    assert choose_encoding(accept("")) is None
+
+
+def test_compress_chunks_matches_whole_body():
+    """Test's that a streamed body decompresses to the same bytes as compressing it whole"""
+    chunks = [b"[", '{"title":"Drive"}', b"]"]
+
+    streamed = b"".join(compress_chunks(iter(chunks), "gzip"))
+
+    assert gzip.decompress(streamed) == gzip.decompress(compress(b'[{"title":"Drive"}]', "gzip"))
+
+
+def test_compress_chunks_closes_source():
+    """Test's that the source stream is closed when the client goes away early"""
+    source = MagicMock()
+    source.__iter__.return_value = iter([b"x" * 100000, b"y"])
+
+    chunks = compress_chunks(source, "gzip")
+    next(chunks)
+    chunks.close()
+
+    source.close.assert_called_once()